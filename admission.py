@@ -0,0 +1,253 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from config import Config
+from metrics import REGISTRY, Counter, GaugeFunction
+
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "clarifier_admission_rejected_total", "被准入控制拒绝的上游调用，reason 为 queue_full / timeout", ("reason",)))
+ADMISSION_WAIT = REGISTRY.register(Counter(
+    "clarifier_admission_wait_seconds_total", "上游调用在准入队列中等待的总时长"))
+
+
+class UpstreamOverloaded(Exception):
+    """上游已满载：等待队列已满或排队超过期限，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, retry_after: int, message: str = "上游服务繁忙，请稍后重试"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """等待队列中的一个请求；同步调用方用 Event 唤醒，异步调用方通过所属事件循环唤醒"""
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop=None):
+        self.event = None if loop is not None else threading.Event()
+        self.loop = loop
+        self.future = None
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        elif self.future is not None:
+            self.loop.call_soon_threadsafe(self._resolve, self.future)
+
+    @staticmethod
+    def _resolve(future):
+        if not future.done():
+            future.set_result(None)
+
+
+class AdmissionController:
+    """所有链共享的上游准入控制：并发上限 + 令牌桶限速 + 有界 FIFO 等待队列
+
+    核心状态由一把线程锁保护，同步和异步调用方排在同一个队列里。
+    队列已满时立即拒绝；排队超过期限时放弃等待，两种情况都抛出 UpstreamOverloaded。
+    rate 为 0 时不限速。
+    """
+
+    def __init__(self, max_concurrency: int, rate: float = 0.0, burst: int = 1,
+                 max_queue: int = 256, queue_timeout: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._hold_time = 1.0  # 单次调用占用时长的滑动平均，用于估算 Retry-After
+
+    def acquire(self, timeout: float = None):
+        """同步获取一个上游调用名额"""
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        with self._lock:
+            waiter = self._enqueue_locked()
+            if waiter is None:
+                return
+
+        enqueued_at = time.monotonic()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._abandon(waiter, 'timeout')
+                    return
+                waiter.event.wait(min(remaining, self._refill_delay()))
+                with self._lock:
+                    if not waiter.granted:
+                        self._dispatch_locked()
+                    if waiter.granted:
+                        return
+                    waiter.event.clear()
+        finally:
+            ADMISSION_WAIT.inc(amount=time.monotonic() - enqueued_at)
+
+    async def aacquire(self, timeout: float = None):
+        """异步获取一个上游调用名额，等待期间不阻塞事件循环"""
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiter = self._enqueue_locked(loop)
+            if waiter is None:
+                return
+            waiter.future = loop.create_future()
+
+        enqueued_at = time.monotonic()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._abandon(waiter, 'timeout')
+                    return
+                await asyncio.wait({waiter.future}, timeout=min(remaining, self._refill_delay()))
+                with self._lock:
+                    if not waiter.granted:
+                        self._dispatch_locked()
+                    if waiter.granted:
+                        return
+                    waiter.future = loop.create_future()
+        except asyncio.CancelledError:
+            # 调用方被取消：仍在排队则出队，已经拿到名额则归还
+            with self._lock:
+                if waiter.granted:
+                    self._in_flight -= 1
+                    self._dispatch_locked()
+                else:
+                    self._remove_locked(waiter)
+            raise
+        finally:
+            ADMISSION_WAIT.inc(amount=time.monotonic() - enqueued_at)
+
+    def try_acquire(self):
+        """不排队地尝试获取名额，成功时返回 True；有请求在排队时总是失败"""
+        with self._lock:
+            return not self._waiters and self._try_take_locked()
+
+    def release(self, held: float = None):
+        """归还名额；held 为本次占用时长"""
+        with self._lock:
+            self._in_flight -= 1
+            if held is not None:
+                self._hold_time = 0.9 * self._hold_time + 0.1 * held
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, timeout: float = None):
+        self.acquire(timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self, timeout: float = None):
+        await self.aacquire(timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': self._in_flight, 'queued': len(self._waiters)}
+
+    def _enqueue_locked(self, loop=None):
+        """有空闲名额且无人排队时直接获得名额并返回 None，否则入队并返回等待者"""
+        if not self._waiters and self._try_take_locked():
+            return None
+        if len(self._waiters) >= self.max_queue:
+            ADMISSION_REJECTED.inc('queue_full')
+            raise UpstreamOverloaded(self._retry_after_locked())
+        waiter = _Waiter(loop)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _abandon(self, waiter: _Waiter, reason: str):
+        """排队超时：名额恰好在超时时到达则视为成功，否则出队并拒绝"""
+        with self._lock:
+            if waiter.granted:
+                return
+            self._remove_locked(waiter)
+            retry_after = self._retry_after_locked()
+        ADMISSION_REJECTED.inc(reason)
+        raise UpstreamOverloaded(retry_after)
+
+    def _remove_locked(self, waiter: _Waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _dispatch_locked(self):
+        """按先后顺序把空闲名额分配给排队的请求"""
+        while self._waiters and self._try_take_locked():
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.wake()
+
+    def _try_take_locked(self):
+        if self._in_flight >= self.max_concurrency:
+            return False
+        if self.rate > 0:
+            self._refill_locked()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        self._in_flight += 1
+        return True
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _refill_delay(self):
+        """下一个令牌到达前的等待时长；不限速时只依赖 release 唤醒，用较长的兜底间隔"""
+        if self.rate <= 0:
+            return 1.0
+        with self._lock:
+            self._refill_locked()
+            return max(0.001, (1 - self._tokens) / self.rate)
+
+    def _retry_after_locked(self):
+        """按当前队列长度估算排到新请求所需的时间，向上取整到秒"""
+        ahead = len(self._waiters) + 1
+        estimate = ahead * self._hold_time / self.max_concurrency
+        if self.rate > 0:
+            estimate = max(estimate, ahead / self.rate)
+        return max(1, math.ceil(estimate))
+
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """获取进程内共享的准入控制器，未启用时返回 None"""
+    global _admission_controller
+    if Config.UPSTREAM_MAX_CONCURRENCY <= 0:
+        return None
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController(
+                max_concurrency=min(Config.UPSTREAM_MAX_CONCURRENCY, Config.LLM_POOL_SIZE),
+                rate=Config.UPSTREAM_RATE_LIMIT,
+                burst=Config.UPSTREAM_BURST,
+                max_queue=Config.UPSTREAM_MAX_QUEUE,
+                queue_timeout=Config.UPSTREAM_QUEUE_TIMEOUT
+            )
+            controller = _admission_controller
+            REGISTRY.register(GaugeFunction(
+                "clarifier_admission", "上游准入控制状态，state 为 in_flight / queued",
+                lambda: {(state,): value for state, value in controller.stats().items()}, ("state",)))
+        return _admission_controller
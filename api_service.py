@@ -1,5 +1,15 @@
-from flask import Flask, request, jsonify
+import json
+import threading
+import time
+from flask import Flask, Response, request, jsonify, stream_with_context
 from clarifier_service import ClarifierService
+from session_store import ClarificationSession, ConversationTurn, create_session_store
+from traffic_capture import CaptureTimer, create_recorder
+from metrics import REGISTRY, GaugeFunction, SESSION_ROUNDS, SESSIONS_COMPLETED, render_metrics
+from response_cache import get_response_cache
+from event_log import elapsed_ms, event_log
+from admission import UpstreamOverloaded
+from hedging import DeadlineExceeded, request_deadline
 from config import Config
 import logging
 
@@ -12,151 +22,590 @@ app = Flask(__name__)
 class APIClarifierService:
     def __init__(self):
         self.clarifier = ClarifierService()
-        self.active_sessions = {}  # 存储活跃的对话会话
+        self.active_sessions = create_session_store()  # 存储活跃的对话会话
+        self.recorder = create_recorder()  # 开启流量录制时记录每个会话请求
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """注册抓取时取值的仪表：会话存储、响应缓存和本地预分类的统计"""
+        REGISTRY.register(GaugeFunction(
+            "clarifier_sessions", "会话存储统计，state 为 live / evicted / expired",
+            lambda: {(state,): value for state, value in self.active_sessions.stats().items()}, ("state",)))
+
+        cache = get_response_cache()
+        if cache is not None:
+            REGISTRY.register(GaugeFunction(
+                "clarifier_response_cache", "响应缓存统计，stat 为 hits / misses / sqlite_hits / warm_hits / size / warm_size / dropped_writes",
+                lambda: {(stat,): value for stat, value in cache.stats().items() if stat != 'hit_rate'}, ("stat",)))
+
+        pre_classifier = self.clarifier.pre_classifier
+        if pre_classifier is not None:
+            REGISTRY.register(GaugeFunction(
+                "clarifier_preclassifier_queries", "本地预分类统计，stat 为 total / short_circuited",
+                lambda: {(stat,): pre_classifier.stats()[stat] for stat in ('total', 'short_circuited')}, ("stat",)))
 
     def start_clarification(self, session_id: str, query: str):
         """开始澄清流程"""
-        print(f"\n=== API请求 - 会话ID: {session_id} ===")
-        print(f"用户问题: {query}")
-
-        # 初始化会话
-        self.active_sessions[session_id] = {
-            'original_query': query,
-            'conversation_history': [],
-            'current_round': 0,
-            'status': 'active'
-        }
+        timer = CaptureTimer(self.recorder, 'start', session_id, query)
+        session = self._init_session(session_id, query)
 
         # 第一轮分析
-        result = self._process_round(session_id, query)
-        return result
+        with request_deadline(Config.REQUEST_DEADLINE):
+            result = self._process_round(session, query)
+        return timer.finish(result)
+
+    async def astart_clarification(self, session_id: str, query: str):
+        """开始澄清流程（异步）"""
+        timer = CaptureTimer(self.recorder, 'start', session_id, query)
+        session = await self._ainit_session(session_id, query)
+        with request_deadline(Config.REQUEST_DEADLINE):
+            result = await self._aprocess_round(session, query)
+        return timer.finish(result)
 
     def continue_clarification(self, session_id: str, user_answer: str):
         """继续澄清流程"""
-        if session_id not in self.active_sessions:
-            return {
+        timer = CaptureTimer(self.recorder, 'continue', session_id, user_answer)
+        session, error = self._get_active_session(session_id)
+        if error:
+            return timer.finish(error)
+
+        # 处理下一轮
+        current_query = self._record_answer(session, user_answer)
+        with request_deadline(Config.REQUEST_DEADLINE):
+            result = self._process_round(session, current_query)
+
+        return timer.finish(result)
+
+    async def acontinue_clarification(self, session_id: str, user_answer: str):
+        """继续澄清流程（异步）"""
+        timer = CaptureTimer(self.recorder, 'continue', session_id, user_answer)
+        session, error = await self._aget_active_session(session_id)
+        if error:
+            return timer.finish(error)
+
+        current_query = self._record_answer(session, user_answer)
+        with request_deadline(Config.REQUEST_DEADLINE):
+            result = await self._aprocess_round(session, current_query)
+        return timer.finish(result)
+
+    def stream_start_clarification(self, session_id: str, query: str):
+        """开始澄清流程（流式），逐步产出 (事件名, 数据)"""
+        timer = CaptureTimer(self.recorder, 'start', session_id, query)
+        session = self._init_session(session_id, query)
+        for event, data in self._stream_round(session, query):
+            yield event, self._capture_event(timer, event, data)
+
+    async def astream_start_clarification(self, session_id: str, query: str):
+        """开始澄清流程（流式、异步）"""
+        timer = CaptureTimer(self.recorder, 'start', session_id, query)
+        session = await self._ainit_session(session_id, query)
+        async for event, data in self._astream_round(session, query):
+            yield event, self._capture_event(timer, event, data)
+
+    def stream_continue_clarification(self, session_id: str, user_answer: str):
+        """继续澄清流程（流式）"""
+        timer = CaptureTimer(self.recorder, 'continue', session_id, user_answer)
+        session, error = self._get_active_session(session_id)
+        if error:
+            yield 'error', timer.finish(error)
+            return
+
+        current_query = self._record_answer(session, user_answer)
+        for event, data in self._stream_round(session, current_query):
+            yield event, self._capture_event(timer, event, data)
+
+    async def astream_continue_clarification(self, session_id: str, user_answer: str):
+        """继续澄清流程（流式、异步）"""
+        timer = CaptureTimer(self.recorder, 'continue', session_id, user_answer)
+        session, error = await self._aget_active_session(session_id)
+        if error:
+            yield 'error', timer.finish(error)
+            return
+
+        current_query = self._record_answer(session, user_answer)
+        async for event, data in self._astream_round(session, current_query):
+            yield event, self._capture_event(timer, event, data)
+
+    def open_session(self, session_id: str, query: str):
+        """为长连接（WebSocket）创建会话，会话对象由连接持有"""
+        return self._init_session(session_id, query)
+
+    async def aopen_session(self, session_id: str, query: str):
+        """为长连接（WebSocket）创建会话（异步）"""
+        return await self._ainit_session(session_id, query)
+
+    async def astream_session_round(self, session: ClarificationSession, user_answer: str = None, stream: bool = True):
+        """在连接持有的会话上处理一轮（异步），不再按 session_id 查找会话；user_answer 为 None 时处理首轮
+
+        stream 为 True 时产出与 SSE 接口相同的事件，否则按非流式路径处理并只产出 result 事件。
+        """
+        if user_answer is None:
+            timer = CaptureTimer(self.recorder, 'start', session.session_id, session.original_query)
+            current_query = session.original_query
+        else:
+            timer = CaptureTimer(self.recorder, 'continue', session.session_id, user_answer)
+            if session.status != 'active':
+                yield 'error', timer.finish({'status': 'error', 'message': '会话已结束'})
+                return
+            current_query = self._record_answer(session, user_answer)
+
+        if not stream:
+            with request_deadline(Config.REQUEST_DEADLINE):
+                result = await self._aprocess_round(session, current_query)
+            yield 'result', timer.finish(result)
+            return
+
+        async for event, data in self._astream_round(session, current_query):
+            yield event, self._capture_event(timer, event, data)
+
+    def _capture_event(self, timer: CaptureTimer, event: str, data: dict):
+        """流式接口在发出最终结果时记录录制数据"""
+        if event == 'result':
+            timer.finish(data)
+        return data
+
+    def classify_batch(self, queries: list, max_concurrency: int = None):
+        """批量分类，不创建会话"""
+        results = self.clarifier.classify_batch(queries, max_concurrency)
+        return self._batch_response(results)
+
+    async def aclassify_batch(self, queries: list, max_concurrency: int = None):
+        """批量分类（异步）"""
+        results = await self.clarifier.aclassify_batch(queries, max_concurrency)
+        return self._batch_response(results)
+
+    def _batch_response(self, results: list):
+        failed = sum(1 for item in results if item['status'] == 'error')
+        return {
+            'status': 'completed',
+            'total': len(results),
+            'failed': failed,
+            'results': results
+        }
+
+    def _init_session(self, session_id: str, query: str):
+        """初始化会话"""
+        event_log.info('session_start', session_id=session_id, query=query)
+
+        session = ClarificationSession(session_id, query)
+        self.active_sessions.put(session)
+        return session
+
+    async def _ainit_session(self, session_id: str, query: str):
+        """初始化会话（异步）：会话后端的读写可能阻塞，不在事件循环上执行"""
+        event_log.info('session_start', session_id=session_id, query=query)
+
+        session = ClarificationSession(session_id, query)
+        await self.active_sessions.aput(session)
+        return session
+
+    def _get_active_session(self, session_id: str):
+        """获取可以继续的会话，不可继续时返回错误响应"""
+        return self._check_active(self.active_sessions.get(session_id))
+
+    async def _aget_active_session(self, session_id: str):
+        """获取可以继续的会话（异步）"""
+        return self._check_active(await self.active_sessions.aget(session_id))
+
+    def _check_active(self, session: ClarificationSession):
+        if session is None:
+            return None, {
                 'status': 'error',
                 'message': '会话不存在或已过期'
             }
 
-        session = self.active_sessions[session_id]
-        if session['status'] != 'active':
-            return {
+        if session.status != 'active':
+            return None, {
                 'status': 'error',
                 'message': '会话已结束'
             }
 
-        print(f"\n=== API请求 - 会话ID: {session_id} 继续 ===")
-        print(f"用户回答: {user_answer}")
+        return session, None
 
-        # 记录用户回答到最近的问题
-        if session['conversation_history']:
-            session['conversation_history'][-1]['user_answer'] = user_answer
+    def _record_answer(self, session: ClarificationSession, user_answer: str):
+        """记录用户回答并返回更新后的查询"""
+        event_log.info('session_answer', session_id=session.session_id, round=session.current_round,
+                       answer=user_answer)
 
-        # 处理下一轮
-        current_query = self._build_current_query(session)
-        result = self._process_round(session_id, current_query)
+        # 记录用户回答到最近的问题
+        if session.conversation_history:
+            session.conversation_history[-1].user_answer = user_answer
 
-        return result
+        return self._build_current_query(session)
 
-    def _process_round(self, session_id: str, current_query: str):
+    def _process_round(self, session: ClarificationSession, current_query: str):
         """处理单轮对话"""
-        session = self.active_sessions[session_id]
-        session['current_round'] += 1
+        started = self._begin_round(session)
 
-        print(f"\n--- 第 {session['current_round']} 轮分析 ---")
-
-        # 问题分类
-        classification_result = self.clarifier.classifier.invoke(current_query)
-        print(f"问题分类: {classification_result['classification']}")
-        print(f"原因: {classification_result['reason']}")
+        # 问题分类，需要继续追问时同时生成追问
+        classification_result, current_strategy, question = self.clarifier._run_round(
+            current_query, session.conversation_history, session.current_round
+        )
 
         # 如果问题已经清晰或达到最大轮数，结束追问
-        if (classification_result['classification'] == 'SIMPLE' or
-                session['current_round'] >= self.clarifier.max_rounds):
-
-            if classification_result['classification'] == 'SIMPLE':
-                print("✅ 问题已经足够清晰，无需继续追问。")
-            else:
-                print(f"⚠️ 已达到最大追问轮数({self.clarifier.max_rounds})，结束追问。")
-
-            # 生成最终结果
-            final_query = self._generate_final_result(session_id)
-            session['status'] = 'completed'
-
-            return {
-                'status': 'completed',
-                'final_query': final_query,
-                'session_id': session_id
-            }
+        if self._should_finish(session, classification_result):
+            final_query = self._generate_final_result(session)
+            return self._complete_session(session, final_query, classification_result, started)
+
+        return self._ask_question(session, current_strategy, question, classification_result, started)
+
+    async def _aprocess_round(self, session: ClarificationSession, current_query: str):
+        """处理单轮对话（异步）"""
+        started = self._begin_round(session)
 
-        # 确定策略并生成追问
-        current_strategy = self.clarifier._determine_strategy(
-            session['conversation_history'],
-            classification_result
+        classification_result, current_strategy, question = await self.clarifier._arun_round(
+            current_query, session.conversation_history, session.current_round
         )
-        print(f"📋 当前策略: {self.clarifier._get_strategy_description(current_strategy)}")
 
-        # 生成追问
-        print("正在生成追问...")
-        clarifying_question_result = self.clarifier.question_generator.invoke(
-            current_query,
-            f"{classification_result['reason']} | 当前需要: {self.clarifier._get_strategy_description(current_strategy)}"
+        if self._should_finish(session, classification_result):
+            final_query = await self._agenerate_final_result(session)
+            return await self._acomplete_session(session, final_query, classification_result, started)
+
+        return await self._aask_question(session, current_strategy, question, classification_result, started)
+
+    def _stream_round(self, session: ClarificationSession, current_query: str):
+        """流式处理单轮对话：先发出分类结果，再逐步发出追问或最终问题，最后发出与非流式接口相同的结果
+
+        流式接口始终按 sequential 模式先分类再生成追问。
+        """
+        started = self._begin_round(session)
+
+        classification_result = self.clarifier._classify(current_query, session.conversation_history)
+        yield 'classification', self._classification_event(session, classification_result)
+
+        if self._should_finish(session, classification_result):
+            final_query = session.final_query
+            if final_query is None:
+                final_started = time.perf_counter()
+                for final_query in self.clarifier._stream_comprehensive_final_query(
+                        session.original_query, session.conversation_history):
+                    yield 'delta', {'field': 'final_query', 'text': final_query}
+                self._finish_final_result(session, final_query, final_started)
+            yield 'result', self._complete_session(session, final_query, classification_result, started)
+            return
+
+        current_strategy = self.clarifier._determine_strategy(session.conversation_history, classification_result)
+        reason = self.clarifier._question_reason(classification_result['reason'], current_strategy)
+        question = None
+        for partial in self.clarifier.question_generator.stream(current_query, reason):
+            if partial.get('question') and partial['question'] != question:
+                question = partial['question']
+                yield 'delta', {'field': 'question', 'text': question}
+
+        yield 'result', self._ask_question(
+            session, current_strategy, self._require_question(question), classification_result, started
         )
-        question = clarifying_question_result['question']
 
-        print(f"追问: {question}")
+    async def _astream_round(self, session: ClarificationSession, current_query: str):
+        """流式处理单轮对话（异步）"""
+        started = self._begin_round(session)
+
+        classification_result = await self.clarifier._aclassify(current_query, session.conversation_history)
+        yield 'classification', self._classification_event(session, classification_result)
+
+        if self._should_finish(session, classification_result):
+            final_query = session.final_query
+            if final_query is None:
+                final_started = time.perf_counter()
+                async for final_query in self.clarifier._astream_comprehensive_final_query(
+                        session.original_query, session.conversation_history):
+                    yield 'delta', {'field': 'final_query', 'text': final_query}
+                self._finish_final_result(session, final_query, final_started)
+            yield 'result', await self._acomplete_session(session, final_query, classification_result, started)
+            return
+
+        current_strategy = self.clarifier._determine_strategy(session.conversation_history, classification_result)
+        reason = self.clarifier._question_reason(classification_result['reason'], current_strategy)
+        question = None
+        async for partial in self.clarifier.question_generator.astream(current_query, reason):
+            if partial.get('question') and partial['question'] != question:
+                question = partial['question']
+                yield 'delta', {'field': 'question', 'text': question}
+
+        yield 'result', await self._aask_question(
+            session, current_strategy, self._require_question(question), classification_result, started
+        )
 
-        # 记录对话历史
-        session['conversation_history'].append({
-            'round': session['current_round'],
-            'strategy': current_strategy,
-            'question': question,
-            'user_answer': None  # 等待用户回答
-        })
+    def _classification_event(self, session: ClarificationSession, classification_result: dict):
+        """流式接口中的分类事件数据"""
+        return {
+            'classification': classification_result['classification'],
+            'reason': classification_result['reason'],
+            'round': session.current_round,
+            'session_id': session.session_id
+        }
+
+    def _require_question(self, question: str):
+        """流式输出结束后必须得到完整的追问"""
+        if not question:
+            raise ValueError("追问生成失败: 模型没有返回 question 字段")
+        return question
+
+    def _finish_final_result(self, session: ClarificationSession, final_query: str, started: float):
+        """记录流式生成的最终问题并输出总结"""
+        session.final_query = final_query
+        self._log_final_result(session, started)
+
+    def _begin_round(self, session: ClarificationSession):
+        """进入新一轮分析，返回本轮的计时起点"""
+        session.current_round += 1
+        return time.perf_counter()
+
+    def _should_finish(self, session: ClarificationSession, classification_result: dict):
+        """判断是否结束追问：问题已经清晰、已收集到足够信息或达到最大轮数"""
+        return self._finish_reason(session, classification_result) is not None
+
+    def _finish_reason(self, session: ClarificationSession, classification_result: dict):
+        return self.clarifier._finish_reason(classification_result, session.conversation_history,
+                                             session.current_round)
+
+    def _ask_question(self, session: ClarificationSession, current_strategy: str, question: str,
+                      classification_result: dict, started: float):
+        """记录追问并返回等待回答的响应"""
+        # 记录对话历史，user_answer 等待用户回答
+        session.conversation_history.append(ConversationTurn(session.current_round, current_strategy, question))
+        if not self.active_sessions.put(session):
+            return self._session_conflict(session)
+        return self._question_asked(session, current_strategy, question, classification_result, started)
+
+    async def _aask_question(self, session: ClarificationSession, current_strategy: str, question: str,
+                             classification_result: dict, started: float):
+        """记录追问并返回等待回答的响应（异步）"""
+        session.conversation_history.append(ConversationTurn(session.current_round, current_strategy, question))
+        if not await self.active_sessions.aput(session):
+            return self._session_conflict(session)
+        return self._question_asked(session, current_strategy, question, classification_result, started)
+
+    def _question_asked(self, session: ClarificationSession, current_strategy: str, question: str,
+                        classification_result: dict, started: float):
+        """追问已写回会话：记录事件并返回等待回答的响应"""
+        event_log.info(
+            'question_asked',
+            session_id=session.session_id,
+            round=session.current_round,
+            classification=classification_result['classification'],
+            reason=classification_result['reason'],
+            strategy=current_strategy,
+            question=question,
+            latency_ms=elapsed_ms(started)
+        )
 
         return {
             'status': 'waiting_answer',
             'question': question,
-            'round': session['current_round'],
-            'session_id': session_id
+            'round': session.current_round,
+            'session_id': session.session_id
         }
 
-    def _build_current_query(self, session):
+    def _complete_session(self, session: ClarificationSession, final_query: str, classification_result: dict,
+                          started: float):
+        """标记会话结束并返回最终结果"""
+        session.status = 'completed'
+        # 已结束的会话只短暂保留，用于对重复请求返回"会话已结束"
+        if not self.active_sessions.put(session, ttl=Config.SESSION_COMPLETED_TTL):
+            return self._session_conflict(session)
+        return self._session_completed(session, final_query, classification_result, started)
+
+    async def _acomplete_session(self, session: ClarificationSession, final_query: str,
+                                 classification_result: dict, started: float):
+        """标记会话结束并返回最终结果（异步）"""
+        session.status = 'completed'
+        if not await self.active_sessions.aput(session, ttl=Config.SESSION_COMPLETED_TTL):
+            return self._session_conflict(session)
+        return self._session_completed(session, final_query, classification_result, started)
+
+    def _session_completed(self, session: ClarificationSession, final_query: str, classification_result: dict,
+                           started: float):
+        """会话已结束并写回：记录指标和事件，返回最终结果"""
+        finish_reason = self._finish_reason(session, classification_result)
+        SESSION_ROUNDS.observe(session.current_round)
+        SESSIONS_COMPLETED.inc(finish_reason)
+        event_log.info(
+            'session_completed',
+            session_id=session.session_id,
+            round=session.current_round,
+            classification=classification_result['classification'],
+            reason=classification_result['reason'],
+            confidence=classification_result.get('confidence'),
+            finish_reason=finish_reason,
+            final_query=final_query,
+            latency_ms=elapsed_ms(started)
+        )
+
+        return {
+            'status': 'completed',
+            'final_query': final_query,
+            'session_id': session.session_id
+        }
+
+    def _session_conflict(self, session: ClarificationSession):
+        """会话在本轮处理期间已被同一会话的其他请求更新，本轮结果不写回"""
+        event_log.warning('session_conflict', session_id=session.session_id, round=session.current_round)
+        return {
+            'status': 'error',
+            'message': '会话已被其他请求更新，请重试'
+        }
+
+    def _build_current_query(self, session: ClarificationSession):
         """构建当前查询"""
         return self.clarifier._update_query_with_strategy(
-            session['original_query'],
-            session['conversation_history']
+            session.original_query,
+            session.conversation_history
         )
 
-    def _generate_final_result(self, session_id: str):
+    def _generate_final_result(self, session: ClarificationSession):
         """生成最终结果"""
-        session = self.active_sessions[session_id]
+        if session.final_query is not None:
+            return session.final_query
 
-        print("\n=== 生成最终结果 ===")
+        started = time.perf_counter()
 
         # 生成最终查询
         final_query = self.clarifier._build_comprehensive_final_query(
-            session['original_query'],
-            session['conversation_history']
+            session.original_query,
+            session.conversation_history
         )
+        session.final_query = final_query
+        self._log_final_result(session, started)
 
-        # 在控制台输出完整总结
-        summary = self.clarifier._generate_final_summary(
-            session['original_query'],
-            session['conversation_history']
-        )
+        return final_query
+
+    async def _agenerate_final_result(self, session: ClarificationSession):
+        """生成最终结果（异步）"""
+        if session.final_query is not None:
+            return session.final_query
 
-        print("\n" + "=" * 60)
-        print("🎯 最终总结:")
-        print(summary)
-        print("=" * 60)
+        started = time.perf_counter()
+
+        final_query = await self.clarifier._abuild_comprehensive_final_query(
+            session.original_query,
+            session.conversation_history
+        )
+        session.final_query = final_query
+        self._log_final_result(session, started)
 
         return final_query
 
+    def _log_final_result(self, session: ClarificationSession, started: float):
+        """记录最终问题的生成耗时；完整总结只在 debug 级别构造和记录"""
+        event_log.info('final_query_generated', session_id=session.session_id, round=session.current_round,
+                       latency_ms=elapsed_ms(started))
+
+        if event_log.enabled('debug'):
+            summary = self.clarifier._generate_final_summary(
+                session.original_query,
+                session.conversation_history,
+                session.final_query
+            )
+            event_log.debug('final_summary', session_id=session.session_id, summary=summary)
+
+
+def format_sse(event: str, data: dict):
+    """格式化一条 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# SSE 响应头：禁止缓存和反向代理缓冲，保证事件即时送达
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def overloaded_error(e: UpstreamOverloaded):
+    """上游满载时的错误响应体；同时通过 Retry-After 响应头告知客户端重试间隔"""
+    return {
+        'status': 'error',
+        'message': str(e),
+        'retry_after': e.retry_after
+    }
+
+
+def deadline_error(e: DeadlineExceeded):
+    """分类或追问生成超过请求截止时间时的错误响应体"""
+    return {
+        'status': 'error',
+        'message': f'处理超时，请稍后重试（{e}）'
+    }
+
+
+def parse_batch_request(data: dict):
+    """校验批量分类请求，返回 (queries, max_concurrency, 错误信息)"""
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return None, None, '缺少必要参数: queries（非空的问题列表）'
+    if len(queries) > Config.BATCH_MAX_QUERIES:
+        return None, None, f'单次最多分类 {Config.BATCH_MAX_QUERIES} 个问题'
+    if not all(isinstance(query, str) and query.strip() for query in queries):
+        return None, None, 'queries 中的每一项都必须是非空字符串'
 
-# 创建服务实例
-clarifier_service = APIClarifierService()
+    # 请求可以调低并发数，但不能超过配置的上限
+    max_concurrency = data.get('max_concurrency') or Config.BATCH_MAX_CONCURRENCY
+    if not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return None, None, 'max_concurrency 必须是正整数'
+    return queries, min(max_concurrency, Config.BATCH_MAX_CONCURRENCY), None
+
+
+# 服务实例在首次请求时创建：会话存储的后台线程和上游连接都属于各自的工作进程，不能在 fork 前创建
+_clarifier_service = None
+_clarifier_service_lock = threading.Lock()
+
+
+def get_clarifier_service():
+    """获取进程内共享的服务实例"""
+    global _clarifier_service
+    if _clarifier_service is None:
+        with _clarifier_service_lock:
+            if _clarifier_service is None:
+                _clarifier_service = APIClarifierService()
+    return _clarifier_service
+
+
+# 预加载：在 gunicorn --preload 的主进程中导入依赖并编译提示模板，工作进程 fork 后直接共享
+if Config.PRELOAD_CHAINS:
+    import chains
+    chains.preload()
+
+
+def _overloaded_response(e: UpstreamOverloaded):
+    return jsonify(overloaded_error(e)), 503, {'Retry-After': str(e.retry_after)}
+
+
+def _deadline_response(e: DeadlineExceeded):
+    event_log.warning('deadline_exceeded', path=request.path, message=str(e))
+    return jsonify(deadline_error(e)), 504
+
+
+def _sse_response(events):
+    """把 (事件名, 数据) 序列包装成 SSE 响应，处理中出错时发出 error 事件
+
+    先在视图中取出第一个事件，这样在发出响应头之前遇到的错误（如上游满载）仍能返回对应的状态码。
+    """
+    try:
+        first = next(events)
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
+    except Exception as e:
+        event_log.error('api_error', path=request.path, message=str(e))
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+    def generate():
+        try:
+            yield format_sse(*first)
+            for event, data in events:
+                yield format_sse(event, data)
+        except UpstreamOverloaded as e:
+            yield format_sse('error', overloaded_error(e))
+        except DeadlineExceeded as e:
+            event_log.warning('deadline_exceeded', path=request.path, message=str(e))
+            yield format_sse('error', deadline_error(e))
+        except Exception as e:
+            event_log.error('api_error', path=request.path, message=str(e))
+            yield format_sse('error', {'status': 'error', 'message': str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
 
 
 @app.route('/clarify/start', methods=['POST'])
@@ -173,11 +622,15 @@ def start_clarification():
                 'message': '缺少必要参数: session_id 和 query'
             }), 400
 
-        result = clarifier_service.start_clarification(session_id, query)
+        result = get_clarifier_service().start_clarification(session_id, query)
         return jsonify(result)
 
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
     except Exception as e:
-        print(f"API错误: {e}")
+        event_log.error('api_error', path=request.path, message=str(e))
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -198,17 +651,87 @@ def continue_clarification():
                 'message': '缺少必要参数: session_id 和 answer'
             }), 400
 
-        result = clarifier_service.continue_clarification(session_id, user_answer)
+        result = get_clarifier_service().continue_clarification(session_id, user_answer)
         return jsonify(result)
 
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
     except Exception as e:
-        print(f"API错误: {e}")
+        event_log.error('api_error', path=request.path, message=str(e))
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
 
+@app.route('/clarify/batch', methods=['POST'])
+def classify_batch():
+    """批量分类的API端点"""
+    try:
+        data = request.get_json()
+        queries, max_concurrency, error = parse_batch_request(data)
+
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 400
+
+        result = get_clarifier_service().classify_batch(queries, max_concurrency)
+        return jsonify(result)
+
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e)
+    except Exception as e:
+        event_log.error('api_error', path=request.path, message=str(e))
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/clarify/start/stream', methods=['POST'])
+def stream_start_clarification():
+    """开始澄清流程的流式API端点（SSE）"""
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    query = data.get('query')
+
+    if not session_id or not query:
+        return jsonify({
+            'status': 'error',
+            'message': '缺少必要参数: session_id 和 query'
+        }), 400
+
+    return _sse_response(get_clarifier_service().stream_start_clarification(session_id, query))
+
+
+@app.route('/clarify/continue/stream', methods=['POST'])
+def stream_continue_clarification():
+    """继续澄清流程的流式API端点（SSE）"""
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    user_answer = data.get('answer')
+
+    if not session_id or not user_answer:
+        return jsonify({
+            'status': 'error',
+            'message': '缺少必要参数: session_id 和 answer'
+        }), 400
+
+    return _sse_response(get_clarifier_service().stream_continue_clarification(session_id, user_answer))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标端点"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
@@ -223,7 +746,12 @@ if __name__ == '__main__':
         print("📍 API端点:")
         print("   - POST /clarify/start - 开始澄清流程")
         print("   - POST /clarify/continue - 继续澄清流程")
+        print("   - POST /clarify/batch - 批量分类")
+        print("   - POST /clarify/start/stream - 开始澄清流程（SSE 流式）")
+        print("   - POST /clarify/continue/stream - 继续澄清流程（SSE 流式）")
+        print("   - GET /metrics - Prometheus 指标")
         print("   - GET /health - 健康检查")
+        print("💡 异步模式: uvicorn asgi_service:app --port 18890")
         print("-" * 50)
 
         app.run(host='0.0.0.0', port=18890, debug=True)
@@ -0,0 +1,302 @@
+import json
+import uuid
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+from admission import UpstreamOverloaded
+from api_service import (SSE_HEADERS, deadline_error, format_sse, get_clarifier_service, overloaded_error,
+                         parse_batch_request)
+from config import Config
+from hedging import DeadlineExceeded
+from event_log import event_log
+from metrics import REGISTRY, GaugeFunction, render_metrics
+
+_websocket_connections = 0
+REGISTRY.register(GaugeFunction(
+    "clarifier_websocket_connections", "当前打开的 WebSocket 澄清连接数", lambda: _websocket_connections))
+
+
+async def start_clarification(request):
+    """开始澄清流程的API端点（异步）"""
+    try:
+        data = await request.json()
+        session_id = data.get('session_id')
+        query = data.get('query')
+
+        if not session_id or not query:
+            return JSONResponse({
+                'status': 'error',
+                'message': '缺少必要参数: session_id 和 query'
+            }, status_code=400)
+
+        result = await get_clarifier_service().astart_clarification(session_id, query)
+        return JSONResponse(result)
+
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e, request.url.path)
+    except Exception as e:
+        event_log.error('api_error', path=request.url.path, message=str(e))
+        return JSONResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status_code=500)
+
+
+async def continue_clarification(request):
+    """继续澄清流程的API端点（异步）"""
+    try:
+        data = await request.json()
+        session_id = data.get('session_id')
+        user_answer = data.get('answer')
+
+        if not session_id or not user_answer:
+            return JSONResponse({
+                'status': 'error',
+                'message': '缺少必要参数: session_id 和 answer'
+            }, status_code=400)
+
+        result = await get_clarifier_service().acontinue_clarification(session_id, user_answer)
+        return JSONResponse(result)
+
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e, request.url.path)
+    except Exception as e:
+        event_log.error('api_error', path=request.url.path, message=str(e))
+        return JSONResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status_code=500)
+
+
+async def classify_batch(request):
+    """批量分类的API端点（异步）"""
+    try:
+        data = await request.json()
+        queries, max_concurrency, error = parse_batch_request(data)
+
+        if error:
+            return JSONResponse({
+                'status': 'error',
+                'message': error
+            }, status_code=400)
+
+        result = await get_clarifier_service().aclassify_batch(queries, max_concurrency)
+        return JSONResponse(result)
+
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e, request.url.path)
+    except Exception as e:
+        event_log.error('api_error', path=request.url.path, message=str(e))
+        return JSONResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status_code=500)
+
+
+def _overloaded_response(e: UpstreamOverloaded):
+    return JSONResponse(overloaded_error(e), status_code=503, headers={'Retry-After': str(e.retry_after)})
+
+
+def _deadline_response(e: DeadlineExceeded, path: str):
+    event_log.warning('deadline_exceeded', path=path, message=str(e))
+    return JSONResponse(deadline_error(e), status_code=504)
+
+
+async def _sse_response(events, path: str):
+    """把异步 (事件名, 数据) 序列包装成 SSE 响应，处理中出错时发出 error 事件
+
+    先取出第一个事件，这样在发出响应头之前遇到的错误（如上游满载）仍能返回对应的状态码。
+    """
+    try:
+        first = await events.__anext__()
+    except UpstreamOverloaded as e:
+        return _overloaded_response(e)
+    except DeadlineExceeded as e:
+        return _deadline_response(e, path)
+    except Exception as e:
+        event_log.error('api_error', path=path, message=str(e))
+        return JSONResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status_code=500)
+
+    async def generate():
+        try:
+            yield format_sse(*first)
+            async for event, data in events:
+                yield format_sse(event, data)
+        except UpstreamOverloaded as e:
+            yield format_sse('error', overloaded_error(e))
+        except DeadlineExceeded as e:
+            event_log.warning('deadline_exceeded', path=path, message=str(e))
+            yield format_sse('error', deadline_error(e))
+        except Exception as e:
+            event_log.error('api_error', path=path, message=str(e))
+            yield format_sse('error', {'status': 'error', 'message': str(e)})
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def stream_start_clarification(request):
+    """开始澄清流程的流式API端点（SSE）"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    session_id = data.get('session_id')
+    query = data.get('query')
+
+    if not session_id or not query:
+        return JSONResponse({
+            'status': 'error',
+            'message': '缺少必要参数: session_id 和 query'
+        }, status_code=400)
+
+    return await _sse_response(get_clarifier_service().astream_start_clarification(session_id, query), request.url.path)
+
+
+async def stream_continue_clarification(request):
+    """继续澄清流程的流式API端点（SSE）"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    session_id = data.get('session_id')
+    user_answer = data.get('answer')
+
+    if not session_id or not user_answer:
+        return JSONResponse({
+            'status': 'error',
+            'message': '缺少必要参数: session_id 和 answer'
+        }, status_code=400)
+
+    return await _sse_response(get_clarifier_service().astream_continue_clarification(session_id, user_answer), request.url.path)
+
+
+async def clarify_websocket(websocket):
+    """WebSocket 澄清端点：一个连接承载一个会话的多轮问答，服务端推送与 SSE 接口相同的事件
+
+    客户端发送 {"type": "start", "query": ..., "session_id": 可选, "stream": 可选} 开始会话，
+    之后每轮发送 {"type": "answer", "answer": ...}；服务端对每条消息推送若干 {"event": ..., "data": ...}，
+    以 result 或 error 事件结束本轮。stream 默认为 true，推送分类和逐步生成的文本；为 false 时每轮只推送 result。
+    会话结束后可以在同一连接上发送新的 start。
+    会话对象由连接持有，每轮不再重新建立请求、按 session_id 查找会话。
+    """
+    global _websocket_connections
+    await websocket.accept()
+    _websocket_connections += 1
+    service = get_clarifier_service()
+    session = None
+    stream = True
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                await _send_ws_error(websocket, '消息必须是 JSON 对象')
+                continue
+            if not isinstance(message, dict):
+                await _send_ws_error(websocket, '消息必须是 JSON 对象')
+                continue
+
+            message_type = message.get('type')
+            if message_type == 'start':
+                query = message.get('query')
+                if not query:
+                    await _send_ws_error(websocket, '缺少必要参数: query')
+                    continue
+                session = await service.aopen_session(message.get('session_id') or uuid.uuid4().hex, query)
+                stream = message.get('stream', True) is not False
+                events = service.astream_session_round(session, stream=stream)
+            elif message_type == 'answer':
+                user_answer = message.get('answer')
+                if session is None or not user_answer:
+                    await _send_ws_error(websocket, '缺少必要参数: answer（需要先发送 start）')
+                    continue
+                events = service.astream_session_round(session, user_answer, stream)
+            else:
+                await _send_ws_error(websocket, '未知的消息类型，应为 start 或 answer')
+                continue
+
+            await _send_ws_events(websocket, events)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _websocket_connections -= 1
+
+
+async def _send_ws_events(websocket, events):
+    """逐个推送一轮的事件；处理中出错时推送 error 事件，连接保持打开"""
+    try:
+        async for event, data in events:
+            await websocket.send_text(json.dumps({'event': event, 'data': data}, ensure_ascii=False))
+    except WebSocketDisconnect:
+        raise
+    except UpstreamOverloaded as e:
+        await websocket.send_text(json.dumps({'event': 'error', 'data': overloaded_error(e)}, ensure_ascii=False))
+    except DeadlineExceeded as e:
+        event_log.warning('deadline_exceeded', path=websocket.url.path, message=str(e))
+        await websocket.send_text(json.dumps({'event': 'error', 'data': deadline_error(e)}, ensure_ascii=False))
+    except Exception as e:
+        event_log.error('api_error', path=websocket.url.path, message=str(e))
+        await _send_ws_error(websocket, str(e))
+    finally:
+        await events.aclose()
+
+
+async def _send_ws_error(websocket, message: str):
+    await websocket.send_text(json.dumps({'event': 'error', 'data': {'status': 'error', 'message': message}},
+                                         ensure_ascii=False))
+
+
+async def metrics(request):
+    """Prometheus 指标端点"""
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+async def health_check(request):
+    """健康检查端点"""
+    return JSONResponse({'status': 'healthy'})
+
+
+app = Starlette(routes=[
+    Route('/clarify/start', start_clarification, methods=['POST']),
+    Route('/clarify/continue', continue_clarification, methods=['POST']),
+    Route('/clarify/batch', classify_batch, methods=['POST']),
+    Route('/clarify/start/stream', stream_start_clarification, methods=['POST']),
+    Route('/clarify/continue/stream', stream_continue_clarification, methods=['POST']),
+    WebSocketRoute('/clarify/ws', clarify_websocket),
+    Route('/metrics', metrics, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+])
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    try:
+        Config.validate()
+        print("✅ 环境准备完成，DeepSeek API Key 已加载。")
+        print("🚀 启动澄清服务API（异步模式）...")
+        print("📍 API端点:")
+        print("   - POST /clarify/start - 开始澄清流程")
+        print("   - POST /clarify/continue - 继续澄清流程")
+        print("   - POST /clarify/batch - 批量分类")
+        print("   - POST /clarify/start/stream - 开始澄清流程（SSE 流式）")
+        print("   - POST /clarify/continue/stream - 继续澄清流程（SSE 流式）")
+        print("   - WS /clarify/ws - 单连接多轮澄清（推送流式事件）")
+        print("   - GET /metrics - Prometheus 指标")
+        print("   - GET /health - 健康检查")
+        print("-" * 50)
+
+        # 显式指定 WebSocket 实现：缺少 websockets 包时启动即报错，而不是静默地拒绝 /clarify/ws 的升级请求
+        uvicorn.run(app, host='0.0.0.0', port=18890, ws='websockets')
+    except ValueError as e:
+        print(f"❌ 配置错误: {e}")
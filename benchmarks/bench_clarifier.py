@@ -0,0 +1,194 @@
+"""离线微基准：在本地模拟上游上测量本项目在大模型之外引入的开销
+
+用法: python -m benchmarks.bench_clarifier --sessions 200 --concurrency 8 --latency-ms 0
+
+测量内容：
+- 提示渲染、JsonOutputParser 解析、会话管理（不经过网络）
+- 通过 Flask 分发的 start / continue / final 三条路径的端到端耗时和吞吐
+- 加 --asgi 时，在 ASGI 应用上比较每轮一个请求（POST / SSE）与一个 WebSocket 连接走完整会话的耗时
+"""
+import argparse
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.mock_llm_server import CANNED_RESPONSES, MockLLMServer
+from benchmarks.stats import format_table, summarize
+from config import Config
+
+
+def _timeit(fn, iterations: int):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_local_stages(service, iterations: int):
+    """不经过网络的各阶段耗时"""
+    from session_store import ClarificationSession, ConversationTurn
+
+    clarifier = service.clarifier
+    history = [
+        ConversationTurn(1, "understand_intent", CANNED_RESPONSES['question']['question'], "想找看糖尿病好的医院"),
+        ConversationTurn(2, "gather_context", "您目前的病情和预算大概是怎样的？", "二型糖尿病，预算一万以内"),
+    ]
+    summary_text = clarifier._prepare_conversation_summary("去香港哪家医院看好", history)
+
+    def bookkeeping():
+        session = ClarificationSession("bench", "去香港哪家医院看好")
+        service.active_sessions.put(session)
+        session = service.active_sessions.get("bench")
+        session.conversation_history.extend(history)
+        clarifier._update_query_with_strategy(session.original_query, session.conversation_history)
+        clarifier._determine_strategy(session.conversation_history, None)
+        clarifier._prepare_conversation_summary(session.original_query, session.conversation_history)
+        service.active_sessions.pop("bench")
+
+    return {
+        'render.classifier': summarize(_timeit(
+            lambda: clarifier.classifier.prompt.invoke({"query": "去香港哪家医院看好"}), iterations)),
+        'render.question': summarize(_timeit(
+            lambda: clarifier.question_generator.prompt.invoke({"query": "去香港哪家医院看好", "reason": "模糊"}),
+            iterations)),
+        'render.final_query': summarize(_timeit(
+            lambda: clarifier.final_query_generator.prompt.invoke({"conversation_summary": summary_text}),
+            iterations)),
+        'parse.classifier': summarize(_timeit(
+            lambda: clarifier.classifier.parser.parse(json.dumps(CANNED_RESPONSES['classifier_vague'])),
+            iterations)),
+        'parse.final_query': summarize(_timeit(
+            lambda: clarifier.final_query_generator.parser.parse(json.dumps(CANNED_RESPONSES['final'])),
+            iterations)),
+        'session.bookkeeping': summarize(_timeit(bookkeeping, iterations)),
+    }
+
+
+def bench_http_paths(app, sessions: int, concurrency: int):
+    """通过 Flask 分发走完整会话：start -> continue（继续追问）-> continue（生成最终问题）"""
+    latencies = {'http.start': [], 'http.continue': [], 'http.final': []}
+
+    def run_session(i):
+        client = app.test_client()
+        session_id = f"bench-{i}"
+        steps = [
+            ('http.start', '/clarify/start', {'session_id': session_id, 'query': f"去香港哪家医院看好（{i}）"}),
+            ('http.continue', '/clarify/continue', {'session_id': session_id, 'answer': "想找看糖尿病好的医院"}),
+            ('http.final', '/clarify/continue', {'session_id': session_id, 'answer': "二型糖尿病，预算一万以内"}),
+        ]
+        timings = []
+        for stage, path, payload in steps:
+            start = time.perf_counter()
+            response = client.post(path, json=payload)
+            timings.append((stage, time.perf_counter() - start))
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} 返回 {response.status_code}: {response.get_data(as_text=True)}")
+        return timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for timings in executor.map(run_session, range(sessions)):
+            for stage, latency in timings:
+                latencies[stage].append(latency)
+    elapsed = time.perf_counter() - start
+
+    results = {stage: summarize(values, elapsed) for stage, values in latencies.items()}
+    results['http.session'] = summarize(
+        [sum(values) for values in zip(*latencies.values())], elapsed
+    )
+    return results
+
+
+def _session_answers(i: int):
+    return f"去香港哪家医院看好（{i}）", ["想找看糖尿病好的医院", "二型糖尿病，预算一万以内"]
+
+
+def bench_asgi_paths(app, sessions: int, concurrency: int):
+    """同一 ASGI 应用上的完整会话：每轮一个请求（POST / SSE）与整个会话一个 WebSocket 连接，分别测非流式和流式"""
+    from starlette.testclient import TestClient
+
+    def run_http(client, i):
+        query, answers = _session_answers(i)
+        session_id = f"asgi-http-{i}"
+        start = time.perf_counter()
+        client.post('/clarify/start', json={'session_id': session_id, 'query': query})
+        for answer in answers:
+            client.post('/clarify/continue', json={'session_id': session_id, 'answer': answer})
+        return time.perf_counter() - start
+
+    def run_sse(client, i):
+        query, answers = _session_answers(i)
+        session_id = f"asgi-sse-{i}"
+        start = time.perf_counter()
+        client.post('/clarify/start/stream', json={'session_id': session_id, 'query': query})
+        for answer in answers:
+            client.post('/clarify/continue/stream', json={'session_id': session_id, 'answer': answer})
+        return time.perf_counter() - start
+
+    def run_ws(client, i, stream=False):
+        query, answers = _session_answers(i)
+        start = time.perf_counter()
+        with client.websocket_connect('/clarify/ws') as websocket:
+            for message in [{'type': 'start', 'query': query, 'stream': stream}] + [
+                    {'type': 'answer', 'answer': answer} for answer in answers]:
+                websocket.send_json(message)
+                while websocket.receive_json()['event'] not in ('result', 'error'):
+                    pass
+        return time.perf_counter() - start
+
+    results = {}
+    # 所有会话共用一个客户端，即同一个事件循环，与真实部署中的单个工作进程一致
+    with TestClient(app) as client:
+        for stage, fn in (
+                ('asgi.http.session', run_http),
+                ('asgi.ws.session', run_ws),
+                ('asgi.sse.session', run_sse),
+                ('asgi.ws_stream.session', functools.partial(run_ws, stream=True))):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(lambda i: fn(client, i), range(sessions)))
+            results[stage] = summarize(latencies, time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="澄清服务离线微基准（本地模拟上游，无需网络）")
+    parser.add_argument("--sessions", type=int, default=200, help="端到端测试的会话数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发会话数")
+    parser.add_argument("--iterations", type=int, default=2000, help="本地阶段的重复次数")
+    parser.add_argument("--latency-ms", type=float, default=0, help="模拟上游的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="模拟上游的随机抖动上限")
+    parser.add_argument("--cache", action="store_true", help="启用响应缓存和近似重复缓存（默认关闭，以测量真实调用路径）")
+    parser.add_argument("--asgi", action="store_true", help="同时测量 ASGI 应用上的 HTTP 与 WebSocket 会话")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件，便于在部署前做回归比较")
+    args = parser.parse_args()
+
+    server = MockLLMServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+    Config.DEEPSEEK_BASE_URL = server.start()
+    Config.DEEPSEEK_API_KEY = Config.DEEPSEEK_API_KEY or "mock-key"
+    Config.RESPONSE_CACHE_ENABLED = args.cache
+    Config.SEMANTIC_CACHE_ENABLED = args.cache
+    Config.PRECLASSIFIER_ENABLED = False
+
+    # 配置就绪后再导入服务，保证链指向模拟上游
+    import api_service
+
+    results = bench_local_stages(api_service.get_clarifier_service(), args.iterations)
+    results.update(bench_http_paths(api_service.app, args.sessions, args.concurrency))
+    if args.asgi:
+        import asgi_service
+        results.update(bench_asgi_paths(asgi_service.app, args.sessions, args.concurrency))
+    server.stop()
+
+    print(format_table(results))
+    print(f"上游调用次数: {server.request_count}（{server.request_count / args.sessions:.2f} 次/会话）")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""启动耗时基准：在全新进程中测量导入耗时和首个请求的延迟
+
+用法: python -m benchmarks.bench_startup --runs 5
+
+三种模式：
+- lazy: 默认配置，导入时不构建链，首个请求承担 langchain 导入和链构建
+- preload: PRELOAD_CHAINS=1，导入时编译提示模板
+- fork: PRELOAD_CHAINS=1 的进程导入后 fork，在子进程中发出首个请求（模拟 gunicorn --preload 的工作进程）
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from benchmarks.mock_llm_server import MockLLMServer
+from benchmarks.stats import format_table, summarize
+
+MODES = ('lazy', 'preload', 'fork')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _first_requests(api_service):
+    """依次发出两个不同的首轮请求，返回各自耗时"""
+    client = api_service.app.test_client()
+    timings = {}
+    for stage, query in (('first_request', "去香港哪家医院看好"), ('second_request', "深圳哪家医院看好")):
+        start = time.perf_counter()
+        response = client.post('/clarify/start', json={'session_id': f"startup-{stage}", 'query': query})
+        timings[stage] = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"/clarify/start 返回 {response.status_code}: {response.get_data(as_text=True)}")
+    return timings
+
+
+def run_child(mode: str):
+    """在子进程中执行：导入服务并发出请求，结果以一行 JSON 输出到标准输出"""
+    start = time.perf_counter()
+    import api_service
+    imported = time.perf_counter() - start
+
+    if mode != 'fork':
+        timings = _first_requests(api_service)
+    else:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(_first_requests(api_service), f)
+            os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            timings = json.load(f)
+        os.waitpid(pid, 0)
+
+    timings['import'] = imported
+    print(json.dumps(timings))
+
+
+def run_mode(mode: str, base_url: str):
+    """启动一个全新的解释器运行 run_child，返回 (各阶段耗时, 进程总耗时)"""
+    env = dict(
+        os.environ,
+        DEEPSEEK_BASE_URL=base_url,
+        DEEPSEEK_API_KEY=os.environ.get("DEEPSEEK_API_KEY") or "mock-key",
+        PRELOAD_CHAINS="0" if mode == 'lazy' else "1",
+        RESPONSE_CACHE_ENABLED="0",
+        PRECLASSIFIER_ENABLED="0",
+        EVENT_LOG_LEVEL="error",
+    )
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child", mode],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    elapsed = time.perf_counter() - start
+    return json.loads(output.strip().splitlines()[-1]), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工作进程启动耗时基准（本地模拟上游，无需网络）")
+    parser.add_argument("--runs", type=int, default=5, help="每种模式启动的进程数")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔的模式: lazy / preload / fork")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件，便于在部署前做回归比较")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    server = MockLLMServer()
+    base_url = server.start()
+
+    samples = {}
+    for mode in args.modes.split(","):
+        for _ in range(args.runs):
+            timings, elapsed = run_mode(mode, base_url)
+            for stage, value in timings.items():
+                samples.setdefault(f"{mode}.{stage}", []).append(value)
+            samples.setdefault(f"{mode}.process", []).append(elapsed)
+    server.stop()
+
+    results = {stage: summarize(values) for stage, values in sorted(samples.items())}
+    print(format_table(results))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
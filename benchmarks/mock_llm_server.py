@@ -0,0 +1,158 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 按提示词中的标志选择预置响应，保证 start -> continue -> 最终问题 的完整流程都能走到
+CANNED_RESPONSES = {
+    'classify_and_ask_vague': {"classification": "VAGUE", "reason": "\"好\"的标准不明确", "confidence": 0.9, "intent_clear": False, "context_sufficient": False, "question": "您最关注医院的哪个方面，比如专科水平、费用还是就诊便利性？"},
+    'classify_and_ask_simple': {"classification": "SIMPLE", "reason": "已经收集到足够的信息", "confidence": 0.95, "intent_clear": True, "context_sufficient": True, "question": ""},
+    'classifier_vague': {"classification": "VAGUE", "reason": "\"好\"的标准不明确", "confidence": 0.9, "intent_clear": False, "context_sufficient": False},
+    'classifier_simple': {"classification": "SIMPLE", "reason": "已经收集到足够的信息", "confidence": 0.95, "intent_clear": True, "context_sufficient": True},
+    'question': {"question": "您最关注医院的哪个方面，比如专科水平、费用还是就诊便利性？"},
+    'final': {"final_question": "作为糖尿病患者，想了解香港哪家医院的内分泌科专家比较好，治疗费用大概是什么水平？"},
+}
+
+
+def pick_response(prompt: str):
+    """根据提示词判断是哪条链的调用，返回预置 JSON"""
+    # 查询中带有用户背景或具体要求时视为已经清晰，用于走到最终问题生成；只看提示词末尾的用户问题，
+    # 提示词正文里的说明文字也会提到"用户背景"
+    query = prompt.rsplit("用户问题:", 1)[-1]
+    clear = "用户背景" in query or "具体要求" in query
+    if "问题分析师兼医疗问询助手" in prompt:
+        return CANNED_RESPONSES['classify_and_ask_simple' if clear else 'classify_and_ask_vague']
+    if "问题分析师" in prompt:
+        return CANNED_RESPONSES['classifier_simple' if clear else 'classifier_vague']
+    if "问题重构专家" in prompt:
+        return CANNED_RESPONSES['final']
+    return CANNED_RESPONSES['question']
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实上游的连接复用行为一致
+    disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免 Nagle 与延迟确认叠加出的约 40ms 停顿
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        content = json.dumps(pick_response(prompt), ensure_ascii=False)
+        self.server.record_request()
+
+        latency = self.server.latency + random.uniform(0, self.server.jitter)
+        if body.get("stream"):
+            self._send_stream(body, content, latency)
+        else:
+            time.sleep(latency)
+            self._send_completion(body, prompt, content)
+
+    def _send_completion(self, body: dict, prompt: str, content: str):
+        payload = json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt),
+                "completion_tokens": len(content),
+                "total_tokens": len(prompt) + len(content)
+            }
+        }, ensure_ascii=False).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, body: dict, content: str, latency: float):
+        # 首个 token 前等待一半延迟，其余延迟平均分摊到后续分片
+        chunks = [content[i:i + self.server.chunk_size] for i in range(0, len(content), self.server.chunk_size)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(latency / 2)
+        for chunk in chunks:
+            data = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(latency / 2 / len(chunks))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """本地 OpenAI 兼容的模拟上游，可配置延迟，返回预置 JSON"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, chunk_size: int = 4):
+        super().__init__((host, port), MockLLMHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+    def start(self):
+        """在后台线程中启动，返回 base_url"""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 DeepSeek（OpenAI 兼容）服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18999)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每次调用的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="在固定延迟上叠加的随机抖动上限")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000)
+    print(f"🧪 模拟上游已启动: {server.base_url}（设置 DEEPSEEK_BASE_URL 指向该地址）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
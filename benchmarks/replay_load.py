@@ -0,0 +1,160 @@
+"""回放录制的会话流量，模拟带思考时间的多轮真实用户
+
+先用 CAPTURE_PATH=capture.jsonl 启动服务录制流量，然后：
+    python -m benchmarks.replay_load capture.jsonl --target http://127.0.0.1:18890 --users 1,4,16 --time-scale 0.1
+
+--time-scale 控制思考时间和到达间隔：1 保持原样，0.1 压缩为十分之一，0 不等待。
+每个并发级别把所有录制会话完整回放一遍，输出该级别下的延迟和吞吐，组成扩展曲线。
+"""
+import argparse
+import itertools
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from benchmarks.stats import format_table, summarize
+
+ENDPOINTS = {'start': '/clarify/start', 'continue': '/clarify/continue'}
+
+
+def load_sessions(path: str):
+    """按 session_id 分组，返回 [(会话开始偏移, [(kind, text, 距上一请求结束的思考时间)])]"""
+    requests_by_session = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                requests_by_session[record['session_id']].append(record)
+
+    sessions = []
+    first_ts = None
+    for records in requests_by_session.values():
+        records.sort(key=lambda record: record['ts'])
+        if records[0]['kind'] != 'start':
+            continue  # 录制开始前就已存在的会话无法完整回放
+
+        steps = []
+        previous_end = None
+        for record in records:
+            think_time = 0.0 if previous_end is None else max(0.0, record['ts'] - previous_end)
+            steps.append((record['kind'], record['text'], think_time))
+            previous_end = record['ts'] + record['latency_ms'] / 1000
+        sessions.append((records[0]['ts'], steps))
+        first_ts = records[0]['ts'] if first_ts is None else min(first_ts, records[0]['ts'])
+
+    sessions.sort(key=lambda session: session[0])
+    return [(start - first_ts, steps) for start, steps in sessions]
+
+
+def post_json(url: str, payload: dict, timeout: float):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def replay(sessions: list, target: str, users: int, time_scale: float, preserve_arrivals: bool, timeout: float):
+    """用 users 个虚拟用户回放全部会话，返回 (按请求类型分组的耗时, 错误数, 完成时间线, 总耗时)"""
+    work = queue.Queue()
+    for session in sessions:
+        work.put(session)
+
+    latencies = defaultdict(list)
+    completions = []  # (完成时间偏移, 耗时)
+    errors = [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+    start = time.perf_counter()
+
+    def virtual_user():
+        while True:
+            try:
+                offset, steps = work.get_nowait()
+            except queue.Empty:
+                return
+
+            if preserve_arrivals:
+                delay = offset * time_scale - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            session_id = f"replay-{next(counter)}-{int(start)}"
+            for kind, text, think_time in steps:
+                if think_time and time_scale:
+                    time.sleep(think_time * time_scale)
+
+                field = 'query' if kind == 'start' else 'answer'
+                sent = time.perf_counter()
+                status, body = post_json(target + ENDPOINTS[kind], {'session_id': session_id, field: text}, timeout)
+                latency = time.perf_counter() - sent
+
+                with lock:
+                    latencies[kind].append(latency)
+                    completions.append((time.perf_counter() - start, latency))
+                    if status != 200 or body is None or body.get('status') == 'error':
+                        errors[0] += 1
+                if body is None or body.get('status') != 'waiting_answer':
+                    break  # 会话已结束（或出错），录制中剩余的请求不再发送
+
+    threads = [threading.Thread(target=virtual_user, daemon=True) for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors[0], completions, time.perf_counter() - start
+
+
+def throughput_timeline(completions: list, bucket: float = 1.0):
+    """按时间窗口统计完成的请求数和延迟"""
+    buckets = defaultdict(list)
+    for finished_at, latency in completions:
+        buckets[int(finished_at // bucket)].append(latency)
+    return {f"t={index * bucket:.0f}s": summarize(values, bucket) for index, values in sorted(buckets.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的会话流量并输出延迟/吞吐曲线")
+    parser.add_argument("capture", help="CAPTURE_PATH 录制的 JSONL 文件")
+    parser.add_argument("--target", default="http://127.0.0.1:18890", help="被测服务地址")
+    parser.add_argument("--users", default="1,4,16", help="逗号分隔的并发虚拟用户数，逐级回放")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="思考时间/到达间隔的缩放比例")
+    parser.add_argument("--preserve-arrivals", action="store_true", help="按录制的会话到达时间发起会话")
+    parser.add_argument("--timeline", action="store_true", help="同时输出每秒的吞吐和延迟")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求超时（秒）")
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.capture)
+    total_requests = sum(len(steps) for _, steps in sessions)
+    print(f"已加载 {len(sessions)} 个会话，共 {total_requests} 个请求")
+
+    curve = {}
+    for users in [int(value) for value in args.users.split(",")]:
+        latencies, errors, completions, elapsed = replay(
+            sessions, args.target.rstrip("/"), users, args.time_scale, args.preserve_arrivals, args.timeout
+        )
+        rows = {f"{kind}": summarize(values, elapsed) for kind, values in latencies.items()}
+        rows['all'] = summarize([value for values in latencies.values() for value in values], elapsed)
+        curve[f"users={users}"] = rows['all']
+
+        print(f"\n=== 并发虚拟用户: {users}，耗时 {elapsed:.2f}s，错误 {errors} ===")
+        print(format_table(rows))
+        if args.timeline:
+            print(format_table(throughput_timeline(completions)))
+
+    print("\n=== 扩展曲线（全部请求）===")
+    print(format_table(curve))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+def percentile(sorted_values: list, p: float):
+    """已排序序列的百分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def summarize(latencies: list, elapsed: float = None):
+    """汇总一组耗时（秒），返回毫秒单位的百分位数和吞吐"""
+    values = sorted(latencies)
+    summary = {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000 if values else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p90_ms': percentile(values, 90) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000 if values else 0.0,
+    }
+    if elapsed:
+        summary['rps'] = len(values) / elapsed
+    return summary
+
+
+def format_table(rows: dict):
+    """把 {阶段: summarize 结果} 格式化为文本表格"""
+    header = f"{'stage':<28}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'rps':>10}"
+    lines = [header, "-" * len(header)]
+    for name, s in rows.items():
+        rps = f"{s['rps']:.1f}" if 'rps' in s else "-"
+        lines.append(
+            f"{name:<28}{s['count']:>8}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}"
+            f"{s['p90_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}{rps:>10}"
+        )
+    lines.append("（耗时单位: ms）")
+    return "\n".join(lines)
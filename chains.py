@@ -1,31 +1,36 @@
+import asyncio
+import hashlib
+import threading
+import time
+from contextlib import nullcontext
+import openai
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from langchain_openai import ChatOpenAI
-from models import Classification, QuestionGenerator, FinalQueryGenerator
+from langchain_core.outputs import Generation
+from langchain_core.runnables import RunnableLambda
+from models import Classification, QuestionGenerator, FinalQueryGenerator, ClassifyAndAsk
+import llm_client
+from llm_client import get_backends, get_chat_model
+from llm_router import get_router
+from response_cache import ResponseCache, get_response_cache
+from singleflight import SingleFlight
+from admission import get_admission_controller
+from hedging import LatencyTracker, ahedged_call, call_deadline, hedged_call
 from config import Config
+from metrics import CHAIN_CALLS, CHAIN_LATENCY, COMPLETION_TOKENS, LLM_LATENCY, PROMPT_TOKENS
+from prompt_budget import PROMPT_SIZE, compact_format_instructions, estimate_tokens
+from output_repair import RepairingJsonOutputParser
 
-class ClassifierChain:
-    def __init__(self):
-        self.model = ChatOpenAI(
-            temperature=Config.TEMPERATURE,
-            model_name=Config.MODEL_NAME,
-            openai_api_key=Config.DEEPSEEK_API_KEY,
-            openai_api_base=Config.DEEPSEEK_BASE_URL
-        )
-        self.parser = JsonOutputParser(pydantic_object=Classification)
-        self.prompt = self._create_prompt()
-        self.chain = self.prompt | self.model | self.parser
+# 进程内共享：所有 ClarifierService 实例中相同输入的在途调用只会发出一次
+_inflight = SingleFlight()
 
-    def _create_prompt(self):
-        return ChatPromptTemplate.from_template(
-            """
-            你是一个专业的问题分析师。你的任务是判断用户的问题是否清晰明确，能够直接回答。
-
-            分类标准：
-            - SIMPLE: 问题表达清晰，有明确的询问对象和内容，虽然可能需要专业知识回答，但问题本身不模糊
-            - COMPLEX: 问题涉及多个选择或比较，需要了解用户的具体偏好、预算、背景等才能给出个性化建议
-            - VAGUE: 问题中包含模糊词汇或缺少关键信息，无法准确理解用户想问什么
+# 按截止时间设置上游请求超时时的下限（秒），剩余时间已很少时仍允许请求正常发出和失败
+MIN_REQUEST_TIMEOUT = 0.1
 
+# 少样本示例，只在完整提示变体（PROMPT_VARIANT=full）中使用
+CLASSIFIER_EXAMPLES = """
             SIMPLE的例子：
             - "糖尿病可以吃炸鸡吗" - 问题明确，直接询问医学建议
             - "北京到上海的高铁票多少钱" - 问题具体，有明确查询对象
@@ -39,9 +44,431 @@ class ClassifierChain:
             - "去香港哪家医院看好" - "好"的标准不明确
             - "这附近有什么餐厅" - "这附近"位置不明确
             - "怎么办" - 完全不知道要解决什么问题
+"""
+
+FINAL_QUERY_EXAMPLES = """
+            示例：
+            原始问题: "在大陆看病有什么不好"
+            追问收集到的信息: 用户关心卫生问题，想了解消毒措施、病房清洁度、医护人员卫生习惯
+            最终问题: "想了解大陆医院在卫生方面的情况，包括医院的消毒措施、病房清洁度以及医护人员的卫生习惯如何？"
+
+            另一个示例：
+            原始问题: "去香港哪家医院看好"
+            追问收集到的信息: 用户是糖尿病患者，关心专科医生水平和治疗费用
+            最终问题: "作为糖尿病患者，想了解香港哪家医院的内分泌科专家比较好，治疗费用大概是什么水平？"
+"""
+
+CLASSIFY_AND_ASK_EXAMPLES = """
+            例子：
+            - "糖尿病可以吃炸鸡吗" - SIMPLE，问题明确，直接询问医学建议
+            - "去香港看病好还是在深圳看病好" - COMPLEX，需要了解用户关注的方面（费用/质量/便利性）
+            - "去香港哪家医院看好" - VAGUE，"好"的标准不明确
+            - "怎么办" - VAGUE，完全不知道要解决什么问题
+"""
+
+
+class ChainMetricsHandler(BaseCallbackHandler):
+    """记录每次上游调用的耗时和 token 数；以内联方式运行，避免异步路径为回调切换线程"""
+    run_inline = True
+
+    def __init__(self, chain_name: str):
+        self.chain_name = chain_name
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        estimated = sum(estimate_tokens(message.content) for batch in messages for message in batch)
+        self._started[run_id] = (time.perf_counter(), estimated)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = (time.perf_counter(), sum(estimate_tokens(prompt) for prompt in prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, estimated = self._started.pop(run_id, (None, None))
+        if started is not None:
+            LLM_LATENCY.observe(time.perf_counter() - started, self.chain_name)
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            PROMPT_TOKENS.inc(self.chain_name, amount=usage.get("prompt_tokens", 0))
+            COMPLETION_TOKENS.inc(self.chain_name, amount=usage.get("completion_tokens", 0))
+        prompt_tokens = usage.get("prompt_tokens") or estimated
+        if prompt_tokens:
+            PROMPT_SIZE.observe(prompt_tokens, self.chain_name)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+class BaseChain:
+    """链的公共部分：共享的模型客户端、JSON 解析器和提示模板
+
+    配置了多个上游后端时，每个后端各有一条完整的链，每次调用由路由器选择其中之一。
+    """
+    name = None  # 指标中的链名
+    output_model = None
+    cacheable = False  # 输出只由输入决定时才允许缓存
+
+    # 链类 -> (解析器, 提示模板)，进程内所有实例共享；在 fork 前预加载时由各工作进程写时复制共享
+    _compiled = {}
+    _compile_lock = threading.Lock()
+
+    def __init__(self):
+        self.model_name = Config.CHAIN_MODELS.get(self.name, Config.MODEL_NAME)
+        self.parser, self.prompt = self.compile()
+        self.router = get_router(self.name)
+        backends = get_backends()
+        self.models = {
+            name: get_chat_model(self.model_name, *backends[name], json_mode=Config.LLM_JSON_MODE)
+            for name in self.router.backend_names
+        }
+        # 流式调用直接读取模型输出的文本，由 _parse_stream 解析，最终结果严格校验
+        self.generators = {name: self.prompt | model for name, model in self.models.items()}
+        self.chains = {name: generator | self.parser for name, generator in self.generators.items()}
+        self.cache = get_response_cache() if self.cacheable else None
+        self.cache_namespace = self._build_cache_namespace()
+        self.run_config = {"callbacks": [ChainMetricsHandler(self.name)]}
+        self.admission = get_admission_controller()
+        self.latency = LatencyTracker()
+        self.latency_budget = Config.CHAIN_LATENCY_BUDGETS.get(self.name)
+        # 批量调用中每条输入单独申请上游名额
+        self.admitted_chain = RunnableLambda(self._admitted_invoke, afunc=self._admitted_ainvoke)
+
+    @classmethod
+    def compile(cls):
+        """构建（或复用）该链的解析器和提示模板，格式说明的 JSON Schema 每个进程只渲染一次"""
+        compiled = cls._compiled.get(cls)
+        if compiled is None:
+            with cls._compile_lock:
+                compiled = cls._compiled.get(cls)
+                if compiled is None:
+                    parser = RepairingJsonOutputParser(pydantic_object=cls.output_model, chain_name=cls.name)
+                    compiled = cls._compiled[cls] = (parser, cls._create_prompt(parser))
+        return compiled
+
+    @classmethod
+    def _create_prompt(cls, parser: JsonOutputParser):
+        raise NotImplementedError
+
+    @classmethod
+    def _format_instructions(cls, parser: JsonOutputParser):
+        """完整变体使用解析器生成的 JSON Schema 说明，精简变体只列出字段"""
+        if Config.PROMPT_VARIANT == "compact":
+            return compact_format_instructions(cls.output_model)
+        return parser.get_format_instructions()
+
+    @staticmethod
+    def _examples(text: str):
+        """少样本示例只在完整变体中保留"""
+        return "" if Config.PROMPT_VARIANT == "compact" else text
+
+    def _build_cache_namespace(self):
+        """缓存命名空间：链名 + 模型名 + 提示变体 + 提示模板摘要，修改提示后旧缓存自动失效"""
+        template = self.prompt.messages[0].prompt.template
+        digest = hashlib.sha1(template.encode("utf-8")).hexdigest()[:12]
+        return f"{type(self).__name__}:{self.model_name}:{Config.PROMPT_VARIANT}:{digest}"
+
+    def _run(self, inputs: dict):
+        key = ResponseCache.make_key(self.cache_namespace, inputs)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                CHAIN_CALLS.inc(self.name, "cache_hit")
+                return dict(cached)
+
+        return dict(_inflight.do(key, lambda: self._invoke_and_store(key, inputs)))
+
+    async def _arun(self, inputs: dict):
+        key = ResponseCache.make_key(self.cache_namespace, inputs)
+        if self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                CHAIN_CALLS.inc(self.name, "cache_hit")
+                return dict(cached)
+
+        return dict(await _inflight.ado(key, lambda: self._ainvoke_and_store(key, inputs)))
+
+    def _batch(self, inputs_list: list, max_concurrency: int):
+        """批量调用：先查缓存，未命中的部分并发调用；按输入顺序返回，单条失败时对应位置为异常对象"""
+        keys = [ResponseCache.make_key(self.cache_namespace, inputs) for inputs in inputs_list]
+        results, pending = self._batch_lookup(keys)
+        if pending:
+            outputs = self.admitted_chain.batch(
+                [inputs_list[i] for i in pending],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True
+            )
+            self._batch_store(keys, results, pending, outputs)
+        return results
+
+    async def _abatch(self, inputs_list: list, max_concurrency: int):
+        keys = [ResponseCache.make_key(self.cache_namespace, inputs) for inputs in inputs_list]
+        # 缓存可能要读 SQLite 持久层，整批查找放到线程池中，不阻塞事件循环
+        results, pending = await asyncio.to_thread(self._batch_lookup, keys)
+        if pending:
+            outputs = await self.admitted_chain.abatch(
+                [inputs_list[i] for i in pending],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True
+            )
+            self._batch_store(keys, results, pending, outputs)
+        return results
+
+    def _batch_lookup(self, keys: list):
+        results = [None] * len(keys)
+        pending = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                CHAIN_CALLS.inc(self.name, "cache_hit")
+                results[i] = dict(cached)
+            else:
+                pending.append(i)
+        return results, pending
+
+    def _batch_store(self, keys: list, results: list, pending: list, outputs: list):
+        for i, output in zip(pending, outputs):
+            results[i] = output
+            CHAIN_CALLS.inc(self.name, self._outcome(output if isinstance(output, Exception) else None))
+            if self.cache is not None and not isinstance(output, Exception):
+                self.cache.set(keys[i], output)
+
+    def _stream(self, inputs: dict):
+        """流式调用：逐步产出增量解析出的 JSON 对象，命中缓存时直接产出完整结果"""
+        key = ResponseCache.make_key(self.cache_namespace, inputs)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                CHAIN_CALLS.inc(self.name, "cache_hit")
+                yield dict(cached)
+                return
+
+        result = None
+        with self._upstream_slot():
+            started = time.perf_counter()
+            try:
+                with self.router.route() as backend:
+                    text = ""
+                    for chunk in self.generators[backend].stream(inputs, config=self.run_config):
+                        text += chunk.content
+                        partial = self._parse_stream(text, result)
+                        if partial is not None:
+                            result = partial
+                            yield partial
+                    partial = self._parse_stream(text, result, final=True)
+                    if partial is not None:
+                        result = partial
+                        yield partial
+            except Exception as e:
+                self._record_call(started, e)
+                raise
+            self._record_call(started)
+        if self.cache is not None and result is not None:
+            self.cache.set(key, result)
+
+    async def _astream(self, inputs: dict):
+        key = ResponseCache.make_key(self.cache_namespace, inputs)
+        if self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                CHAIN_CALLS.inc(self.name, "cache_hit")
+                yield dict(cached)
+                return
+
+        result = None
+        async with self._aupstream_slot():
+            started = time.perf_counter()
+            try:
+                with self.router.route() as backend:
+                    text = ""
+                    async for chunk in self.generators[backend].astream(inputs, config=self.run_config):
+                        text += chunk.content
+                        partial = self._parse_stream(text, result)
+                        if partial is not None:
+                            result = partial
+                            yield partial
+                    partial = self._parse_stream(text, result, final=True)
+                    if partial is not None:
+                        result = partial
+                        yield partial
+            except Exception as e:
+                self._record_call(started, e)
+                raise
+            self._record_call(started)
+        if self.cache is not None and result is not None:
+            self.cache.set(key, result)
+
+    def _parse_stream(self, text: str, previous: dict, final: bool = False):
+        """解析到目前为止的流式输出，结果有变化时返回；final 时严格解析，输出被截断或不符合输出模型时抛出异常"""
+        parsed = self.parser.parse_result([Generation(text=text)], partial=not final)
+        return None if parsed is None or parsed == previous else parsed
+
+    def _invoke_and_store(self, key: str, inputs: dict):
+        deadline = call_deadline(self.latency_budget)
+        hedge_delay = self._hedge_delay()
+        if deadline is None and hedge_delay is None:
+            result = self._attempt(inputs)
+        else:
+            result = hedged_call(
+                self.name,
+                lambda: self._attempt(inputs, deadline),
+                lambda: self._timed_invoke(inputs, deadline),
+                hedge_delay,
+                deadline,
+                self.admission
+            )
+
+        if self.cache is not None:
+            self.cache.set(key, result)
+        return result
+
+    async def _ainvoke_and_store(self, key: str, inputs: dict):
+        deadline = call_deadline(self.latency_budget)
+        hedge_delay = self._hedge_delay()
+        if deadline is None and hedge_delay is None:
+            result = await self._aattempt(inputs)
+        else:
+            result = await ahedged_call(
+                self.name,
+                lambda: self._aattempt(inputs, deadline),
+                lambda: self._atimed_invoke(inputs, deadline),
+                hedge_delay,
+                deadline,
+                self.admission
+            )
+
+        if self.cache is not None:
+            self.cache.set(key, result)
+        return result
+
+    def _hedge_delay(self):
+        """主请求超过该时长仍未返回时发出对冲请求；样本不足或未启用时不对冲"""
+        if not Config.HEDGE_ENABLED:
+            return None
+        threshold = self.latency.percentile(Config.HEDGE_PERCENTILE)
+        return None if threshold is None else max(Config.HEDGE_MIN_DELAY, threshold)
+
+    def _attempt(self, inputs: dict, deadline: float = None):
+        with self._upstream_slot(deadline):
+            return self._timed_invoke(inputs, deadline)
+
+    async def _aattempt(self, inputs: dict, deadline: float = None):
+        async with self._aupstream_slot(deadline):
+            return await self._atimed_invoke(inputs, deadline)
+
+    def _timed_invoke(self, inputs: dict, deadline: float = None):
+        started = time.perf_counter()
+        try:
+            result = self._routed_invoke(inputs, deadline)
+        except Exception as e:
+            self._record_call(started, e)
+            raise
+        self._record_call(started)
+        return result
+
+    async def _atimed_invoke(self, inputs: dict, deadline: float = None):
+        started = time.perf_counter()
+        try:
+            result = await self._arouted_invoke(inputs, deadline)
+        except Exception as e:
+            self._record_call(started, e)
+            raise
+        self._record_call(started)
+        return result
+
+    def _routed_invoke(self, inputs: dict, deadline: float = None):
+        """在路由选出的后端上调用；连接失败（请求没有到达上游）时换一个后端重试一次"""
+        backend = None
+        try:
+            with self.router.route() as backend:
+                return self._chain(backend, deadline).invoke(inputs, config=self.run_config)
+        except openai.APIConnectionError as e:
+            if not self._can_fail_over(e):
+                raise
+        with self.router.route(exclude=backend) as backend:
+            return self._chain(backend, deadline).invoke(inputs, config=self.run_config)
+
+    async def _arouted_invoke(self, inputs: dict, deadline: float = None):
+        backend = None
+        try:
+            with self.router.route() as backend:
+                return await self._chain(backend, deadline).ainvoke(inputs, config=self.run_config)
+        except openai.APIConnectionError as e:
+            if not self._can_fail_over(e):
+                raise
+        with self.router.route(exclude=backend) as backend:
+            return await self._chain(backend, deadline).ainvoke(inputs, config=self.run_config)
+
+    def _chain(self, backend: str, deadline: float = None):
+        """后端上的调用链；有截止时间时以剩余时间作为本次上游请求的超时，超过截止时间的请求不再占用连接"""
+        if deadline is None:
+            return self.chains[backend]
+        timeout = min(Config.LLM_REQUEST_TIMEOUT, max(MIN_REQUEST_TIMEOUT, deadline - time.monotonic()))
+        return self.prompt | self.models[backend].bind(timeout=timeout) | self.parser
+
+    def _can_fail_over(self, error: Exception):
+        # 读超时时上游可能已经在处理，不再换后端重复发送
+        return len(self.chains) > 1 and not isinstance(error, openai.APITimeoutError)
+
+    def _admitted_invoke(self, inputs: dict):
+        with self._upstream_slot():
+            return self._routed_invoke(inputs)
+
+    async def _admitted_ainvoke(self, inputs: dict):
+        async with self._aupstream_slot():
+            return await self._arouted_invoke(inputs)
+
+    def _upstream_slot(self, deadline: float = None):
+        """占用一个上游调用名额；上游满载时抛出 UpstreamOverloaded，排队时间不超过截止时间"""
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.slot(self._queue_timeout(deadline))
 
+    def _aupstream_slot(self, deadline: float = None):
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.aslot(self._queue_timeout(deadline))
+
+    def _queue_timeout(self, deadline: float = None):
+        if deadline is None:
+            return None
+        return max(0.0, min(self.admission.queue_timeout, deadline - time.monotonic()))
+
+    def _record_call(self, started: float, error: Exception = None):
+        elapsed = time.perf_counter() - started
+        CHAIN_LATENCY.observe(elapsed, self.name)
+        CHAIN_CALLS.inc(self.name, self._outcome(error))
+        if error is None:
+            self.latency.observe(elapsed)
+
+    @staticmethod
+    def _outcome(error: Exception = None):
+        if error is None:
+            return "ok"
+        return "parse_error" if isinstance(error, OutputParserException) else "error"
+
+
+class ClassifierChain(BaseChain):
+    name = "classifier"
+    output_model = Classification
+    cacheable = True
+
+    @classmethod
+    def _create_prompt(cls, parser: JsonOutputParser):
+        return ChatPromptTemplate.from_template(
+            """
+            你是一个专业的问题分析师。你的任务是判断用户的问题是否清晰明确，能够直接回答。
+
+            分类标准：
+            - SIMPLE: 问题表达清晰，有明确的询问对象和内容，虽然可能需要专业知识回答，但问题本身不模糊
+            - COMPLEX: 问题涉及多个选择或比较，需要了解用户的具体偏好、预算、背景等才能给出个性化建议
+            - VAGUE: 问题中包含模糊词汇或缺少关键信息，无法准确理解用户想问什么
+            {examples}
             注意：不要因为问题需要专业知识回答就判断为COMPLEX，只要问题本身表达清晰就是SIMPLE。
 
+            同时评估信息是否充分：intent_clear 表示已经能确定用户想问什么，
+            context_sufficient 表示已经掌握给出针对性回答所需的用户背景，confidence 是你对这些判断的把握（0 到 1）。
+            问题中已经包含用户对追问的回答时，据此判断信息是否已经足够。
+
             严格按照指示的JSON格式输出。
 
             {format_instructions}
@@ -50,25 +477,31 @@ class ClassifierChain:
 
             请分析这个问题并给出分类。
             """,
-            partial_variables={"format_instructions": self.parser.get_format_instructions()},
+            partial_variables={
+                "format_instructions": cls._format_instructions(parser),
+                "examples": cls._examples(CLASSIFIER_EXAMPLES),
+            },
         )
 
     def invoke(self, query: str):
-        return self.chain.invoke({"query": query})
+        return self._run({"query": query})
 
-class QuestionGeneratorChain:
-    def __init__(self):
-        self.model = ChatOpenAI(
-            temperature=Config.TEMPERATURE,
-            model_name=Config.MODEL_NAME,
-            openai_api_key=Config.DEEPSEEK_API_KEY,
-            openai_api_base=Config.DEEPSEEK_BASE_URL
-        )
-        self.parser = JsonOutputParser(pydantic_object=QuestionGenerator)
-        self.prompt = self._create_prompt()
-        self.chain = self.prompt | self.model | self.parser
+    async def ainvoke(self, query: str):
+        return await self._arun({"query": query})
 
-    def _create_prompt(self):
+    def batch(self, queries: list, max_concurrency: int = 8):
+        return self._batch([{"query": query} for query in queries], max_concurrency)
+
+    async def abatch(self, queries: list, max_concurrency: int = 8):
+        return await self._abatch([{"query": query} for query in queries], max_concurrency)
+
+class QuestionGeneratorChain(BaseChain):
+    name = "question_generator"
+    output_model = QuestionGenerator
+    cacheable = True
+
+    @classmethod
+    def _create_prompt(cls, parser: JsonOutputParser):
         return ChatPromptTemplate.from_template(
             """
             你是一个专业的医疗问询助手。一个用户提出了一个问题，但该问题被判断为模糊或复杂。
@@ -89,25 +522,27 @@ class QuestionGeneratorChain:
 
             请生成一个追问。
             """,
-            partial_variables={"format_instructions": self.parser.get_format_instructions()},
+            partial_variables={"format_instructions": cls._format_instructions(parser)},
         )
 
     def invoke(self, query: str, reason: str):
-        return self.chain.invoke({"query": query, "reason": reason})
+        return self._run({"query": query, "reason": reason})
 
-class FinalQueryGeneratorChain:
-    def __init__(self):
-        self.model = ChatOpenAI(
-            temperature=Config.TEMPERATURE,
-            model_name=Config.MODEL_NAME,
-            openai_api_key=Config.DEEPSEEK_API_KEY,
-            openai_api_base=Config.DEEPSEEK_BASE_URL
-        )
-        self.parser = JsonOutputParser(pydantic_object=FinalQueryGenerator)
-        self.prompt = self._create_prompt()
-        self.chain = self.prompt | self.model | self.parser
+    async def ainvoke(self, query: str, reason: str):
+        return await self._arun({"query": query, "reason": reason})
 
-    def _create_prompt(self):
+    def stream(self, query: str, reason: str):
+        return self._stream({"query": query, "reason": reason})
+
+    def astream(self, query: str, reason: str):
+        return self._astream({"query": query, "reason": reason})
+
+class FinalQueryGeneratorChain(BaseChain):
+    name = "final_query_generator"
+    output_model = FinalQueryGenerator
+
+    @classmethod
+    def _create_prompt(cls, parser: JsonOutputParser):
         return ChatPromptTemplate.from_template(
             """
             你是一个专业的问题重构专家。用户原本提出了一个问题，通过多轮追问，我们收集了更多信息。
@@ -119,17 +554,7 @@ class FinalQueryGeneratorChain:
             3. 表述自然、流畅，像真人提问
             4. 保持问题的核心意图不变
             5. 包含重要的背景信息和具体要求
-
-            示例：
-            原始问题: "在大陆看病有什么不好"
-            追问收集到的信息: 用户关心卫生问题，想了解消毒措施、病房清洁度、医护人员卫生习惯
-            最终问题: "想了解大陆医院在卫生方面的情况，包括医院的消毒措施、病房清洁度以及医护人员的卫生习惯如何？"
-
-            另一个示例：
-            原始问题: "去香港哪家医院看好"
-            追问收集到的信息: 用户是糖尿病患者，关心专科医生水平和治疗费用
-            最终问题: "作为糖尿病患者，想了解香港哪家医院的内分泌科专家比较好，治疗费用大概是什么水平？"
-
+            {examples}
             严格按照指示的JSON格式输出。
 
             {format_instructions}
@@ -139,8 +564,79 @@ class FinalQueryGeneratorChain:
 
             请生成最终的完整问题。
             """,
-            partial_variables={"format_instructions": self.parser.get_format_instructions()},
+            partial_variables={
+                "format_instructions": cls._format_instructions(parser),
+                "examples": cls._examples(FINAL_QUERY_EXAMPLES),
+            },
         )
 
     def invoke(self, conversation_summary: str):
-        return self.chain.invoke({"conversation_summary": conversation_summary})
\ No newline at end of file
+        return self._run({"conversation_summary": conversation_summary})
+
+    async def ainvoke(self, conversation_summary: str):
+        return await self._arun({"conversation_summary": conversation_summary})
+
+    def stream(self, conversation_summary: str):
+        return self._stream({"conversation_summary": conversation_summary})
+
+    def astream(self, conversation_summary: str):
+        return self._astream({"conversation_summary": conversation_summary})
+
+class ClassifyAndAskChain(BaseChain):
+    """分类与追问合并为一次调用：问题不清晰时在同一个结构化响应里直接给出追问"""
+    name = "classify_and_ask"
+    output_model = ClassifyAndAsk
+    cacheable = True
+
+    @classmethod
+    def _create_prompt(cls, parser: JsonOutputParser):
+        return ChatPromptTemplate.from_template(
+            """
+            你是一个专业的问题分析师兼医疗问询助手。你需要先判断用户的问题是否清晰明确，
+            如果不够清晰，再生成1个追问帮助用户明确需求。
+
+            分类标准：
+            - SIMPLE: 问题表达清晰，有明确的询问对象和内容，虽然可能需要专业知识回答，但问题本身不模糊
+            - COMPLEX: 问题涉及多个选择或比较，需要了解用户的具体偏好、预算、背景等才能给出个性化建议
+            - VAGUE: 问题中包含模糊词汇或缺少关键信息，无法准确理解用户想问什么
+            {examples}
+            注意：不要因为问题需要专业知识回答就判断为COMPLEX，只要问题本身表达清晰就是SIMPLE。
+
+            同时评估信息是否充分：intent_clear 表示已经能确定用户想问什么，
+            context_sufficient 表示已经掌握给出针对性回答所需的用户背景，confidence 是你对这些判断的把握（0 到 1）。
+            问题中已经包含用户对追问的回答时，据此判断信息是否已经足够。
+
+            分类为 COMPLEX 或 VAGUE 时，围绕"当前需要"生成追问，追问应该：
+            1. 一次只问一个问题
+            2. 自然、口语化
+            3. 针对性强，直击问题核心
+            4. 提供选项或引导方向
+            分类为 SIMPLE 时，question 为空字符串。
+
+            严格按照指示的JSON格式输出。
+
+            {format_instructions}
+
+            用户问题: "{query}"
+            当前需要: "{strategy}"
+
+            请给出分类，并在需要时生成一个追问。
+            """,
+            partial_variables={
+                "format_instructions": cls._format_instructions(parser),
+                "examples": cls._examples(CLASSIFY_AND_ASK_EXAMPLES),
+            },
+        )
+
+    def invoke(self, query: str, strategy: str):
+        return self._run({"query": query, "strategy": strategy})
+
+    async def ainvoke(self, query: str, strategy: str):
+        return await self._arun({"query": query, "strategy": strategy})
+
+
+def preload():
+    """编译所有链的提示模板，不创建任何网络连接；供 gunicorn --preload 等在 fork 前的主进程中调用"""
+    llm_client.preload()
+    for chain_class in (ClassifierChain, QuestionGeneratorChain, FinalQueryGeneratorChain, ClassifyAndAskChain):
+        chain_class.compile()
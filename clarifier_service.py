@@ -1,11 +1,34 @@
-from chains import ClassifierChain, QuestionGeneratorChain, FinalQueryGeneratorChain
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from event_log import event_log
+from pre_classifier import get_pre_classifier
+from semantic_cache import get_semantic_cache
+from prompt_budget import fit_rounds
+from session_store import ConversationTurn
+
+# 推测执行模式下并行生成追问的线程池，所有服务实例共享
+_speculation_executor = ThreadPoolExecutor(max_workers=Config.SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+# 线程池的空闲线程数；没有空闲线程时退回顺序执行，追问不在线程池中排队（排队会比顺序执行更慢）
+_speculation_slots = threading.BoundedSemaphore(Config.SPECULATIVE_WORKERS)
+
+
+def _speculate(fn, *args):
+    """在推测执行线程池中执行，结束时归还名额"""
+    try:
+        return fn(*args)
+    finally:
+        _speculation_slots.release()
 
 
 class ClarifierService:
     def __init__(self, max_rounds=5):
-        self.classifier = ClassifierChain()
-        self.question_generator = QuestionGeneratorChain()
-        self.final_query_generator = FinalQueryGeneratorChain()
+        self._chains = {}  # 链在首次使用时才构建
+        self._chains_lock = threading.Lock()
+        self.pre_classifier = get_pre_classifier()
+        self.semantic_cache = get_semantic_cache()
         self.max_rounds = max_rounds
 
         # 通用的思考路径
@@ -15,6 +38,33 @@ class ClarifierService:
             "specify_details"  # 第3步：补充具体细节（如果需要）
         ]
 
+    @property
+    def classifier(self):
+        return self._get_chain("ClassifierChain")
+
+    @property
+    def question_generator(self):
+        return self._get_chain("QuestionGeneratorChain")
+
+    @property
+    def final_query_generator(self):
+        return self._get_chain("FinalQueryGeneratorChain")
+
+    @property
+    def classify_and_ask(self):
+        return self._get_chain("ClassifyAndAskChain") if Config.ROUND_MODE == "fused" else None
+
+    def _get_chain(self, class_name: str):
+        """首次使用时才导入 langchain 并构建链，加快进程启动"""
+        chain = self._chains.get(class_name)
+        if chain is None:
+            with self._chains_lock:
+                chain = self._chains.get(class_name)
+                if chain is None:
+                    import chains
+                    chain = self._chains[class_name] = getattr(chains, class_name)()
+        return chain
+
     def run_clarifier_flow(self, user_query: str):
         """运行完整的澄清器流程"""
         print(f"--- 开始处理新问题: '{user_query}' ---")
@@ -28,8 +78,10 @@ class ClarifierService:
             round_count += 1
             print(f"\n=== 第 {round_count} 轮分析 ===")
 
-            # 问题分类
-            classification_result = self.classifier.invoke(current_query)
+            # 问题分类（需要继续追问时同时生成追问）
+            classification_result, current_strategy, question = self._run_round(
+                current_query, conversation_history, round_count
+            )
             print(f"问题分类: {classification_result['classification']}")
             print(f"原因: {classification_result['reason']}")
 
@@ -43,18 +95,13 @@ class ClarifierService:
                 print(f"⚠️ 已达到最大追问轮数({self.max_rounds})，结束追问。")
                 break
 
-            # 确定当前应该使用的策略
-            current_strategy = self._determine_strategy(conversation_history, classification_result)
-            print(f"📋 当前策略: {self._get_strategy_description(current_strategy)}")
+            # 如果已经收集到足够的信息，提前结束
+            if question is None:
+                print("✅ 已经收集到足够的信息，提前结束追问。")
+                break
 
-            # 生成针对性追问
+            print(f"📋 当前策略: {self._get_strategy_description(current_strategy)}")
             print("正在生成追问...")
-            clarifying_question_result = self.question_generator.invoke(
-                current_query,
-                f"{classification_result['reason']} | 当前需要: {self._get_strategy_description(current_strategy)}"
-            )
-            question = clarifying_question_result['question']
-
             print(f"追问: {question}")
 
             # 获取用户回答
@@ -66,19 +113,15 @@ class ClarifierService:
                 break
 
             # 记录对话历史
-            conversation_history.append({
-                'round': round_count,
-                'strategy': current_strategy,
-                'question': question,
-                'user_answer': user_answer
-            })
+            conversation_history.append(ConversationTurn(round_count, current_strategy, question, user_answer))
 
             # 智能更新当前查询
             current_query = self._update_query_with_strategy(user_query, conversation_history)
             print(f"已更新查询内容: {current_query}")
 
         # 生成最终总结
-        final_summary = self._generate_final_summary(user_query, conversation_history)
+        final_query = self._build_comprehensive_final_query(user_query, conversation_history, console=True)
+        final_summary = self._generate_final_summary(user_query, conversation_history, final_query)
 
         print("\n" + "=" * 60)
         print("🎯 最终总结:")
@@ -87,14 +130,240 @@ class ClarifierService:
 
         return final_summary
 
+    def classify_batch(self, queries: list, max_concurrency: int = None):
+        """批量分类（不创建会话），按输入顺序返回结果，单条失败不影响其他问题"""
+        results, pending = self._pre_classify_batch(queries)
+        if pending:
+            outputs = self.classifier.batch(
+                [queries[i] for i in pending],
+                max_concurrency or Config.BATCH_MAX_CONCURRENCY
+            )
+            for i, output in zip(pending, outputs):
+                results[i] = self._batch_item(queries[i], output)
+        return results
+
+    async def aclassify_batch(self, queries: list, max_concurrency: int = None):
+        """批量分类（异步）"""
+        results, pending = self._pre_classify_batch(queries)
+        if pending:
+            outputs = await self.classifier.abatch(
+                [queries[i] for i in pending],
+                max_concurrency or Config.BATCH_MAX_CONCURRENCY
+            )
+            for i, output in zip(pending, outputs):
+                results[i] = self._batch_item(queries[i], output)
+        return results
+
+    def _pre_classify_batch(self, queries: list):
+        """批量分类前先走本地预分类，返回已有结果和需要调用大模型的下标"""
+        results = [None] * len(queries)
+        pending = []
+        for i, query in enumerate(queries):
+            classification_result = self._pre_classify(query, [])
+            if classification_result is None:
+                pending.append(i)
+            else:
+                results[i] = self._batch_item(query, classification_result)
+        return results, pending
+
+    def _batch_item(self, query: str, output):
+        """单条批量分类结果"""
+        if isinstance(output, Exception):
+            return {'query': query, 'status': 'error', 'message': str(output)}
+        return {
+            'query': query,
+            'status': 'ok',
+            'classification': output['classification'],
+            'reason': output['reason']
+        }
+
+    def _run_round(self, current_query: str, conversation_history: list, round_count: int):
+        """执行一轮分析：先分类，需要继续追问时确定策略并生成追问
+
+        返回 (classification_result, strategy, question)，无需追问时 strategy 和 question 为 None
+        """
+        classification_result = self._pre_classify(current_query, conversation_history)
+        if classification_result is None:
+            if (Config.ROUND_MODE == "speculative" and round_count < self.max_rounds
+                    and _speculation_slots.acquire(blocking=False)):
+                return self._run_round_speculative(current_query, conversation_history, round_count)
+            if Config.ROUND_MODE == "fused" and round_count < self.max_rounds:
+                return self._run_round_fused(current_query, conversation_history, round_count)
+
+            classification_result = self.classifier.invoke(current_query)
+
+        if not self._needs_question(classification_result, conversation_history, round_count):
+            return classification_result, None, None
+
+        # 确定当前应该使用的策略并生成针对性追问
+        current_strategy = self._determine_strategy(conversation_history, classification_result)
+        clarifying_question_result = self.question_generator.invoke(
+            current_query,
+            self._question_reason(classification_result['reason'], current_strategy)
+        )
+        return classification_result, current_strategy, clarifying_question_result['question']
+
+    async def _arun_round(self, current_query: str, conversation_history: list, round_count: int):
+        """执行一轮分析（异步）"""
+        classification_result = self._pre_classify(current_query, conversation_history)
+        if classification_result is None:
+            if Config.ROUND_MODE == "speculative" and round_count < self.max_rounds:
+                return await self._arun_round_speculative(current_query, conversation_history, round_count)
+            if Config.ROUND_MODE == "fused" and round_count < self.max_rounds:
+                return await self._arun_round_fused(current_query, conversation_history, round_count)
+
+            classification_result = await self.classifier.ainvoke(current_query)
+
+        if not self._needs_question(classification_result, conversation_history, round_count):
+            return classification_result, None, None
+
+        current_strategy = self._determine_strategy(conversation_history, classification_result)
+        clarifying_question_result = await self.question_generator.ainvoke(
+            current_query,
+            self._question_reason(classification_result['reason'], current_strategy)
+        )
+        return classification_result, current_strategy, clarifying_question_result['question']
+
+    def _classify(self, current_query: str, conversation_history: list):
+        """只做分类（预分类优先），供流式接口使用"""
+        classification_result = self._pre_classify(current_query, conversation_history)
+        if classification_result is None:
+            classification_result = self.classifier.invoke(current_query)
+        return classification_result
+
+    async def _aclassify(self, current_query: str, conversation_history: list):
+        """只做分类（异步）"""
+        classification_result = self._pre_classify(current_query, conversation_history)
+        if classification_result is None:
+            classification_result = await self.classifier.ainvoke(current_query)
+        return classification_result
+
+    def _pre_classify(self, current_query: str, conversation_history: list):
+        """本地预分类，只对首轮的原始问题生效；后续轮次的查询已拼接了用户回答，交给大模型判断"""
+        if self.pre_classifier is None or conversation_history:
+            return None
+        return self.pre_classifier.classify(current_query)
+
+    def _run_round_speculative(self, current_query: str, conversation_history: list, round_count: int):
+        """推测执行：分类与追问生成同时发出，无需继续追问时丢弃追问
+
+        调用方已占用一个 _speculation_slots 名额，追问生成结束（或任务在开始前被取消）时归还。
+        策略只取决于对话历史，可以在分类前确定；此时还不知道分类原因，追问使用通用原因描述。
+        """
+        try:
+            current_strategy = self._determine_strategy(conversation_history, None)
+            # 复制当前上下文，使追问生成沿用本次请求的截止时间
+            future = _speculation_executor.submit(
+                contextvars.copy_context().run,
+                _speculate,
+                self.question_generator.invoke,
+                current_query,
+                self._question_reason("问题需要进一步澄清", current_strategy)
+            )
+        except BaseException:
+            _speculation_slots.release()
+            raise
+
+        classification_result = self.classifier.invoke(current_query)
+        if not self._needs_question(classification_result, conversation_history, round_count):
+            if future.cancel():
+                _speculation_slots.release()
+            return classification_result, None, None
+
+        return classification_result, current_strategy, future.result()['question']
+
+    async def _arun_round_speculative(self, current_query: str, conversation_history: list, round_count: int):
+        """推测执行（异步），无需继续追问时取消追问任务"""
+        current_strategy = self._determine_strategy(conversation_history, None)
+        question_task = asyncio.ensure_future(self.question_generator.ainvoke(
+            current_query,
+            self._question_reason("问题需要进一步澄清", current_strategy)
+        ))
+
+        try:
+            classification_result = await self.classifier.ainvoke(current_query)
+        except BaseException:
+            question_task.cancel()
+            raise
+
+        if not self._needs_question(classification_result, conversation_history, round_count):
+            question_task.cancel()
+            return classification_result, None, None
+
+        return classification_result, current_strategy, (await question_task)['question']
+
+    def _run_round_fused(self, current_query: str, conversation_history: list, round_count: int):
+        """合并模式：一次调用同时得到分类、原因和追问"""
+        current_strategy = self._determine_strategy(conversation_history, None)
+        result = self.classify_and_ask.invoke(current_query, self._get_strategy_description(current_strategy))
+        classification_result = {key: value for key, value in result.items() if key != 'question'}
+        if not self._needs_question(classification_result, conversation_history, round_count):
+            return classification_result, None, None
+
+        question = result.get('question')
+        if not question:
+            # 模型漏给追问时退回单独的追问生成链
+            question = self.question_generator.invoke(
+                current_query,
+                self._question_reason(result['reason'], current_strategy)
+            )['question']
+        return classification_result, current_strategy, question
+
+    async def _arun_round_fused(self, current_query: str, conversation_history: list, round_count: int):
+        """合并模式（异步）"""
+        current_strategy = self._determine_strategy(conversation_history, None)
+        result = await self.classify_and_ask.ainvoke(current_query, self._get_strategy_description(current_strategy))
+        classification_result = {key: value for key, value in result.items() if key != 'question'}
+        if not self._needs_question(classification_result, conversation_history, round_count):
+            return classification_result, None, None
+
+        question = result.get('question')
+        if not question:
+            question = (await self.question_generator.ainvoke(
+                current_query,
+                self._question_reason(result['reason'], current_strategy)
+            ))['question']
+        return classification_result, current_strategy, question
+
+    def _needs_question(self, classification_result: dict, conversation_history: list, round_count: int):
+        """问题仍不清晰、信息还不充分且未达到最大轮数时才需要生成追问"""
+        return self._finish_reason(classification_result, conversation_history, round_count) is None
+
+    def _finish_reason(self, classification_result: dict, conversation_history: list, round_count: int):
+        """结束追问的原因 simple / max_rounds / sufficient（已收集到足够信息，提前结束），仍需追问时返回 None"""
+        if classification_result['classification'] == 'SIMPLE':
+            return 'simple'
+        if round_count >= self.max_rounds:
+            return 'max_rounds'
+        # 至少回答过一轮追问后，分类模型有把握地认为意图和背景都已明确
+        if conversation_history and all(self._confident_signals(classification_result)):
+            return 'sufficient'
+        return None
+
+    def _confident_signals(self, classification_result: dict):
+        """分类模型的信息充分性判断 (意图已明确, 背景已充分)；未启用、缺少字段或置信度不足时都视为 False"""
+        if not Config.EARLY_FINISH_ENABLED or not classification_result:
+            return False, False
+        try:
+            confidence = float(classification_result.get('confidence') or 0)
+        except (TypeError, ValueError):
+            return False, False
+        if confidence < Config.EARLY_FINISH_CONFIDENCE:
+            return False, False
+        return (classification_result.get('intent_clear') is True,
+                classification_result.get('context_sufficient') is True)
+
+    def _question_reason(self, reason: str, strategy: str):
+        """拼接追问生成链的原因描述"""
+        return f"{reason} | 当前需要: {self._get_strategy_description(strategy)}"
+
     def _determine_strategy(self, conversation_history: list, classification_result: dict):
-        """确定当前应该使用的澄清策略"""
-        if not conversation_history:
-            return "understand_intent"
+        """确定当前应该使用的澄清策略；分类模型有把握地认为意图或背景已经明确时跳过对应阶段"""
+        intent_clear, context_sufficient = self._confident_signals(classification_result)
 
         # 检查是否已经理解了用户意图
-        has_intent = any(conv['strategy'] == 'understand_intent' for conv in conversation_history)
-        has_context = any(conv['strategy'] == 'gather_context' for conv in conversation_history)
+        has_intent = intent_clear or any(conv.strategy == 'understand_intent' for conv in conversation_history)
+        has_context = context_sufficient or any(conv.strategy == 'gather_context' for conv in conversation_history)
 
         if not has_intent:
             return "understand_intent"
@@ -106,8 +375,8 @@ class ClarifierService:
     def _needs_user_context(self, conversation_history: list):
         """判断是否需要收集用户背景信息"""
         # 检查用户意图是否涉及个人化建议或需要背景信息
-        intent_answers = [conv['user_answer'] for conv in conversation_history
-                          if conv['strategy'] == 'understand_intent']
+        intent_answers = [conv.user_answer for conv in conversation_history
+                          if conv.strategy == 'understand_intent']
 
         if not intent_answers:
             return True
@@ -153,62 +422,183 @@ class ClarifierService:
 
     def _extract_info_by_strategy(self, conversation_history: list, strategy: str):
         """提取特定策略阶段的信息"""
-        strategy_conversations = [conv for conv in conversation_history if conv['strategy'] == strategy]
+        strategy_conversations = [conv for conv in conversation_history if conv.strategy == strategy]
         if not strategy_conversations:
             return ""
 
         # 合并同一策略下的所有回答
-        answers = [conv['user_answer'] for conv in strategy_conversations]
+        answers = [conv.user_answer for conv in strategy_conversations]
         return "; ".join(answers)
 
-    def _generate_final_summary(self, original_query: str, conversation_history: list):
-        """生成最终总结"""
+    def _generate_final_summary(self, original_query: str, conversation_history: list, final_query: str = None):
+        """生成最终总结；已生成过最终问题时直接传入，避免重复调用大模型"""
         if not conversation_history:
             return f"用户问题: {original_query}"
 
+        # 使用大模型生成最终的自然问题
+        if final_query is None:
+            final_query = self._build_comprehensive_final_query(original_query, conversation_history)
+        return self._format_final_summary(original_query, conversation_history, final_query)
+
+    async def _agenerate_final_summary(self, original_query: str, conversation_history: list,
+                                       final_query: str = None):
+        """生成最终总结（异步）"""
+        if not conversation_history:
+            return f"用户问题: {original_query}"
+
+        if final_query is None:
+            final_query = await self._abuild_comprehensive_final_query(original_query, conversation_history)
+        return self._format_final_summary(original_query, conversation_history, final_query)
+
+    def _format_final_summary(self, original_query: str, conversation_history: list, final_query: str):
+        """拼接最终总结文本"""
         summary = f"📋 对话总结:\n"
         summary += f"原始问题: {original_query}\n\n"
 
         # 按策略分组显示追问过程
         summary += f"追问过程:\n"
         for conv in conversation_history:
-            strategy_desc = self._get_strategy_description(conv['strategy'])
-            summary += f"第{conv['round']}轮 ({strategy_desc}): {conv['question']}\n"
-            summary += f"用户回答: {conv['user_answer']}\n\n"
+            strategy_desc = self._get_strategy_description(conv.strategy)
+            summary += f"第{conv.round}轮 ({strategy_desc}): {conv.question}\n"
+            summary += f"用户回答: {conv.user_answer}\n\n"
 
-        # 使用大模型生成最终的自然问题
-        final_query = self._build_comprehensive_final_query(original_query, conversation_history)
         summary += f"🎯 最终生成的用户问题:\n{final_query}"
 
         return summary
 
-    def _build_comprehensive_final_query(self, original_query: str, conversation_history: list):
-        """使用大模型构建自然的最终查询"""
+    def _build_comprehensive_final_query(self, original_query: str, conversation_history: list,
+                                         console: bool = False):
+        """使用大模型构建自然的最终查询；console 为 True 时（命令行交互流程）同时把错误打印到终端"""
         if not conversation_history:
             return original_query
 
+        # 之前有近似相同的问题和回答时直接复用生成过的最终问题
+        cached = self._lookup_similar_final_query(original_query, conversation_history)
+        if cached is not None:
+            return cached
+
         # 准备对话历史信息
         conversation_summary = self._prepare_conversation_summary(original_query, conversation_history)
 
         try:
             # 调用大模型生成自然的最终问题
             result = self.final_query_generator.invoke(conversation_summary)
+            self._store_similar_final_query(original_query, conversation_history, result['final_question'])
             return result['final_question']
         except Exception as e:
-            print(f"生成最终问题时出错: {e}")
+            event_log.warning('final_query_fallback', error=str(e))
+            if console:
+                print(f"生成最终问题时出错: {e}")
             # 如果大模型调用失败，返回一个基本的汇总
             return self._build_fallback_final_query(original_query, conversation_history)
 
+    async def _abuild_comprehensive_final_query(self, original_query: str, conversation_history: list):
+        """使用大模型构建自然的最终查询（异步）"""
+        if not conversation_history:
+            return original_query
+
+        cached = self._lookup_similar_final_query(original_query, conversation_history)
+        if cached is not None:
+            return cached
+
+        conversation_summary = self._prepare_conversation_summary(original_query, conversation_history)
+
+        try:
+            result = await self.final_query_generator.ainvoke(conversation_summary)
+            self._store_similar_final_query(original_query, conversation_history, result['final_question'])
+            return result['final_question']
+        except Exception as e:
+            event_log.warning('final_query_fallback', error=str(e))
+            return self._build_fallback_final_query(original_query, conversation_history)
+
+    def _stream_comprehensive_final_query(self, original_query: str, conversation_history: list):
+        """流式生成最终查询，逐步产出目前已生成的最终问题文本，最后一次产出即完整结果"""
+        if not conversation_history:
+            yield original_query
+            return
+
+        cached = self._lookup_similar_final_query(original_query, conversation_history)
+        if cached is not None:
+            yield cached
+            return
+
+        conversation_summary = self._prepare_conversation_summary(original_query, conversation_history)
+
+        final_query = None
+        try:
+            for partial in self.final_query_generator.stream(conversation_summary):
+                if partial.get('final_question') and partial['final_question'] != final_query:
+                    final_query = partial['final_question']
+                    yield final_query
+        except Exception as e:
+            event_log.warning('final_query_fallback', error=str(e))
+            final_query = None
+
+        if final_query is None:
+            yield self._build_fallback_final_query(original_query, conversation_history)
+        else:
+            self._store_similar_final_query(original_query, conversation_history, final_query)
+
+    async def _astream_comprehensive_final_query(self, original_query: str, conversation_history: list):
+        """流式生成最终查询（异步）"""
+        if not conversation_history:
+            yield original_query
+            return
+
+        cached = self._lookup_similar_final_query(original_query, conversation_history)
+        if cached is not None:
+            yield cached
+            return
+
+        conversation_summary = self._prepare_conversation_summary(original_query, conversation_history)
+
+        final_query = None
+        try:
+            async for partial in self.final_query_generator.astream(conversation_summary):
+                if partial.get('final_question') and partial['final_question'] != final_query:
+                    final_query = partial['final_question']
+                    yield final_query
+        except Exception as e:
+            event_log.warning('final_query_fallback', error=str(e))
+            final_query = None
+
+        if final_query is None:
+            yield self._build_fallback_final_query(original_query, conversation_history)
+        else:
+            self._store_similar_final_query(original_query, conversation_history, final_query)
+
+    def _similarity_text(self, conversation_history: list):
+        """近似重复缓存的比较文本：只包含用户回答，模型生成的追问措辞和固定格式不参与比较
+
+        原始问题作为缓存的 scope 必须完全一致（如只差一个地名的“去香港/澳门哪家医院好”），不按相似度比较。
+        """
+        return "\n".join(conv.user_answer or "" for conv in conversation_history)
+
+    def _lookup_similar_final_query(self, original_query: str, conversation_history: list):
+        if self.semantic_cache is None:
+            return None
+        return self.semantic_cache.get(self._similarity_text(conversation_history), scope=original_query)
+
+    def _store_similar_final_query(self, original_query: str, conversation_history: list, final_query: str):
+        if self.semantic_cache is not None:
+            self.semantic_cache.set(self._similarity_text(conversation_history), final_query, scope=original_query)
+
     def _prepare_conversation_summary(self, original_query: str, conversation_history: list):
-        """准备对话历史的摘要信息"""
+        """准备对话历史的摘要信息，追问过程的长度不超过 FINAL_QUERY_HISTORY_BUDGET"""
         summary = f"原始问题: {original_query}\n\n追问过程:\n"
 
+        rounds = []
         for conv in conversation_history:
-            strategy_desc = self._get_strategy_description(conv['strategy'])
-            summary += f"- {strategy_desc}: {conv['question']}\n"
-            summary += f"  用户回答: {conv['user_answer']}\n"
-
-        return summary
+            strategy_desc = self._get_strategy_description(conv.strategy)
+            rounds.append((
+                f"- {strategy_desc}: {conv.question}\n  用户回答: {conv.user_answer}\n",
+                f"- 用户回答: {conv.user_answer}\n"
+            ))
+
+        texts, dropped = fit_rounds(rounds, Config.FINAL_QUERY_HISTORY_BUDGET)
+        if dropped:
+            summary += f"- （省略了较早的 {dropped} 轮对话）\n"
+        return summary + "".join(texts)
 
     def _build_fallback_final_query(self, original_query: str, conversation_history: list):
         """当大模型调用失败时的备用方案"""
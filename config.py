@@ -5,10 +5,139 @@ load_dotenv()
 
 class Config:
     DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-    DEEPSEEK_BASE_URL = "https://api.deepseek.com"
-    MODEL_NAME = "deepseek-chat"
+    DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+    MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-chat")
     TEMPERATURE = 0
 
+    # 各链使用的模型，格式为 "链名=模型名,..."，未列出的链使用 MODEL_NAME；
+    # 例如分类这类三选一的标签可以交给更小更快的模型，只有最终问题生成使用最强的模型
+    CHAIN_MODELS = {
+        name: model for name, model in (
+            item.split("=", 1) for item in os.getenv("CHAIN_MODELS", "").split(",") if item
+        )
+    }
+
+    # 多个 OpenAI 兼容的上游后端，格式为 "名称=base_url,..."；未设置时只有 DEEPSEEK_BASE_URL 一个后端（名为 default）。
+    # 各后端的 API key 读取 LLM_BACKEND_<名称大写>_API_KEY，未设置时使用 DEEPSEEK_API_KEY
+    LLM_BACKENDS = {
+        name: base_url for name, base_url in (
+            item.split("=", 1) for item in os.getenv("LLM_BACKENDS", "").split(",") if item
+        )
+    }
+    LLM_BACKEND_API_KEYS = {name: os.getenv(f"LLM_BACKEND_{name.upper()}_API_KEY") for name in LLM_BACKENDS}
+
+    # 各链可用的后端，格式为 "链名=后端1|后端2,..."，未列出的链可以使用全部后端
+    CHAIN_BACKENDS = {
+        name: backends.split("|") for name, backends in (
+            item.split("=", 1) for item in os.getenv("CHAIN_BACKENDS", "").split(",") if item
+        )
+    }
+
+    # 后端路由：耗时和错误率滑动平均的权重；错误率达到阈值的后端暂停使用，冷却期满（秒）后放行一次探测请求
+    LLM_ROUTER_ALPHA = float(os.getenv("LLM_ROUTER_ALPHA", "0.2"))
+    LLM_ROUTER_ERROR_THRESHOLD = float(os.getenv("LLM_ROUTER_ERROR_THRESHOLD", "0.5"))
+    LLM_ROUTER_COOLDOWN = float(os.getenv("LLM_ROUTER_COOLDOWN", "30"))
+
+    # 共享 HTTP 连接池配置
+    LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+    LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+
+    # 分类与追问结果缓存（TEMPERATURE 为 0 时输出确定）
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+    RESPONSE_CACHE_SQLITE_PATH = os.getenv("RESPONSE_CACHE_SQLITE_PATH")
+    # 离线预计算的首轮结果（python warm_cache.py 历史日志.jsonl --output warm.bin 生成），启动时只读映射
+    WARM_CACHE_PATH = os.getenv("WARM_CACHE_PATH")
+
+    # 会话存储：空闲超时（秒）、数量上限、已结束会话的保留时间和后台清理间隔
+    SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+    SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+    SESSION_COMPLETED_TTL = float(os.getenv("SESSION_COMPLETED_TTL", "60"))
+    SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+    # 会话后端：memory 仅限单进程；sqlite 可供多个工作进程共享
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+
+    # 每轮处理模式：sequential 先分类再追问；speculative 分类与追问并行，分类为 SIMPLE 时丢弃追问；
+    # fused 使用 ClassifyAndAskChain 一次调用同时完成分类和追问。同步路径上同时进行的推测执行不超过 SPECULATIVE_WORKERS，
+    # 超出时该轮按 sequential 处理
+    ROUND_MODE = os.getenv("ROUND_MODE", "sequential")
+    SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "16"))
+
+    # 批量分类：单次请求的问题数上限和默认并发数
+    BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+    # 流量录制：设置后把每个会话请求追加写入该 JSONL 文件，供 benchmarks/replay_load.py 回放
+    CAPTURE_PATH = os.getenv("CAPTURE_PATH")
+
+    # 本地预分类：规则 + 可选的字符 n-gram 模型，只对首轮原始问题生效
+    PRECLASSIFIER_ENABLED = os.getenv("PRECLASSIFIER_ENABLED", "1") == "1"
+    PRECLASSIFIER_MODEL_PATH = os.getenv("PRECLASSIFIER_MODEL_PATH")
+    PRECLASSIFIER_THRESHOLD = float(os.getenv("PRECLASSIFIER_THRESHOLD", "0.97"))
+
+    # 结构化事件日志：低于 EVENT_LOG_LEVEL（debug / info / warning / error）的事件不记录，
+    # debug/info 事件再按 EVENT_LOG_SAMPLE_RATE 采样；未设置 EVENT_LOG_PATH 时写到标准输出
+    EVENT_LOG_LEVEL = os.getenv("EVENT_LOG_LEVEL", "info")
+    EVENT_LOG_SAMPLE_RATE = float(os.getenv("EVENT_LOG_SAMPLE_RATE", "1.0"))
+    EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH")
+
+    # 上游准入控制：所有链共享的并发上限（0 表示不限制）、令牌桶限速（次/秒，0 表示不限速）和突发容量，
+    # 以及有界等待队列的长度和单个请求的最长排队时间；队列已满或排队超时的请求返回 503 和 Retry-After。
+    # 并发上限默认等于连接池大小且不会超过它：多出的调用只会在连接池中不可见地排队，绕过有界队列和 503
+    UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", str(LLM_POOL_SIZE)))
+    UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", "0"))
+    UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", "10"))
+    UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "256"))
+    UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10"))
+
+    # 要求上游以 JSON 对象格式输出（response_format=json_object），上游不支持该参数时关闭
+    LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "1") == "1"
+
+    # 单次上游 HTTP 请求的超时（秒）
+    LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
+
+    # 请求整体截止时间（秒，0 表示不限制）和各链单次调用的延迟预算，格式为 "链名=秒数,..."；
+    # 生成最终问题时超过截止时间会退回到本地拼接的最终问题
+    REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "25"))
+    CHAIN_LATENCY_BUDGETS = {
+        name: float(seconds) for name, seconds in (
+            item.split("=") for item in os.getenv(
+                "CHAIN_LATENCY_BUDGETS",
+                "classifier=8,question_generator=10,classify_and_ask=12,final_query_generator=15"
+            ).split(",") if item
+        )
+    }
+
+    # 对冲请求：调用超过该链近期耗时的 HEDGE_PERCENTILE 分位（且不少于 HEDGE_MIN_DELAY 秒）仍未返回时，
+    # 再发出一次相同请求，取先成功解析的结果
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+    HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+
+    # 导入 api_service 时预先编译所有链的提示模板，配合 gunicorn --preload 让工作进程 fork 后直接共享；
+    # 默认关闭，链在首次使用时才构建
+    PRELOAD_CHAINS = os.getenv("PRELOAD_CHAINS", "0") == "1"
+
+    # 提前结束追问：已回答过至少一轮，且分类模型以不低于阈值的置信度判断意图和用户背景都已明确时，直接生成最终问题
+    EARLY_FINISH_ENABLED = os.getenv("EARLY_FINISH_ENABLED", "1") == "1"
+    EARLY_FINISH_CONFIDENCE = float(os.getenv("EARLY_FINISH_CONFIDENCE", "0.8"))
+
+    # 最终问题的近似重复缓存：原始问题完全相同，用户回答的字符 shingle 相似度不低于阈值、且逐行的否定词、数字和单位
+    # 完全一致时复用之前生成的最终问题。字符相似度不能区分所有改变事实的改写，默认关闭
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "200000"))
+
+    # 提示变体：full 使用完整的 JSON Schema 格式说明和少样本示例；compact 只列出输出字段、不带示例，输入 token 更少
+    PROMPT_VARIANT = os.getenv("PROMPT_VARIANT", "full")
+
+    # 生成最终问题时对话历史的 token 预算（估算值，0 表示不限制）：超出时较早的轮次只保留用户回答，仍超出时省略最早的轮次
+    FINAL_QUERY_HISTORY_BUDGET = int(os.getenv("FINAL_QUERY_HISTORY_BUDGET", "800"))
+
     @classmethod
     def validate(cls):
         if not cls.DEEPSEEK_API_KEY:
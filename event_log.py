@@ -0,0 +1,111 @@
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from config import Config
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+class EventLogger:
+    """结构化 JSON 事件日志：请求线程只把事件放入队列，由后台线程统一写出
+
+    低于 level 的事件直接丢弃；debug/info 事件再按 sample_rate 采样，warning 及以上总是记录。
+    队列满时丢弃事件并计数，不阻塞请求线程。
+    """
+
+    def __init__(self, level: str = 'info', sample_rate: float = 1.0, stream=None, queue_size: int = 10000):
+        self.threshold = LEVELS[level]
+        self.sample_rate = sample_rate
+        self.stream = stream or sys.stdout
+        self.dropped = 0
+        self.queue_size = queue_size
+        self._start_writer()
+        atexit.register(self.close)
+        # fork 出的工作进程不会继承后台线程，需要重新启动
+        os.register_at_fork(after_in_child=self._start_writer)
+
+    def _start_writer(self):
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._writer = threading.Thread(target=self._write_loop, name="event-log-writer", daemon=True)
+        self._writer.start()
+
+    def enabled(self, level: str):
+        """该级别是否会被记录（不含采样），用于跳过昂贵的字段构造"""
+        return LEVELS[level] >= self.threshold
+
+    def log(self, level: str, event: str, **fields):
+        severity = LEVELS[level]
+        if severity < self.threshold:
+            return
+        if severity < LEVELS['warning'] and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+
+        record = {'ts': round(time.time(), 6), 'level': level, 'event': event}
+        record.update(fields)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event: str, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event: str, **fields):
+        self.log('info', event, **fields)
+
+    def warning(self, event: str, **fields):
+        self.log('warning', event, **fields)
+
+    def error(self, event: str, **fields):
+        self.log('error', event, **fields)
+
+    def close(self):
+        """写完队列中剩余的事件后停止后台线程"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+
+    def _write_loop(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+
+            lines = [json.dumps(record, ensure_ascii=False, default=str)]
+            # 一次取完当前积压的事件后再统一 flush，减少写调用
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write(lines)
+                    return
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            self._write(lines)
+
+    def _write(self, lines: list):
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def elapsed_ms(started: float):
+    """从 perf_counter 起点到现在的毫秒数"""
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def _create_event_logger():
+    stream = open(Config.EVENT_LOG_PATH, "a", encoding="utf-8") if Config.EVENT_LOG_PATH else None
+    return EventLogger(Config.EVENT_LOG_LEVEL, Config.EVENT_LOG_SAMPLE_RATE, stream)
+
+
+# 进程内共享的事件日志
+event_log = _create_event_logger()
@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+from metrics import REGISTRY, Counter
+
+HEDGED_CALLS = REGISTRY.register(Counter(
+    "clarifier_hedged_calls_total", "对冲请求次数，outcome 为 launched / won（采用了对冲请求的结果）/ skipped（上游无空闲名额）",
+    ("chain", "outcome")))
+DEADLINE_EXCEEDED = REGISTRY.register(Counter(
+    "clarifier_deadline_exceeded_total", "超过请求截止时间或链延迟预算的调用次数", ("chain",)))
+
+# 当前请求的截止时间（time.monotonic），由接口层设置；异步任务会自动继承
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+# 对冲请求没有发出（主请求先结束、已过截止时间或上游无空闲名额）
+_NOT_LAUNCHED = object()
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求截止时间或链的延迟预算已用完"""
+
+
+@contextmanager
+def request_deadline(seconds: float):
+    """为当前请求设置整体截止时间，嵌套时取更早的一个；seconds 为 0 或 None 时不限制"""
+    if not seconds:
+        yield
+        return
+
+    deadline = time.monotonic() + seconds
+    current = _request_deadline.get()
+    token = _request_deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def call_deadline(budget: float = None):
+    """单次链调用的截止时间：请求截止时间与链延迟预算中更早的一个，都没有时返回 None"""
+    deadline = _request_deadline.get()
+    if budget:
+        budget_deadline = time.monotonic() + budget
+        deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
+    return deadline
+
+
+class LatencyTracker:
+    """最近若干次调用耗时的滑动窗口，用于计算对冲阈值
+
+    分位数每 recompute_every 次观测才重新排序计算一次，读取时只返回缓存值。
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20, recompute_every: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self.recompute_every = recompute_every
+        self._lock = threading.Lock()
+        self._samples = [0.0] * window
+        self._count = 0
+        self._percentiles = {}
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples[self._count % self.window] = seconds
+            self._count += 1
+            if self._count % self.recompute_every == 0:
+                self._percentiles = {}
+
+    def percentile(self, p: float):
+        """第 p 百分位耗时；样本不足时返回 None"""
+        with self._lock:
+            if self._count < self.min_samples:
+                return None
+            value = self._percentiles.get(p)
+            if value is None:
+                samples = sorted(self._samples[:min(self._count, self.window)])
+                value = samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+                self._percentiles[p] = value
+            return value
+
+
+def hedged_call(chain_name: str, attempt, hedge_attempt, hedge_delay: float = None, deadline: float = None,
+                admission=None):
+    """同步对冲调用；attempt / hedge_attempt 为无参函数，各自在独立线程中执行，调用方等待先成功的结果
+
+    主请求超过 hedge_delay 仍未返回时发出一次对冲请求，并在开始时才向 admission 申请上游名额、不排队，
+    没有空闲名额时放弃对冲。超过 deadline 时抛出 DeadlineExceeded，不再等待的请求在后台执行完（上游请求超时
+    由调用方按剩余时间设置）。每次调用单独起线程，不受固定大小线程池的限制；并发上限由 admission 控制。
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        _deadline_exceeded(chain_name)
+
+    hedge_at = None if hedge_delay is None else time.monotonic() + hedge_delay
+    primary = _start_thread(attempt)
+    pending = {primary}
+    hedge = None
+    try:
+        while True:
+            done, pending = wait(pending, timeout=_wait_timeout(chain_name, deadline, hedge_at),
+                                 return_when=FIRST_COMPLETED)
+            if primary in done and primary.exception() is None:
+                return primary.result()
+            if hedge in done and hedge.exception() is None and hedge.result() is not _NOT_LAUNCHED:
+                HEDGED_CALLS.inc(chain_name, "won")
+                return hedge.result()
+            if not pending:
+                raise primary.exception()
+
+            now = time.monotonic()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if deadline is None or now < deadline:
+                    hedge = _start_thread(_run_hedge, chain_name, hedge_attempt, admission)
+                    pending.add(hedge)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _start_thread(fn, *args):
+    """在新的守护线程中执行 fn（继承调用方的 contextvars），返回其结果的 Future"""
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(fn, *args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedged-call", daemon=True).start()
+    return future
+
+
+def _run_hedge(chain_name: str, hedge_attempt, admission):
+    if admission is not None and not admission.try_acquire():
+        HEDGED_CALLS.inc(chain_name, "skipped")
+        return _NOT_LAUNCHED
+    HEDGED_CALLS.inc(chain_name, "launched")
+    started = time.monotonic()
+    try:
+        return hedge_attempt()
+    finally:
+        if admission is not None:
+            admission.release(time.monotonic() - started)
+
+
+async def ahedged_call(chain_name: str, attempt, hedge_attempt, hedge_delay: float = None, deadline: float = None,
+                       admission=None):
+    """异步对冲调用；attempt / hedge_attempt() 返回协程，先成功的结果返回后取消另一个请求
+
+    对冲请求在任务开始执行时才向 admission 申请名额：还没开始就被取消的对冲任务不会占用名额。
+    截止时间已过时不再发出对冲请求。
+    """
+    hedge_at = None if hedge_delay is None else time.monotonic() + hedge_delay
+    primary = asyncio.ensure_future(attempt())
+    pending = {primary}
+    hedge = None
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, timeout=_wait_timeout(chain_name, deadline, hedge_at),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if primary in done and primary.exception() is None:
+                return primary.result()
+            if hedge in done and hedge.exception() is None and hedge.result() is not _NOT_LAUNCHED:
+                HEDGED_CALLS.inc(chain_name, "won")
+                return hedge.result()
+            if not pending:
+                # 主请求失败，且对冲请求没有发出或也失败了
+                raise primary.exception()
+
+            now = time.monotonic()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if deadline is None or now < deadline:
+                    hedge = asyncio.ensure_future(_arun_hedge(chain_name, hedge_attempt, admission))
+                    pending.add(hedge)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _arun_hedge(chain_name: str, hedge_attempt, admission):
+    # 申请名额与进入 try 之间没有 await，任务被取消时名额一定会归还
+    if admission is not None and not admission.try_acquire():
+        HEDGED_CALLS.inc(chain_name, "skipped")
+        return _NOT_LAUNCHED
+    HEDGED_CALLS.inc(chain_name, "launched")
+    started = time.monotonic()
+    try:
+        return await hedge_attempt()
+    finally:
+        if admission is not None:
+            admission.release(time.monotonic() - started)
+
+
+def _wait_timeout(chain_name: str, deadline: float, hedge_at: float):
+    """距离下一个需要处理的时间点（对冲时刻或截止时间）的等待时长；截止时间已过时抛出 DeadlineExceeded"""
+    now = time.monotonic()
+    if deadline is not None and now >= deadline:
+        _deadline_exceeded(chain_name)
+
+    wake_at = min([t for t in (deadline, hedge_at) if t is not None], default=None)
+    return None if wake_at is None else max(0.0, wake_at - now)
+
+
+def _deadline_exceeded(chain_name: str):
+    DEADLINE_EXCEEDED.inc(chain_name)
+    raise DeadlineExceeded(f"{chain_name} 调用超过截止时间")
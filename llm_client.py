@@ -0,0 +1,111 @@
+import os
+import threading
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+from config import Config
+
+# HTTP/2 依赖可选的 h2 包，未安装时退回 HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMClientRegistry:
+    """进程级的大模型客户端注册表，所有链和服务实例共享同一组连接池"""
+
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _clients = {}  # (base_url, api_key) -> (OpenAI, AsyncOpenAI)
+    _models = {}  # (model_name, base_url, api_key, temperature, json_mode) -> ChatOpenAI
+
+    @classmethod
+    def get_chat_model(cls, model_name: str = None, base_url: str = None, api_key: str = None,
+                       json_mode: bool = False):
+        """获取共享的 ChatOpenAI 实例，同一端点的模型复用同一个连接池；json_mode 时要求上游按 JSON 对象格式输出"""
+        model_name = model_name or Config.MODEL_NAME
+        base_url = base_url or Config.DEEPSEEK_BASE_URL
+        api_key = api_key or Config.DEEPSEEK_API_KEY
+        key = (model_name, base_url, api_key, Config.TEMPERATURE, json_mode)
+
+        with cls._lock:
+            cls._reset_after_fork()
+            if key not in cls._models:
+                client, async_client = cls._get_clients(base_url, api_key)
+                cls._models[key] = ChatOpenAI(
+                    temperature=Config.TEMPERATURE,
+                    model_name=model_name,
+                    openai_api_key=api_key,
+                    openai_api_base=base_url,
+                    request_timeout=Config.LLM_REQUEST_TIMEOUT,
+                    model_kwargs={"response_format": {"type": "json_object"}} if json_mode else {},
+                    client=client.chat.completions,
+                    async_client=async_client.chat.completions
+                )
+            return cls._models[key]
+
+    @classmethod
+    def _get_clients(cls, base_url: str, api_key: str):
+        """按端点创建（或复用）带连接池的 OpenAI 客户端"""
+        key = (base_url, api_key)
+        if key not in cls._clients:
+            limits = httpx.Limits(
+                max_connections=Config.LLM_POOL_SIZE,
+                max_keepalive_connections=Config.LLM_POOL_SIZE,
+                keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+            )
+            http2 = Config.LLM_HTTP2 and HTTP2_AVAILABLE
+            cls._clients[key] = (
+                openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=Config.LLM_REQUEST_TIMEOUT,
+                    http_client=httpx.Client(limits=limits, http2=http2)
+                ),
+                openai.AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=Config.LLM_REQUEST_TIMEOUT,
+                    http_client=httpx.AsyncClient(limits=limits, http2=http2)
+                ),
+            )
+        return cls._clients[key]
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """fork 出的子进程不能复用父进程的套接字，检测到 pid 变化时重建"""
+        if cls._pid != os.getpid():
+            cls._pid = os.getpid()
+            cls._clients = {}
+            cls._models = {}
+
+    @classmethod
+    def close(cls):
+        """关闭所有同步连接池（异步连接池随事件循环结束释放）"""
+        with cls._lock:
+            for client, _ in cls._clients.values():
+                client.close()
+            cls._clients = {}
+            cls._models = {}
+
+
+def get_chat_model(model_name: str = None, base_url: str = None, api_key: str = None, json_mode: bool = False):
+    """获取进程内共享的聊天模型客户端"""
+    return LLMClientRegistry.get_chat_model(model_name, base_url, api_key, json_mode)
+
+
+def get_backends():
+    """配置的上游后端 {名称: (base_url, api_key)}；未配置 LLM_BACKENDS 时只有 DEEPSEEK_BASE_URL 一个 default 后端"""
+    if not Config.LLM_BACKENDS:
+        return {"default": (Config.DEEPSEEK_BASE_URL, Config.DEEPSEEK_API_KEY)}
+    return {
+        name: (base_url, Config.LLM_BACKEND_API_KEYS.get(name) or Config.DEEPSEEK_API_KEY)
+        for name, base_url in Config.LLM_BACKENDS.items()
+    }
+
+
+def preload():
+    """导入 OpenAI 客户端按需加载的 chat 资源模块（首次访问 client.chat 时才导入，耗时明显），不创建连接"""
+    import openai.resources.chat  # noqa: F401
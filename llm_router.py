@@ -0,0 +1,157 @@
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+from metrics import REGISTRY, Counter, GaugeFunction
+import llm_client
+
+BACKEND_CALLS = REGISTRY.register(Counter(
+    "clarifier_backend_calls_total", "按后端统计的上游调用次数，outcome 为 ok / error / cancelled",
+    ("chain", "backend", "outcome")))
+
+
+class _BackendState:
+    __slots__ = ("name", "latency", "error_rate", "pending", "last_used")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency = None  # 成功调用耗时的滑动平均，还没有样本时为 None
+        self.error_rate = 0.0
+        self.pending = 0
+        self.last_used = 0.0
+
+
+class BackendRouter:
+    """为一条链在多个 OpenAI 兼容后端之间选择上游
+
+    每个后端维护调用耗时和错误率的指数滑动平均，选择 耗时均值 × (在途请求数 + 1) 最小的健康后端：
+    在途请求多的后端会让给其他后端，对冲请求因此倾向于发往另一个后端。还没有样本的后端空闲时优先尝试一次。
+    错误率达到 error_threshold 的后端暂停使用，冷却 cooldown 秒后放行一次探测请求。
+    """
+
+    def __init__(self, chain_name: str, backend_names: list, alpha: float = 0.2,
+                 error_threshold: float = 0.5, cooldown: float = 30.0):
+        if not backend_names:
+            raise ValueError(f"链 {chain_name} 没有可用的上游后端")
+        self.chain_name = chain_name
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._states = {name: _BackendState(name) for name in backend_names}
+
+    @property
+    def backend_names(self):
+        return list(self._states)
+
+    def choose(self, exclude: str = None):
+        """选择本次调用的后端并计入在途请求，exclude 为本次不考虑的后端；调用结束后必须 release"""
+        with self._lock:
+            now = time.monotonic()
+            states = list(self._states.values())
+            candidates = [state for state in states if state.name != exclude] or states
+            state = self._probe_locked(candidates, now) or self._best_locked(candidates)
+            state.pending += 1
+            state.last_used = now
+            return state.name
+
+    def release(self, name: str, elapsed: float, error: bool = False, cancelled: bool = False):
+        """记录调用结果；被取消的调用按已耗时计入耗时均值（实际耗时的下限），不计入错误率"""
+        with self._lock:
+            state = self._states[name]
+            state.pending -= 1
+            if not cancelled:
+                state.error_rate += self.alpha * ((1.0 if error else 0.0) - state.error_rate)
+            if not error:
+                state.latency = elapsed if state.latency is None else state.latency + self.alpha * (
+                    elapsed - state.latency)
+        BACKEND_CALLS.inc(self.chain_name, name, "cancelled" if cancelled else "error" if error else "ok")
+
+    @contextmanager
+    def route(self, exclude: str = None):
+        """选择后端并在调用结束时记录耗时和结果"""
+        name = self.choose(exclude)
+        started = time.perf_counter()
+        try:
+            yield name
+        except Exception:
+            self.release(name, time.perf_counter() - started, error=True)
+            raise
+        except BaseException:
+            # 对冲中落败被取消，或流式输出被调用方提前关闭
+            self.release(name, time.perf_counter() - started, cancelled=True)
+            raise
+        self.release(name, time.perf_counter() - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {'latency': state.latency, 'error_rate': state.error_rate, 'pending': state.pending}
+                for name, state in self._states.items()
+            }
+
+    def _probe_locked(self, candidates: list, now: float):
+        """暂停中的后端冷却期满后放行一次探测请求"""
+        for state in candidates:
+            if state.error_rate >= self.error_threshold and now - state.last_used >= self.cooldown:
+                return state
+        return None
+
+    def _best_locked(self, candidates: list):
+        healthy = [state for state in candidates if state.error_rate < self.error_threshold]
+        if not healthy:
+            return min(candidates, key=lambda state: state.error_rate)
+
+        # 还没有样本但已有在途请求的后端，按已知最快后端的耗时估计
+        prior = min((state.latency for state in healthy if state.latency is not None), default=1.0)
+
+        def score(state):
+            if state.latency is None:
+                return 0.0 if state.pending == 0 else prior * (state.pending + 1)
+            return state.latency * (state.pending + 1)
+
+        # 分数相同时按配置顺序优先
+        return min(healthy, key=score)
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(chain_name: str):
+    """获取某条链在进程内共享的后端路由器，可用后端由 CHAIN_BACKENDS 限定"""
+    with _routers_lock:
+        router = _routers.get(chain_name)
+        if router is None:
+            backends = llm_client.get_backends()
+            names = Config.CHAIN_BACKENDS.get(chain_name) or list(backends)
+            unknown = [name for name in names if name not in backends]
+            if unknown:
+                raise ValueError(f"CHAIN_BACKENDS 中链 {chain_name} 引用了未配置的后端: {', '.join(unknown)}")
+            router = _routers[chain_name] = BackendRouter(
+                chain_name,
+                names,
+                alpha=Config.LLM_ROUTER_ALPHA,
+                error_threshold=Config.LLM_ROUTER_ERROR_THRESHOLD,
+                cooldown=Config.LLM_ROUTER_COOLDOWN
+            )
+        return router
+
+
+def _router_gauge(field: str):
+    with _routers_lock:
+        routers = list(_routers.values())
+    return {
+        (router.chain_name, name): stats[field]
+        for router in routers
+        for name, stats in router.stats().items()
+        if stats[field] is not None
+    }
+
+
+REGISTRY.register(GaugeFunction(
+    "clarifier_backend_latency_seconds", "各链在各后端上成功调用耗时的滑动平均",
+    lambda: _router_gauge('latency'), ("chain", "backend")))
+REGISTRY.register(GaugeFunction(
+    "clarifier_backend_error_rate", "各链在各后端上调用错误率的滑动平均",
+    lambda: _router_gauge('error_rate'), ("chain", "backend")))
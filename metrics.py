@@ -0,0 +1,132 @@
+import bisect
+import threading
+
+# 默认的延迟分桶（秒），覆盖本地缓存命中到上游慢请求
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = ""):
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """固定分桶直方图，观测时只做一次二分查找和计数"""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # label_values -> [各桶计数..., 总和, 总数]
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 3)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), state):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.label_names, label_values, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {state[-2]}")
+                lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class GaugeFunction:
+    """在抓取时调用函数取值的仪表；函数返回数值，或 {标签值元组: 数值}"""
+
+    def __init__(self, name: str, documentation: str, fn, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.label_names = label_names
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        value = self.fn()
+        values = value if isinstance(value, dict) else {(): value}
+        for label_values, item in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {item}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """按名称注册，重复注册时替换（如服务实例重建）"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CHAIN_LATENCY = REGISTRY.register(Histogram(
+    "clarifier_chain_latency_seconds", "链调用耗时（含提示渲染和 JSON 解析，不含缓存命中）", ("chain",)))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "clarifier_llm_latency_seconds", "上游模型调用耗时", ("chain",)))
+CHAIN_CALLS = REGISTRY.register(Counter(
+    "clarifier_chain_calls_total", "链调用次数，outcome 为 ok / error / parse_error / cache_hit", ("chain", "outcome")))
+PROMPT_TOKENS = REGISTRY.register(Counter(
+    "clarifier_prompt_tokens_total", "上游返回的提示 token 数", ("chain",)))
+COMPLETION_TOKENS = REGISTRY.register(Counter(
+    "clarifier_completion_tokens_total", "上游返回的生成 token 数", ("chain",)))
+SESSION_ROUNDS = REGISTRY.register(Histogram(
+    "clarifier_session_rounds", "每个已结束会话的轮数", (), buckets=(1, 2, 3, 4, 5, 6, 8, 10)))
+SESSIONS_COMPLETED = REGISTRY.register(Counter(
+    "clarifier_sessions_completed_total", "已结束的会话数，reason 为 simple / sufficient（提前结束）/ max_rounds", ("reason",)))
+
+
+def render_metrics():
+    return REGISTRY.render()
@@ -3,9 +3,15 @@ from pydantic.v1 import BaseModel, Field
 class Classification(BaseModel):
     classification: str = Field(description="问题的分类，必须是 'SIMPLE', 'COMPLEX', 或 'VAGUE' 中的一个。")
     reason: str = Field(description="做出该分类的简要原因。")
+    confidence: float = Field(0.0, description="对分类及以下两项判断的把握程度，0 到 1 之间的小数。")
+    intent_clear: bool = Field(False, description="是否已经能确定用户想问什么（询问对象和真实需求明确）。")
+    context_sufficient: bool = Field(False, description="是否已经掌握给出针对性回答所需的用户背景（如病情、预算、偏好、地点）；问题本身不需要背景时也为 true。")
 
 class QuestionGenerator(BaseModel):
     question: str = Field(description="生成的单个追问")
 
 class FinalQueryGenerator(BaseModel):
-    final_question: str = Field(description="整合了所有信息后生成的完整、自然的用户问题")
\ No newline at end of file
+    final_question: str = Field(description="整合了所有信息后生成的完整、自然的用户问题")
+
+class ClassifyAndAsk(Classification):
+    question: str = Field("", description="分类为 'COMPLEX' 或 'VAGUE' 时生成的单个追问；分类为 'SIMPLE' 时为空字符串")
\ No newline at end of file
@@ -0,0 +1,159 @@
+import json
+import re
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import JsonOutputParser
+from pydantic.v1 import ValidationError
+from metrics import REGISTRY, Counter
+
+OUTPUT_REPAIRS = REGISTRY.register(Counter(
+    "clarifier_output_repairs_total",
+    "模型输出不是合法 JSON 时的本地修复次数，outcome 为 repaired / failed（无法修复）/ invalid（不符合输出模型）",
+    ("chain", "outcome")))
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+_OPEN_QUOTES = {'"': '"', "'": "'", "“": "”", "”": "”"}
+_BARE_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_NUMBER = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?$")
+
+
+def repair_json(text: str, partial: bool = False):
+    """修复模型输出中常见的 JSON 问题后解析，无法修复时抛出 ValueError
+
+    处理代码块围栏、JSON 前后的多余文字、单引号或中文引号、未加引号的键和值、
+    多余的逗号和 Python 风格的 True/False/None。被截断的输出只在 partial 时补全（流式输出的中间结果），
+    否则视为无法修复：补全后的字段内容是不完整的。
+    """
+    match = _FENCE.search(text)
+    if match:
+        text = match.group(1)
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("输出中没有 JSON 对象")
+    rewritten, truncated = _rewrite(text[start:])
+    if truncated and not partial:
+        raise ValueError("输出被截断")
+    return json.loads(rewritten, strict=False)
+
+
+def _parse_strict(text: str):
+    """不做任何修复的解析，只去掉代码块围栏"""
+    match = _FENCE.search(text)
+    return json.loads(match.group(1) if match else text, strict=False)
+
+
+def _rewrite(text: str):
+    """逐字符改写为合法 JSON：字符串外的内容按 JSON 语法规范化，顶层对象结束后的文字丢弃
+
+    返回 (改写后的文本, 是否被截断)；被截断时补全了未闭合的字符串、值和括号。
+    """
+    out = []
+    stack = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch in _OPEN_QUOTES:
+            i = _read_string(text, i + 1, _OPEN_QUOTES[ch], out)
+            continue
+        if ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack and stack[-1] == ch:
+                stack.pop()
+                out.append(ch)
+            if not stack:
+                return "".join(out), False
+        elif ch in ",:" or ch.isspace():
+            out.append(ch)
+        else:
+            # 未加引号的键或值，读到分隔符为止
+            end = i
+            while end < n and text[end] not in ",:}]\n\"":
+                end += 1
+            token = text[i:end].strip()
+            if end < n and text[end] == ":":
+                out.append(json.dumps(token, ensure_ascii=False))
+            elif token in _BARE_LITERALS:
+                out.append(_BARE_LITERALS[token])
+            elif _NUMBER.match(token):
+                out.append(token)
+            else:
+                out.append(json.dumps(token, ensure_ascii=False))
+            i = max(end, i + 1)
+            continue
+        i += 1
+
+    # 输出被截断：补全未闭合的值和括号
+    _strip_trailing_comma(out)
+    if "".join(out).rstrip().endswith(":"):
+        out.append("null")
+    out.extend(reversed(stack))
+    return "".join(out), True
+
+
+def _read_string(text: str, i: int, closer: str, out: list):
+    """读取一个字符串字面量并以双引号形式写出，返回字符串结束后的位置；字符串未闭合时读到末尾"""
+    out.append('"')
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n:
+            out.append(text[i:i + 2])
+            i += 2
+            continue
+        if ch == closer:
+            out.append('"')
+            return i + 1
+        out.append('\\"' if ch == '"' else ch)
+        i += 1
+    out.append('"')
+    return n
+
+
+def _strip_trailing_comma(out: list):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+class RepairingJsonOutputParser(JsonOutputParser):
+    """JsonOutputParser 解析失败时先在本地修复，最终结果按 pydantic_object 校验并转换类型
+
+    修复只需几十微秒，代替因格式问题整轮重试的上游调用。流式输出的中间结果不校验；
+    最终结果被截断时不补全，按解析失败处理，避免不完整的内容进入缓存。
+    """
+    chain_name: str = ""
+
+    def parse_result(self, result, *, partial: bool = False):
+        if partial:
+            parsed = super().parse_result(result, partial=True)
+            if parsed is None:
+                try:
+                    parsed = repair_json(result[0].text, partial=True)
+                except ValueError:
+                    return None
+            return parsed
+
+        # 父类的非流式解析也会补全被截断的 JSON，这里改为严格解析
+        text = result[0].text
+        try:
+            parsed = _parse_strict(text)
+        except ValueError:
+            try:
+                parsed = repair_json(text)
+            except ValueError as e:
+                OUTPUT_REPAIRS.inc(self.chain_name, "failed")
+                raise OutputParserException(f"Invalid json output: {text}", llm_output=text) from e
+            OUTPUT_REPAIRS.inc(self.chain_name, "repaired")
+        return self._validate(parsed, text)
+
+    def _validate(self, parsed, text: str):
+        if self.pydantic_object is None:
+            return parsed
+        try:
+            return self.pydantic_object.parse_obj(parsed).dict()
+        except ValidationError as e:
+            OUTPUT_REPAIRS.inc(self.chain_name, "invalid")
+            raise OutputParserException(f"输出不符合 {self.pydantic_object.__name__}: {e}", llm_output=text) from e
@@ -0,0 +1,186 @@
+import json
+import math
+import re
+import sys
+import threading
+from collections import Counter
+from config import Config
+from response_cache import normalize_text
+
+# 去掉标点和语气词后仍只剩这些内容的问题，无法判断用户想问什么
+_FILLER_QUERIES = {
+    "怎么办", "咋办", "怎么弄", "怎么回事", "为什么", "什么意思", "帮帮我", "求助", "请问", "你好",
+    "在吗", "有人吗", "怎么样", "好不好", "可以吗", "行吗", "有用吗",
+}
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+_TRAILING_PARTICLES = re.compile(r"[啊呀呢吧吗么嘛哦]+$")
+
+# 依赖说话人所在位置的地点短语，几个字之内跟着医疗机构名词，并且问题在找这个机构
+_DEICTIC_PLACE = re.compile(
+    r"(这附近|这周边|我家附近|我们附近|我这附近|离我最近|离我近|^附近|^周边)"
+    r".{0,8}?"
+    r"(医院|药店|药房|诊所|卫生院|卫生所|门诊|急诊|体检中心)")
+_PLACE_SEEKING = re.compile(r"(有什么|有没有|哪家|哪个|哪里|哪儿|去哪)")
+
+# 以指代词开头的短问题，指代对象缺失
+_DANGLING_REFERENCE = re.compile(r"^(这个|那个|它|这种|那种|这样|那样)")
+
+
+class NgramModel:
+    """字符 n-gram 朴素贝叶斯分类器，从记录的分类结果训练"""
+
+    def __init__(self, class_counts: dict, feature_counts: dict, ngram_range=(1, 2)):
+        self.ngram_range = tuple(ngram_range)
+        self.class_counts = class_counts
+        self.feature_counts = feature_counts
+        self.vocabulary = set()
+        for counts in feature_counts.values():
+            self.vocabulary.update(counts)
+        total_docs = sum(class_counts.values())
+        self.log_priors = {label: math.log(count / total_docs) for label, count in class_counts.items()}
+
+        # 预先计算拉普拉斯平滑后的对数似然，预测时只做查表和加法
+        vocab_size = len(self.vocabulary) + 1
+        self.log_likelihoods = {}
+        self.unseen_log_likelihood = {}
+        for label, counts in feature_counts.items():
+            denominator = math.log(sum(counts.values()) + vocab_size)
+            self.log_likelihoods[label] = {gram: math.log(count + 1) - denominator for gram, count in counts.items()}
+            self.unseen_log_likelihood[label] = -denominator
+
+    @staticmethod
+    def features(text: str, ngram_range=(1, 2)):
+        text = _PUNCTUATION.sub("", normalize_text(text))
+        grams = []
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+        return grams
+
+    @classmethod
+    def train(cls, samples, ngram_range=(1, 2)):
+        """samples 为 (query, classification) 序列"""
+        class_counts = Counter()
+        feature_counts = {}
+        for query, label in samples:
+            class_counts[label] += 1
+            feature_counts.setdefault(label, Counter()).update(cls.features(query, ngram_range))
+        return cls(dict(class_counts), {label: dict(counts) for label, counts in feature_counts.items()}, ngram_range)
+
+    def predict(self, text: str):
+        """返回 (分类, 后验概率)"""
+        grams = self.features(text, self.ngram_range)
+        scores = {}
+        for label, log_prior in self.log_priors.items():
+            likelihoods = self.log_likelihoods[label]
+            unseen = self.unseen_log_likelihood[label]
+            scores[label] = log_prior + sum(likelihoods.get(gram, unseen) for gram in grams)
+
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                'ngram_range': list(self.ngram_range),
+                'class_counts': self.class_counts,
+                'feature_counts': self.feature_counts
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data['class_counts'], data['feature_counts'], data['ngram_range'])
+
+
+class PreClassifier:
+    """本地快速预分类：只处理高置信度的明显情况，其余返回 None 交给大模型分类"""
+
+    def __init__(self, model: NgramModel = None, threshold: float = 0.97):
+        self.model = model
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._total = 0
+        self._short_circuited = Counter()
+
+    def classify(self, query: str):
+        """返回与 ClassifierChain 相同结构的结果，无法高置信判断时返回 None"""
+        result = self._classify_by_rules(query)
+        if result is None and self.model is not None:
+            label, probability = self.model.predict(query)
+            if probability >= self.threshold:
+                result = {'classification': label, 'reason': f"本地模型判断（置信度 {probability:.2f}）"}
+
+        with self._lock:
+            self._total += 1
+            if result is not None:
+                self._short_circuited[result['classification']] += 1
+        return result
+
+    def stats(self):
+        """返回短路统计"""
+        with self._lock:
+            short_circuited = sum(self._short_circuited.values())
+            return {
+                'total': self._total,
+                'short_circuited': short_circuited,
+                'short_circuit_rate': short_circuited / self._total if self._total else 0.0,
+                'by_classification': dict(self._short_circuited)
+            }
+
+    def _classify_by_rules(self, query: str):
+        text = _PUNCTUATION.sub("", normalize_text(query))
+        core = _TRAILING_PARTICLES.sub("", text)
+
+        if not core or core in _FILLER_QUERIES or text in _FILLER_QUERIES:
+            return {'classification': 'VAGUE', 'reason': "问题过于笼统，完全不知道要解决什么问题"}
+
+        if _DEICTIC_PLACE.search(text) and _PLACE_SEEKING.search(text):
+            return {'classification': 'VAGUE', 'reason': "问题中的位置（如\"这附近\"）不明确"}
+
+        if len(core) <= 8 and _DANGLING_REFERENCE.match(core):
+            return {'classification': 'VAGUE', 'reason': "问题中的指代对象不明确"}
+
+        return None
+
+
+_pre_classifier = None
+_pre_classifier_lock = threading.Lock()
+
+
+def get_pre_classifier():
+    """获取进程内共享的预分类器，未启用时返回 None"""
+    global _pre_classifier
+    if not Config.PRECLASSIFIER_ENABLED:
+        return None
+    with _pre_classifier_lock:
+        if _pre_classifier is None:
+            model = NgramModel.load(Config.PRECLASSIFIER_MODEL_PATH) if Config.PRECLASSIFIER_MODEL_PATH else None
+            _pre_classifier = PreClassifier(model, Config.PRECLASSIFIER_THRESHOLD)
+        return _pre_classifier
+
+
+def main():
+    """从记录的分类结果（JSONL，每行含 query 和 classification）训练 n-gram 模型"""
+    if len(sys.argv) != 3:
+        print("用法: python pre_classifier.py <分类记录.jsonl> <输出模型.json>")
+        return
+
+    samples = []
+    with open(sys.argv[1], encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get('query') and record.get('classification') in ('SIMPLE', 'COMPLEX', 'VAGUE'):
+                samples.append((record['query'], record['classification']))
+
+    model = NgramModel.train(samples)
+    model.save(sys.argv[2])
+    print(f"已训练 {len(samples)} 条样本，模型保存到 {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+from metrics import REGISTRY, Counter, Histogram
+
+PROMPT_SIZE = REGISTRY.register(Histogram(
+    "clarifier_prompt_size_tokens", "每次上游调用的输入 token 数（上游未返回用量时为本地估算）", ("chain",),
+    buckets=(50, 100, 200, 300, 400, 600, 800, 1000, 1500, 2000, 4000)))
+HISTORY_TRIMMED = REGISTRY.register(Counter(
+    "clarifier_history_trimmed_rounds_total", "为满足预算而压缩或省略的历史轮次，action 为 compressed / dropped",
+    ("action",)))
+
+# 粗略换算：1 个中文字符约 0.6 个 token，1 个英文字符约 0.3 个 token
+_CJK_TOKENS = 0.6
+_ASCII_TOKENS = 0.3
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+def estimate_tokens(text: str):
+    """不依赖分词器的 token 数估算，用于预算控制和指标"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return int((len(text) - ascii_chars) * _CJK_TOKENS + ascii_chars * _ASCII_TOKENS) + 1
+
+
+def compact_format_instructions(model):
+    """精简的输出格式说明：只列出字段名、类型和描述，代替完整的 JSON Schema 样板"""
+    lines = ["只输出一个 JSON 对象，不要输出其他内容。字段："]
+    for name, field in model.__fields__.items():
+        json_type = _JSON_TYPES.get(field.outer_type_, "string")
+        lines.append(f"- {name} ({json_type}): {field.field_info.description}")
+    return "\n".join(lines)
+
+
+def fit_rounds(rounds: list, budget: int):
+    """让对话轮次的文本总量不超过预算（token 估算）
+
+    rounds 为按时间顺序的 (完整文本, 压缩文本)。超出预算时先从最早的轮次开始换成压缩文本，
+    仍然超出时再从最早的轮次开始省略；最近一轮总是保留完整文本。返回 (文本列表, 省略的轮数)。
+    """
+    texts = [full for full, _ in rounds]
+    sizes = [estimate_tokens(text) for text in texts]
+    if not budget or sum(sizes) <= budget:
+        return texts, 0
+
+    for i in range(len(rounds) - 1):
+        if sum(sizes) <= budget:
+            break
+        texts[i] = rounds[i][1]
+        sizes[i] = estimate_tokens(texts[i])
+        HISTORY_TRIMMED.inc("compressed")
+
+    dropped = 0
+    while dropped < len(rounds) - 1 and sum(sizes[dropped:]) > budget:
+        dropped += 1
+    if dropped:
+        HISTORY_TRIMMED.inc("dropped", amount=dropped)
+    return texts[dropped:], dropped
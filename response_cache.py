@@ -0,0 +1,231 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from config import Config
+
+
+def normalize_text(text: str):
+    """规范化提示输入：全半角统一、去除首尾空白并合并连续空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class ResponseCache:
+    """链调用结果缓存：内存 LRU + TTL，可选只读的预计算层（warm_cache 生成的文件）和 SQLite 持久层
+
+    内存未命中时依次查预计算层和持久层，命中后放入内存层。持久层有单独的锁：异步调用方通过 aget 在线程池中读取，
+    不阻塞事件循环；写入由后台线程批量提交，set 只更新内存层并把写入放入队列，队列满时丢弃写入。
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400, sqlite_path: str = None,
+                 warm_path: str = None, write_queue_size: int = 10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()  # 内存层和统计
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._db = None
+        self._db_lock = threading.Lock()  # 持久层连接
+        self._hits = 0
+        self._misses = 0
+        self._sqlite_hits = 0
+        self._warm_hits = 0
+        self._dropped_writes = 0
+        self._warm = None
+
+        if warm_path:
+            from warm_cache import WarmCache
+            self._warm = WarmCache(warm_path)
+
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._writes = queue.Queue(maxsize=write_queue_size)
+            self._writer = threading.Thread(target=self._write_loop, name="response-cache-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def make_key(namespace: str, inputs: dict):
+        """根据链标识和规范化后的输入生成缓存键"""
+        normalized = {name: normalize_text(value) for name, value in sorted(inputs.items())}
+        payload = json.dumps([namespace, normalized], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """读取缓存，未命中或已过期时返回 None"""
+        value = self._get_local(key)
+        if value is None and self._db is not None:
+            value = self._load_persistent(key)
+        return value
+
+    async def aget(self, key: str):
+        """读取缓存（异步）：内存层和预计算层直接读取，持久层在线程池中读取"""
+        value = self._get_local(key)
+        if value is None and self._db is not None:
+            value = await asyncio.to_thread(self._load_persistent, key)
+        return value
+
+    def set(self, key: str, value: dict):
+        """写入缓存；持久层由后台线程写入，不等待磁盘 I/O"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._set_memory(key, value, expires_at)
+        if self._db is not None:
+            try:
+                self._writes.put_nowait((key, json.dumps(value, ensure_ascii=False), expires_at))
+            except queue.Full:
+                with self._lock:
+                    self._dropped_writes += 1
+
+    def flush(self):
+        """等待队列中的写入全部提交到持久层"""
+        if self._db is not None:
+            self._writes.join()
+
+    def close(self):
+        """提交剩余的写入后停止后台写入线程"""
+        if self._db is not None and self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join(timeout=5)
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'sqlite_hits': self._sqlite_hits,
+                'warm_hits': self._warm_hits,
+                'hit_rate': self._hits / total if total else 0.0,
+                'size': len(self._entries),
+                'warm_size': len(self._warm) if self._warm is not None else 0,
+                'dropped_writes': self._dropped_writes
+            }
+
+    def snapshot(self):
+        """内存层中未过期的 {键: 值}，供离线预计算任务导出"""
+        now = time.time()
+        with self._lock:
+            return {key: value for key, (expires_at, value) in self._entries.items() if expires_at > now}
+
+    def clear(self):
+        """清空内存层与持久层（预计算层只读，不受影响）"""
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            self.flush()
+            with self._db_lock:
+                self._db.execute("DELETE FROM response_cache")
+                self._db.commit()
+
+    def _get_local(self, key: str):
+        """读取内存层和预计算层；都未命中且没有持久层时计入未命中"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            value = self._warm.get(key) if self._warm is not None else None
+            if value is not None:
+                self._warm_hits += 1
+                self._hits += 1
+                self._set_memory(key, value, now + self.ttl)
+                return value
+
+            if self._db is None:
+                self._misses += 1
+            return None
+
+    def _load_persistent(self, key: str):
+        """读取持久层并计入命中统计，命中时放入内存层"""
+        now = time.time()
+        value = None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] <= now:
+                self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._db.commit()
+            elif row is not None:
+                value = json.loads(row[0])
+
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._sqlite_hits += 1
+            self._hits += 1
+            self._set_memory(key, value, now + self.ttl)
+            return value
+
+    def _set_memory(self, key: str, value: dict, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _write_loop(self):
+        while True:
+            rows = [self._writes.get()]
+            # 一次取完当前积压的写入后统一提交
+            while True:
+                try:
+                    rows.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in rows
+            rows = [row for row in rows if row is not None]
+            try:
+                if rows:
+                    with self._db_lock:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)", rows
+                        )
+                        self._db.commit()
+            except sqlite3.Error:
+                with self._lock:
+                    self._dropped_writes += len(rows)
+            finally:
+                for _ in range(len(rows) + (1 if stop else 0)):
+                    self._writes.task_done()
+            if stop:
+                break
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """获取进程内共享的响应缓存，未启用时返回 None"""
+    global _response_cache
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+                ttl=Config.RESPONSE_CACHE_TTL,
+                sqlite_path=Config.RESPONSE_CACHE_SQLITE_PATH,
+                warm_path=Config.WARM_CACHE_PATH
+            )
+        return _response_cache
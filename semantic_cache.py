@@ -0,0 +1,213 @@
+import re
+import threading
+from collections import OrderedDict
+from config import Config
+from metrics import REGISTRY, Counter, GaugeFunction
+from response_cache import normalize_text
+
+SEMANTIC_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "clarifier_semantic_cache_lookups_total", "近似重复缓存查询次数，outcome 为 hit / miss", ("outcome",)))
+
+_MASK64 = (1 << 64) - 1
+_EMPTY = 1 << 64  # 没有任何 shingle 落入的桶
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_HASH_OFFSET = 0x632BE59BD9B4E019
+_PUNCTUATION = re.compile(r"[\s\W_]+")
+# 只差一个字就会改变事实的内容：否定词、数字（含中文数字）及其单位，必须逐行完全一致才能命中
+_CRITICAL = re.compile(
+    r"[没不无未非别勿否]"
+    r"|(?:\d+(?:\.\d+)?|[〇零一二两三四五六七八九十百千万]+)"
+    r"\s*(?:[a-zA-Z%℃°/]+|毫克|微克|克|公斤|千克|斤|毫升|升|毫米|厘米|米|岁|周岁|年|个月|月|周|天|日|小时|分钟|次|片|粒|支|度|型|级|期)?")
+
+
+def critical_tokens(text: str):
+    """每行文本中的否定词、数字和单位，按出现顺序；相似度再高，这部分不同也不能复用结果"""
+    return tuple(tuple(token.replace(" ", "") for token in _CRITICAL.findall(normalize_text(line)))
+                 for line in text.split("\n"))
+
+
+class MinHashLSH:
+    """字符 shingle 的 MinHash 签名（单次排列哈希 + 旋转致密化）和分段 LSH 索引键
+
+    每个 shingle 只哈希一次，按高位分到 num_perm 个桶中取最小值，签名计算与 shingle 数量线性相关。
+    两个签名对应位置相等的比例是 Jaccard 相似度的估计。
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 3):
+        if num_perm & (num_perm - 1) or num_perm % bands:
+            raise ValueError("num_perm 必须是 2 的幂并且能被 bands 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self._shift = 64 - (num_perm.bit_length() - 1)
+        self._low_mask = (1 << self._shift) - 1
+
+    def shingles(self, text: str):
+        """去除空白和标点后的字符 n-gram 哈希集合"""
+        text = _PUNCTUATION.sub("", normalize_text(text).lower())
+        if len(text) <= self.shingle_size:
+            return {hash(text)} if text else set()
+        n = self.shingle_size
+        return {hash(text[i:i + n]) for i in range(len(text) - n + 1)}
+
+    def signature(self, text: str):
+        """文本的 MinHash 签名；没有可用字符时返回 None"""
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+
+        signature = [_EMPTY] * self.num_perm
+        shift, low_mask = self._shift, self._low_mask
+        for shingle in shingles:
+            h = (shingle * _HASH_MULTIPLIER + _HASH_OFFSET) & _MASK64
+            index = h >> shift
+            value = h & low_mask
+            if value < signature[index]:
+                signature[index] = value
+
+        # 空桶借用右侧最近的非空桶的值，并按距离偏移，避免不同空桶之间产生虚假的相等
+        if _EMPTY in signature:
+            k = self.num_perm
+            source = list(signature)
+            nearest = None
+            for i in range(2 * k - 1, -1, -1):
+                if source[i % k] != _EMPTY:
+                    nearest = i
+                elif i < k and nearest is not None:
+                    signature[i] = source[nearest % k] + (nearest - i) * (low_mask + 1)
+        return tuple(signature)
+
+    def band_keys(self, signature: tuple, scope: str = ""):
+        """LSH 分段键；scope 不同的签名落在不同的桶中"""
+        rows = self.rows
+        return [hash((scope, band, signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    def similarity(self, a: tuple, b: tuple):
+        return sum(1 for x, y in zip(a, b) if x == y) / self.num_perm
+
+
+class SemanticCache:
+    """近似重复缓存：按文本相似度（估计的字符 shingle Jaccard）查找之前的结果
+
+    scope 必须（规范化后）完全一致，只有 text 按相似度比较：改一个地名或药名字符相似度仍很高，
+    不能靠相似度区分的部分应放在 scope 中。查询先通过 LSH 分段桶取候选，再用签名估计相似度，只返回不低于
+    threshold 的最相似条目。“没有抽搐”和“有抽搐”的字符相似度很高，因此候选还必须与查询逐行有相同的否定词、
+    数字和单位。超过 max_entries 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, threshold: float = 0.85, max_entries: int = 200000,
+                 num_perm: int = 64, bands: int = 16, shingle_size: int = 3, max_candidates: int = 64):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self.lsh = MinHashLSH(num_perm, bands, shingle_size)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 条目编号 -> (签名, 分段键, 关键内容, 值)
+        self._buckets = {}  # 分段键 -> [条目编号]
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, text: str, scope: str = ""):
+        """返回 scope 相同、text 最相似且不低于阈值的缓存值，没有时返回 None"""
+        signature = self.lsh.signature(text)
+        if signature is None:
+            return None
+
+        scope = normalize_text(scope)
+        guard = (scope, critical_tokens(text))
+        with self._lock:
+            entry_id, similarity = self._best_match_locked(signature, self.lsh.band_keys(signature, scope), guard)
+            if entry_id is not None and similarity >= self.threshold:
+                self._entries.move_to_end(entry_id)
+                self._hits += 1
+                SEMANTIC_CACHE_LOOKUPS.inc("hit")
+                return self._entries[entry_id][3]
+            self._misses += 1
+        SEMANTIC_CACHE_LOOKUPS.inc("miss")
+        return None
+
+    def set(self, text: str, value, scope: str = ""):
+        signature = self.lsh.signature(text)
+        if signature is None:
+            return
+
+        scope = normalize_text(scope)
+        band_keys = self.lsh.band_keys(signature, scope)
+        guard = (scope, critical_tokens(text))
+        with self._lock:
+            # 已有签名和关键内容都完全相同的条目时只更新值
+            entry_id, similarity = self._best_match_locked(signature, band_keys, guard)
+            if entry_id is not None and similarity == 1.0:
+                self._entries[entry_id] = (signature, band_keys, guard, value)
+                self._entries.move_to_end(entry_id)
+                return
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, band_keys, guard, value)
+            for key in band_keys:
+                self._buckets.setdefault(key, []).append(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._evict_locked()
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / total if total else 0.0,
+                'size': len(self._entries)
+            }
+
+    def _best_match_locked(self, signature: tuple, band_keys: list, guard: tuple):
+        """在 scope 和关键内容都相同的 LSH 候选中找出最相似的条目；每个桶只检查最近加入的 max_candidates 个条目"""
+        best_id, best_similarity = None, 0.0
+        seen = set()
+        for key in band_keys:
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            for entry_id in bucket[-self.max_candidates:]:
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                entry = self._entries[entry_id]
+                if entry[2] != guard:
+                    continue
+                similarity = self.lsh.similarity(signature, entry[0])
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+        return best_id, best_similarity
+
+    def _evict_locked(self):
+        entry_id, (_, band_keys, _, _) = self._entries.popitem(last=False)
+        for key in band_keys:
+            bucket = self._buckets[key]
+            bucket.remove(entry_id)
+            if not bucket:
+                del self._buckets[key]
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """获取进程内共享的近似重复缓存，未启用时返回 None"""
+    global _semantic_cache
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+                max_entries=Config.SEMANTIC_CACHE_MAX_ENTRIES
+            )
+            cache = _semantic_cache
+            REGISTRY.register(GaugeFunction(
+                "clarifier_semantic_cache_entries", "近似重复缓存中的条目数", lambda: cache.stats()['size']))
+        return _semantic_cache
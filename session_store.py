@@ -0,0 +1,381 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+
+class ConversationTurn:
+    """单轮追问记录"""
+    __slots__ = ("round", "strategy", "question", "user_answer")
+
+    def __init__(self, round: int, strategy: str, question: str, user_answer: str = None):
+        self.round = round
+        self.strategy = strategy
+        self.question = question
+        self.user_answer = user_answer
+
+
+class ClarificationSession:
+    """一次澄清对话的会话状态"""
+    __slots__ = ("session_id", "original_query", "conversation_history", "current_round",
+                 "status", "final_query", "last_access", "ttl", "version")
+
+    def __init__(self, session_id: str, original_query: str):
+        self.session_id = session_id
+        self.original_query = original_query
+        self.conversation_history = []
+        self.current_round = 0
+        self.status = "active"
+        self.final_query = None  # 本会话已生成的最终问题
+        self.last_access = time.monotonic()
+        self.ttl = None  # 为 None 时使用存储的默认空闲超时
+        self.version = None  # 读取时在持久化后端中的版本号，为 None 表示尚未写入过
+
+    def copy(self):
+        """复制会话：各轮记录也复制，修改副本不影响原会话"""
+        session = ClarificationSession(self.session_id, self.original_query)
+        session.conversation_history = [
+            ConversationTurn(turn.round, turn.strategy, turn.question, turn.user_answer)
+            for turn in self.conversation_history
+        ]
+        session.current_round = self.current_round
+        session.status = self.status
+        session.final_query = self.final_query
+        session.last_access = self.last_access
+        session.ttl = self.ttl
+        session.version = self.version
+        return session
+
+    def to_dict(self):
+        """序列化为可持久化的字典"""
+        return {
+            'session_id': self.session_id,
+            'original_query': self.original_query,
+            'conversation_history': [
+                [turn.round, turn.strategy, turn.question, turn.user_answer]
+                for turn in self.conversation_history
+            ],
+            'current_round': self.current_round,
+            'status': self.status,
+            'final_query': self.final_query
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """从持久化的字典恢复会话"""
+        session = cls(data['session_id'], data['original_query'])
+        session.conversation_history = [ConversationTurn(*turn) for turn in data['conversation_history']]
+        session.current_round = data['current_round']
+        session.status = data['status']
+        session.final_query = data['final_query']
+        return session
+
+
+class SessionBackend:
+    """会话后端接口：每轮处理前读取会话，处理后写回"""
+
+    def get(self, session_id: str):
+        raise NotImplementedError
+
+    def put(self, session: ClarificationSession, ttl: float = None):
+        """写回会话；会话在读取后已被其他请求更新时不写入并返回 False"""
+        raise NotImplementedError
+
+    def pop(self, session_id: str):
+        raise NotImplementedError
+
+    async def aget(self, session_id: str):
+        """异步读取会话；默认直接调用 get，读写可能阻塞的后端改为在线程中执行"""
+        return self.get(session_id)
+
+    async def aput(self, session: ClarificationSession, ttl: float = None):
+        """异步写回会话"""
+        return self.put(session, ttl)
+
+    def sweep(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SessionStore(SessionBackend):
+    """线程安全的进程内会话存储：空闲超时淘汰 + 数量上限 LRU 淘汰 + 后台过期清理
+
+    与 SQLiteSessionBackend 相同，读取返回会话的副本、写回时比较版本号：处理失败的一轮不会改动已存储的会话，
+    同一会话的并发请求只有先写回的生效。
+    """
+
+    def __init__(self, max_entries: int = 10000, idle_ttl: float = 1800, sweep_interval: float = 60):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.RLock()
+        self._sessions = OrderedDict()
+        self._evicted = 0
+        self._expired = 0
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def get(self, session_id: str):
+        """获取会话的副本并刷新访问时间，不存在或已过期时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._is_expired(session, now):
+                del self._sessions[session_id]
+                self._expired += 1
+                return None
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return session.copy()
+
+    def put(self, session: ClarificationSession, ttl: float = None):
+        """写入会话的副本；ttl 可为单个会话指定更短的保留时间（如已结束的会话）
+
+        读取后已被其他请求写回过时不写入并返回 False；新会话（version 为 None）覆盖同一 session_id 的旧会话。
+        """
+        with self._lock:
+            if session.version is not None:
+                stored = self._sessions.get(session.session_id)
+                if stored is not None and stored.version != session.version:
+                    return False
+            session.version = (session.version or 0) + 1
+            session.last_access = time.monotonic()
+            session.ttl = ttl
+            self._sessions[session.session_id] = session.copy()
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self._evicted += 1
+        self._ensure_sweeper()
+        return True
+
+    def pop(self, session_id: str):
+        """移除会话"""
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def __contains__(self, session_id: str):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def sweep(self):
+        """清理所有已过期的会话，返回清理数量"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items()
+                       if self._is_expired(session, now)]
+            for session_id in expired:
+                del self._sessions[session_id]
+            self._expired += len(expired)
+        return len(expired)
+
+    def stats(self):
+        """返回存活、LRU 淘汰和过期清理的会话数"""
+        with self._lock:
+            return {
+                'live': len(self._sessions),
+                'evicted': self._evicted,
+                'expired': self._expired
+            }
+
+    def close(self):
+        """停止后台清理线程"""
+        self._stop.set()
+
+    def _is_expired(self, session: ClarificationSession, now: float):
+        ttl = session.ttl if session.ttl is not None else self.idle_ttl
+        return now - session.last_access > ttl
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            self.sweep()
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """基于 SQLite WAL 的本地文件会话后端，多个 prefork 工作进程可共享同一份会话
+
+    每行带版本号，写回时比较读取时的版本：同一会话的两个并发请求（如重复提交的回答）
+    只有先写回的生效，后写回的返回 False，不会互相覆盖对话历史。
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, idle_ttl: float = 1800, sweep_interval: float = 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._last_sweep = time.time()
+        self._evicted = 0
+        self._expired = 0
+
+        db = self._connection()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+            "ttl REAL, updated_at REAL NOT NULL, expires_at REAL NOT NULL, version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(sessions)")}
+        if "version" not in columns:
+            db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+
+    def get(self, session_id: str):
+        """读取会话并刷新过期时间，不存在或已过期时返回 None"""
+        now = time.time()
+        db = self._connection()
+        row = db.execute(
+            "SELECT data, expires_at, ttl, version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._expired += 1
+            return None
+
+        session = ClarificationSession.from_dict(json.loads(row[0]))
+        # 指定了单会话 ttl 的（如已结束的会话）不续期，其余按空闲超时续期
+        session.ttl = row[2]
+        session.version = row[3]
+        if session.ttl is None:
+            db.execute(
+                "UPDATE sessions SET updated_at = ?, expires_at = ? WHERE session_id = ?",
+                (now, now + self.idle_ttl, session_id)
+            )
+        return session
+
+    def put(self, session: ClarificationSession, ttl: float = None):
+        """写回会话；读取后已被其他请求写回过时不写入并返回 False"""
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.idle_ttl)
+        data = json.dumps(session.to_dict(), ensure_ascii=False)
+        db = self._connection()
+        if session.version is None:
+            # 新会话：同一 session_id 重新开始时覆盖旧会话
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, ttl, updated_at, expires_at, version) "
+                "VALUES (?, ?, ?, ?, ?, 1)",
+                (session.session_id, data, ttl, now, expires_at)
+            )
+            version = 1
+            # 与进程内存储一致，写入新会话时就按数量上限淘汰最久未更新的会话
+            self._evicted += self._trim(db)
+        else:
+            # 读取后被清理的会话照常写回；仍存在时只有版本未变才写入
+            written = db.execute(
+                "INSERT INTO sessions (session_id, data, ttl, updated_at, expires_at, version) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, ttl = excluded.ttl, "
+                "updated_at = excluded.updated_at, expires_at = excluded.expires_at, version = excluded.version "
+                "WHERE sessions.version = ?",
+                (session.session_id, data, ttl, now, expires_at, session.version + 1, session.version)
+            ).rowcount
+            if not written:
+                return False
+            version = session.version + 1
+        session.ttl = ttl
+        session.version = version
+        if self.sweep_interval > 0 and now - self._last_sweep > self.sweep_interval:
+            self.sweep()
+        return True
+
+    async def aget(self, session_id: str):
+        # SQLite 的读写在等待其他进程的写锁时最多阻塞 timeout 秒，不能在事件循环上执行
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def aput(self, session: ClarificationSession, ttl: float = None):
+        return await asyncio.to_thread(self.put, session, ttl)
+
+    def pop(self, session_id: str):
+        """移除会话"""
+        session = self.get(session_id)
+        if session is not None:
+            self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return session
+
+    def __contains__(self, session_id: str):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def sweep(self):
+        """清理过期会话并按最近更新时间裁剪到数量上限，返回过期清理数量"""
+        now = time.time()
+        self._last_sweep = now
+        db = self._connection()
+        expired = db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+        self._expired += expired
+        self._evicted += self._trim(db)
+        return expired
+
+    def stats(self):
+        """返回存活会话数，以及本进程执行的淘汰和过期清理数"""
+        return {
+            'live': len(self),
+            'evicted': self._evicted,
+            'expired': self._expired
+        }
+
+    def _trim(self, db: sqlite3.Connection):
+        """按最近更新时间裁剪到数量上限，返回淘汰数量"""
+        return db.execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            "SELECT session_id FROM sessions ORDER BY updated_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _connection(self):
+        # sqlite3 连接不能跨线程共享，每个线程各自持有一个连接
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+
+def create_session_store():
+    """按配置创建会话后端"""
+    if Config.SESSION_BACKEND == "sqlite":
+        return SQLiteSessionBackend(
+            Config.SESSION_DB_PATH,
+            max_entries=Config.SESSION_MAX_ENTRIES,
+            idle_ttl=Config.SESSION_IDLE_TTL,
+            sweep_interval=Config.SESSION_SWEEP_INTERVAL
+        )
+
+    return SessionStore(
+        max_entries=Config.SESSION_MAX_ENTRIES,
+        idle_ttl=Config.SESSION_IDLE_TTL,
+        sweep_interval=Config.SESSION_SWEEP_INTERVAL
+    )
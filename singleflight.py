@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """合并相同键的并发调用：同一时刻只有一个调用真正执行，其余调用等待并共享结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key: str, fn):
+        """同步调用；fn 抛出的异常会传递给所有等待者"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    async def ado(self, key: str, coro_fn):
+        """异步调用；发起者被取消时不影响其他等待者"""
+        future = self._async_calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coro_fn())
+            self._async_calls[key] = future
+            future.add_done_callback(lambda _: self._async_calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def in_flight(self):
+        """当前正在执行的调用数"""
+        return len(self._calls) + len(self._async_calls)
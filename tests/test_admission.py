@@ -0,0 +1,26 @@
+import unittest
+from unittest import mock
+import admission
+from config import Config
+
+
+class AdmissionConfigTest(unittest.TestCase):
+    def controller(self, max_concurrency: int, pool_size: int):
+        with mock.patch.object(Config, 'UPSTREAM_MAX_CONCURRENCY', max_concurrency), \
+                mock.patch.object(Config, 'LLM_POOL_SIZE', pool_size), \
+                mock.patch.object(admission, '_admission_controller', None):
+            return admission.get_admission_controller()
+
+    def test_default_matches_pool_size(self):
+        self.assertEqual(Config.UPSTREAM_MAX_CONCURRENCY, Config.LLM_POOL_SIZE)
+
+    def test_limit_capped_at_pool_size(self):
+        self.assertEqual(self.controller(32, 20).max_concurrency, 20)
+        self.assertEqual(self.controller(8, 20).max_concurrency, 8)
+
+    def test_disabled(self):
+        self.assertIsNone(self.controller(0, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+from starlette.testclient import TestClient
+import api_service
+import asgi_service
+from admission import UpstreamOverloaded
+from hedging import DeadlineExceeded
+
+
+class _FailingService:
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def start_clarification(self, session_id: str, query: str):
+        raise self.error
+
+    async def astart_clarification(self, session_id: str, query: str):
+        raise self.error
+
+
+class ErrorStatusTest(unittest.TestCase):
+    payload = {'session_id': 's1', 'query': '糖尿病可以吃炸鸡吗'}
+
+    def post(self, error: Exception):
+        service = _FailingService(error)
+        with mock.patch.object(api_service, 'get_clarifier_service', return_value=service), \
+                mock.patch.object(asgi_service, 'get_clarifier_service', return_value=service):
+            flask_response = api_service.app.test_client().post('/clarify/start', json=self.payload)
+            asgi_response = TestClient(asgi_service.app).post('/clarify/start', json=self.payload)
+        return flask_response, asgi_response
+
+    def test_deadline_exceeded_is_504(self):
+        for response in self.post(DeadlineExceeded("ClassifierChain 调用超过截止时间")):
+            self.assertEqual(response.status_code, 504)
+
+    def test_overloaded_is_503(self):
+        for response in self.post(UpstreamOverloaded(3)):
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '3')
+
+    def test_other_errors_are_500(self):
+        for response in self.post(RuntimeError("boom")):
+            self.assertEqual(response.status_code, 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
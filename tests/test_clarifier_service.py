@@ -0,0 +1,121 @@
+import builtins
+import threading
+import time
+import unittest
+from unittest import mock
+from langchain_core.outputs import Generation
+import clarifier_service
+from clarifier_service import ClarifierService
+from config import Config
+from models import ClassifyAndAsk
+from output_repair import RepairingJsonOutputParser
+
+
+class _FusedChain:
+    """按真实解析器解析固定的模型输出"""
+
+    def __init__(self, text: str):
+        self.parser = RepairingJsonOutputParser(pydantic_object=ClassifyAndAsk, chain_name="test")
+        self.text = text
+
+    def invoke(self, query: str, strategy: str):
+        return self.parser.parse_result([Generation(text=self.text)])
+
+
+class FusedRoundTest(unittest.TestCase):
+    def setUp(self):
+        self.service = ClarifierService()
+
+    def run_fused(self, text: str):
+        chain = _FusedChain(text)
+        question_generator = mock.Mock()
+        question_generator.invoke.return_value = {'question': '您是几型糖尿病？'}
+        with mock.patch.object(ClarifierService, 'classify_and_ask', new_callable=mock.PropertyMock,
+                               return_value=chain), \
+                mock.patch.object(ClarifierService, 'question_generator', new_callable=mock.PropertyMock,
+                                  return_value=question_generator):
+            return self.service._run_round_fused("糖尿病可以吃炸鸡吗", [], 1), question_generator
+
+    def test_simple_without_question(self):
+        (classification, strategy, question), question_generator = self.run_fused(
+            '{"classification": "SIMPLE", "reason": "问题明确", "confidence": 0.9}')
+        self.assertEqual(classification['classification'], "SIMPLE")
+        self.assertIsNone(question)
+        question_generator.invoke.assert_not_called()
+
+    def test_missing_question_falls_back_to_question_chain(self):
+        (classification, strategy, question), question_generator = self.run_fused(
+            '{"classification": "VAGUE", "reason": "缺少糖尿病类型"}')
+        self.assertEqual(classification['classification'], "VAGUE")
+        self.assertEqual(question, "您是几型糖尿病？")
+        question_generator.invoke.assert_called_once()
+
+    def test_question_from_fused_output(self):
+        (_, _, question), question_generator = self.run_fused(
+            '{"classification": "VAGUE", "reason": "缺少糖尿病类型", "question": "您是一型还是二型？"}')
+        self.assertEqual(question, "您是一型还是二型？")
+        question_generator.invoke.assert_not_called()
+
+
+
+class SpeculativeRoundTest(unittest.TestCase):
+    vague = {'classification': 'VAGUE', 'reason': '缺少糖尿病类型', 'confidence': 0.5}
+
+    def setUp(self):
+        self.service = ClarifierService()
+        self.service.pre_classifier = None
+        self.calls = []
+        classifier = mock.Mock()
+        classifier.invoke.side_effect = lambda query: self.record("classify", self.vague)
+        question_generator = mock.Mock()
+        question_generator.invoke.side_effect = lambda query, reason: self.record("question", {'question': '几型？'})
+        for name, chain in (('classifier', classifier), ('question_generator', question_generator)):
+            patcher = mock.patch.object(ClarifierService, name, new_callable=mock.PropertyMock, return_value=chain)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(Config, 'ROUND_MODE', 'speculative')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, name: str, result: dict):
+        self.calls.append((name, threading.get_ident()))
+        time.sleep(0.01)
+        return result
+
+    def test_speculative_round_releases_slot(self):
+        slots = threading.BoundedSemaphore(1)
+        with mock.patch.object(clarifier_service, '_speculation_slots', slots):
+            for _ in range(3):
+                _, _, question = self.service._run_round("糖尿病可以吃炸鸡吗", [], 1)
+                self.assertEqual(question, '几型？')
+        # 追问在线程池中执行，三轮都走了推测执行
+        self.assertEqual(sum(1 for name, thread in self.calls if thread != threading.get_ident()), 3)
+
+    def test_saturated_pool_falls_back_to_sequential(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(clarifier_service, '_speculation_slots', slots), \
+                mock.patch.object(clarifier_service._speculation_executor, 'submit') as submit:
+            _, strategy, question = self.service._run_round("糖尿病可以吃炸鸡吗", [], 1)
+        submit.assert_not_called()
+        self.assertEqual(question, '几型？')
+        self.assertEqual([name for name, _ in self.calls], ['classify', 'question'])
+
+
+class ConsoleFlowTest(unittest.TestCase):
+    def test_progress_lines(self):
+        service = ClarifierService()
+        asked = ({'classification': 'VAGUE', 'reason': '缺少信息'}, 'understand_intent', '您是几型糖尿病？')
+        answers = iter(["二型", ""])
+        with mock.patch.object(service, '_run_round', return_value=asked), \
+                mock.patch.object(service, '_build_comprehensive_final_query', return_value="最终问题"), \
+                mock.patch.object(builtins, 'input', lambda _: next(answers)), \
+                mock.patch.object(builtins, 'print') as printed:
+            service.run_clarifier_flow("糖尿病可以吃炸鸡吗")
+        lines = [call.args[0] for call in printed.call_args_list if call.args]
+        self.assertIn("正在生成追问...", lines)
+        self.assertEqual(lines[lines.index("正在生成追问...") + 1], "追问: 您是几型糖尿病？")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+import unittest
+from admission import AdmissionController
+from hedging import DeadlineExceeded, ahedged_call, call_deadline, hedged_call, request_deadline
+
+
+def _in_flight(admission: AdmissionController):
+    return admission.stats()['in_flight']
+
+
+class AsyncHedgedCallTest(unittest.TestCase):
+    def setUp(self):
+        self.admission = AdmissionController(max_concurrency=4)
+
+    def primary(self, delay: float, result="primary", error: Exception = None):
+        async def attempt():
+            async with self.admission.aslot():
+                await asyncio.sleep(delay)
+                if error is not None:
+                    raise error
+                return result
+        return attempt
+
+    @staticmethod
+    def hedge(delay: float, result="hedge"):
+        async def attempt():
+            await asyncio.sleep(delay)
+            return result
+        return attempt
+
+    def run_call(self, coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                # 让被取消的任务执行完清理
+                await asyncio.sleep(0.05)
+        return asyncio.run(main())
+
+    def test_hedge_wins(self):
+        result = self.run_call(ahedged_call(
+            "test", self.primary(0.3), self.hedge(0.01), hedge_delay=0.02, admission=self.admission))
+        self.assertEqual(result, "hedge")
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_primary_error_falls_back_to_hedge(self):
+        result = self.run_call(ahedged_call(
+            "test", self.primary(0.05, error=RuntimeError("boom")), self.hedge(0.05),
+            hedge_delay=0.01, admission=self.admission))
+        self.assertEqual(result, "hedge")
+
+    def test_deadline_during_hedge_releases_slots(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.run_call(ahedged_call(
+                "test", self.primary(1.0), self.hedge(1.0), hedge_delay=0.01,
+                deadline=time.monotonic() + 0.05, admission=self.admission))
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_deadline_at_hedge_time_releases_slots(self):
+        # 对冲时刻与截止时间重合：对冲任务创建后还没开始执行就被取消
+        for _ in range(20):
+            with self.assertRaises(DeadlineExceeded):
+                self.run_call(ahedged_call(
+                    "test", self.primary(0.5), self.hedge(0.5), hedge_delay=0.0,
+                    deadline=time.monotonic() + 0.002, admission=self.admission))
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_no_hedge_after_deadline(self):
+        launched = []
+
+        async def hedge():
+            launched.append(True)
+            return "hedge"
+
+        with self.assertRaises(DeadlineExceeded):
+            self.run_call(ahedged_call(
+                "test", self.primary(0.2), hedge, hedge_delay=0.05,
+                deadline=time.monotonic() + 0.01, admission=self.admission))
+        self.assertEqual(launched, [])
+
+    def test_cancelled_caller_releases_slots(self):
+        async def main():
+            task = asyncio.ensure_future(ahedged_call(
+                "test", self.primary(1.0), self.hedge(1.0), hedge_delay=0.01, admission=self.admission))
+            await asyncio.sleep(0.05)
+            self.assertEqual(_in_flight(self.admission), 2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.01)
+
+        asyncio.run(main())
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_hedge_skipped_without_free_slot(self):
+        admission = AdmissionController(max_concurrency=1)
+        launched = []
+
+        async def primary():
+            async with admission.aslot():
+                await asyncio.sleep(0.05)
+                return "primary"
+
+        async def hedge():
+            launched.append(True)
+            return "hedge"
+
+        result = self.run_call(ahedged_call("test", primary, hedge, hedge_delay=0.01, admission=admission))
+        self.assertEqual(result, "primary")
+        self.assertEqual(launched, [])
+        self.assertEqual(_in_flight(admission), 0)
+
+
+class SyncHedgedCallTest(unittest.TestCase):
+    def setUp(self):
+        self.admission = AdmissionController(max_concurrency=4)
+
+    def primary(self, delay: float, result="primary", error: Exception = None, threads: list = None):
+        def attempt():
+            if threads is not None:
+                threads.append(threading.get_ident())
+            with self.admission.slot():
+                time.sleep(delay)
+                if error is not None:
+                    raise error
+                return result
+        return attempt
+
+    def test_primary_wins(self):
+        result = hedged_call("test", self.primary(0.01), lambda: "hedge",
+                             hedge_delay=1.0, admission=self.admission)
+        self.assertEqual(result, "primary")
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_hedge_wins(self):
+        def hedge():
+            time.sleep(0.05)
+            return "hedge"
+
+        started = time.monotonic()
+        result = hedged_call("test", self.primary(1.0), hedge, hedge_delay=0.02, admission=self.admission)
+        self.assertEqual(result, "hedge")
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_deadline_during_slow_primary(self):
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            hedged_call("test", self.primary(1.0), lambda: time.sleep(1.0), hedge_delay=0.05,
+                        deadline=time.monotonic() + 0.3, admission=self.admission)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_call_inherits_context(self):
+        seen = []
+
+        def attempt():
+            seen.append(call_deadline())
+            return "primary"
+
+        with request_deadline(10):
+            expected = call_deadline()
+            self.assertEqual(hedged_call("test", attempt, attempt, deadline=expected), "primary")
+        self.assertEqual(seen, [expected])
+
+    def test_primary_error_falls_back_to_hedge(self):
+        result = hedged_call("test", self.primary(0.1, error=RuntimeError("boom")), lambda: "hedge",
+                             hedge_delay=0.01, admission=self.admission)
+        self.assertEqual(result, "hedge")
+
+    def test_primary_error_before_hedge(self):
+        launched = []
+        with self.assertRaises(RuntimeError):
+            hedged_call("test", self.primary(0.0, error=RuntimeError("boom")), lambda: launched.append(True),
+                        hedge_delay=0.5, admission=self.admission)
+        time.sleep(0.05)
+        self.assertEqual(launched, [])
+
+    def test_deadline_during_hedge_releases_slots(self):
+        def hedge():
+            time.sleep(0.2)
+            return "hedge"
+
+        with self.assertRaises(DeadlineExceeded):
+            hedged_call("test", self.primary(0.05, error=RuntimeError("boom")), hedge, hedge_delay=0.01,
+                        deadline=time.monotonic() + 0.1, admission=self.admission)
+        time.sleep(0.2)
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_no_call_after_deadline(self):
+        with self.assertRaises(DeadlineExceeded):
+            hedged_call("test", self.primary(0.0), lambda: "hedge", hedge_delay=0.01,
+                        deadline=time.monotonic() - 1, admission=self.admission)
+        self.assertEqual(_in_flight(self.admission), 0)
+
+    def test_no_hedge_after_deadline(self):
+        launched = []
+        with self.assertRaises(DeadlineExceeded):
+            hedged_call("test", self.primary(0.1), lambda: launched.append(True), hedge_delay=0.05,
+                        deadline=time.monotonic() + 0.01, admission=self.admission)
+        # 不再等待的主请求在后台执行完并归还名额
+        time.sleep(0.2)
+        self.assertEqual(launched, [])
+        self.assertEqual(_in_flight(self.admission), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.outputs import Generation
+from models import ClassifyAndAsk, QuestionGenerator
+from output_repair import RepairingJsonOutputParser, repair_json
+
+TRUNCATED = '{"question": "您是在哪个城市？", "reason": "需要地点'
+
+
+class RepairJsonTest(unittest.TestCase):
+    def test_valid_json(self):
+        self.assertEqual(repair_json('{"a": 1, "b": "x"}'), {"a": 1, "b": "x"})
+
+    def test_code_fence_and_surrounding_text(self):
+        self.assertEqual(repair_json('好的，结果如下：\n```json\n{"a": 1}\n```\n希望有帮助'), {"a": 1})
+        self.assertEqual(repair_json('结果：{"a": 1} 以上'), {"a": 1})
+
+    def test_quotes(self):
+        self.assertEqual(repair_json("{'question': '您多大年龄？'}"), {"question": "您多大年龄？"})
+        self.assertEqual(repair_json('{“question”: “您多大年龄？”}'), {"question": "您多大年龄？"})
+        self.assertEqual(repair_json("{'reason': '用户说\"随便\"'}"), {"reason": '用户说"随便"'})
+
+    def test_unquoted_keys_and_values(self):
+        self.assertEqual(repair_json('{classification: VAGUE, confidence: 0.9}'),
+                         {"classification": "VAGUE", "confidence": 0.9})
+
+    def test_trailing_commas_and_python_literals(self):
+        self.assertEqual(repair_json('{"a": [1, 2,], "b": True, "c": None,}'), {"a": [1, 2], "b": True, "c": None})
+
+    def test_no_object(self):
+        with self.assertRaises(ValueError):
+            repair_json("抱歉，我无法回答")
+
+    def test_truncated_rejected(self):
+        for text in (TRUNCATED, '{"question": "您是在哪个城市？", "reason":', '{"a": [1, 2', '{"a": {"b": 1}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    repair_json(text)
+
+    def test_truncated_completed_when_partial(self):
+        self.assertEqual(repair_json(TRUNCATED, partial=True), {"question": "您是在哪个城市？", "reason": "需要地点"})
+        self.assertEqual(repair_json('{"question": "您', partial=True), {"question": "您"})
+        self.assertEqual(repair_json('{"a": 1, "b":', partial=True), {"a": 1, "b": None})
+
+
+class RepairingJsonOutputParserTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = RepairingJsonOutputParser(pydantic_object=QuestionGenerator, chain_name="test")
+
+    def parse(self, text: str, partial: bool = False):
+        return self.parser.parse_result([Generation(text=text)], partial=partial)
+
+    def test_repaired_final_result(self):
+        self.assertEqual(self.parse("```json\n{'question': '您是在哪个城市？',}\n```"), {"question": "您是在哪个城市？"})
+
+    def test_truncated_final_result_fails(self):
+        for text in (TRUNCATED, '{"question": "您是在哪个'):
+            with self.subTest(text=text):
+                with self.assertRaises(OutputParserException):
+                    self.parse(text)
+
+    def test_truncated_partial_result(self):
+        self.assertEqual(self.parse(TRUNCATED, partial=True), {"question": "您是在哪个城市？", "reason": "需要地点"})
+
+    def test_invalid_final_result(self):
+        with self.assertRaises(OutputParserException):
+            self.parse('{"reason": "缺少追问"}')
+
+    def test_fused_result_without_question(self):
+        parser = RepairingJsonOutputParser(pydantic_object=ClassifyAndAsk, chain_name="test")
+        result = parser.parse_result([Generation(text='{"classification": "SIMPLE", "reason": "问题明确"}')])
+        self.assertEqual((result['classification'], result['question']), ("SIMPLE", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from pre_classifier import PreClassifier
+
+
+class PreClassifierRulesTest(unittest.TestCase):
+    def setUp(self):
+        self.classifier = PreClassifier()
+
+    def test_unknown_location(self):
+        for query in ("这附近哪家医院好", "我家附近有什么药店", "附近有没有24小时药房", "离我最近的医院在哪里"):
+            with self.subTest(query=query):
+                result = self.classifier.classify(query)
+                self.assertIsNotNone(result)
+                self.assertEqual(result['classification'], 'VAGUE')
+
+    def test_deictic_words_without_location_question(self):
+        for query in (
+                "我这个月体检发现血糖高，有哪些饮食推荐",
+                "这里面有哪些成分对糖尿病有害",
+                "身边的朋友推荐什么降压药",
+                "这边的医生说我血压偏高，需要吃药吗",
+                "我这种情况推荐去哪个科室",
+                "附近的人都说喝醋能降血脂，有道理吗"):
+            with self.subTest(query=query):
+                self.assertIsNone(self.classifier.classify(query))
+
+    def test_filler_and_dangling_reference(self):
+        self.assertEqual(self.classifier.classify("怎么办啊？")['classification'], 'VAGUE')
+        self.assertEqual(self.classifier.classify("这个能吃吗")['classification'], 'VAGUE')
+        self.assertIsNone(self.classifier.classify("二甲双胍饭前吃还是饭后吃"))
+
+
+if __name__ == "__main__":
+    unittest.main()
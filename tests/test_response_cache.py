@@ -0,0 +1,91 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.db")
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        self.tmpdir.cleanup()
+
+    def make_cache(self, **kwargs):
+        cache = ResponseCache(sqlite_path=self.path, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_memory_only(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get("k"))
+        cache.set("k", {"a": 1})
+        self.assertEqual(cache.get("k"), {"a": 1})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_write_behind_persists(self):
+        cache = self.make_cache()
+        cache.set("k", {"a": 1})
+        cache.flush()
+        other = self.make_cache()
+        self.assertEqual(other.get("k"), {"a": 1})
+        self.assertEqual(other.stats()['sqlite_hits'], 1)
+
+    def test_aget_reads_persistent_tier_off_the_event_loop(self):
+        writer = self.make_cache()
+        writer.set("k", {"a": 1})
+        writer.flush()
+        cache = self.make_cache()
+        threads = []
+        load = cache._load_persistent
+
+        def record_thread(key):
+            threads.append(threading.get_ident())
+            return load(key)
+
+        cache._load_persistent = record_thread
+
+        async def main():
+            return await cache.aget("k"), threading.get_ident()
+
+        value, loop_thread = asyncio.run(main())
+        self.assertEqual(value, {"a": 1})
+        self.assertNotIn(loop_thread, threads)
+        # 命中后放入内存层，再次读取不再访问持久层
+        self.assertEqual(asyncio.run(cache.aget("k")), {"a": 1})
+        self.assertEqual(len(threads), 1)
+
+    def test_expired_entry(self):
+        cache = self.make_cache(ttl=-1)
+        cache.set("k", {"a": 1})
+        cache.flush()
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_clear(self):
+        cache = self.make_cache()
+        cache.set("k", {"a": 1})
+        cache.clear()
+        self.assertIsNone(cache.get("k"))
+        self.assertIsNone(self.make_cache().get("k"))
+
+    def test_full_write_queue_drops_writes(self):
+        cache = self.make_cache(write_queue_size=1)
+        with cache._db_lock:
+            # 持久层被占用时写入线程阻塞，队列很快填满
+            for i in range(10):
+                cache.set(f"k{i}", {"i": i})
+            self.assertGreater(cache.stats()['dropped_writes'], 0)
+        cache.flush()
+        self.assertEqual(cache.get("k9"), {"i": 9})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from clarifier_service import ClarifierService
+from semantic_cache import SemanticCache, critical_tokens
+from session_store import ConversationTurn
+
+
+# 远低于默认阈值（shingle 哈希每个进程不同，估计值有波动），确保下面的改写单靠字符相似度都会命中，拒绝命中的是关键内容检查
+THRESHOLD = 0.4
+
+
+class SemanticCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticCache(threshold=THRESHOLD)
+
+    def assert_not_reused(self, stored: str, query: str):
+        lsh = self.cache.lsh
+        self.assertGreaterEqual(lsh.similarity(lsh.signature(stored), lsh.signature(query)), THRESHOLD)
+        self.cache.set(stored, "stored")
+        self.assertIsNone(self.cache.get(query))
+
+    def test_near_duplicate_hit(self):
+        self.cache.set("孩子发烧三天了怎么办\n体温最高烧到了三十九度，精神还可以，吃饭正常", "stored")
+        self.assertEqual(self.cache.get("孩子发烧三天了怎么办？\n体温最高烧到了三十九度,精神还可以,吃饭正常"), "stored")
+
+    def test_negation_convulsion(self):
+        self.assert_not_reused(
+            "孩子发烧三天了怎么办\n体温最高烧到三十九度，没有抽搐，精神还可以，吃饭正常",
+            "孩子发烧三天了怎么办\n体温最高烧到三十九度，有抽搐，精神还可以，吃饭正常")
+
+    def test_negation_renal_insufficiency(self):
+        self.assert_not_reused(
+            "糖尿病患者可以吃二甲双胍吗\n我六十五岁，没有肾功能不全，血糖控制一般",
+            "糖尿病患者可以吃二甲双胍吗\n我六十五岁，有肾功能不全，血糖控制一般")
+
+    def test_negation_words(self):
+        for negated, plain in (("不过敏", "过敏"), ("无高血压", "有高血压"), ("未怀孕", "已怀孕")):
+            with self.subTest(negated=negated):
+                self.cache = SemanticCache(threshold=THRESHOLD)
+                self.assert_not_reused(
+                    f"感冒了可以吃布洛芬吗\n成年人，{negated}，平时身体健康，想尽快退烧",
+                    f"感冒了可以吃布洛芬吗\n成年人，{plain}，平时身体健康，想尽快退烧")
+
+    def test_numbers_and_units(self):
+        self.assert_not_reused(
+            "降压药怎么吃\n医生开的氨氯地平每天5毫克，血压还是偏高，想问问要不要加量",
+            "降压药怎么吃\n医生开的氨氯地平每天10毫克，血压还是偏高，想问问要不要加量")
+        self.assert_not_reused(
+            "孩子能吃这个药吗\n孩子3岁，体重15公斤，最近一直咳嗽，晚上咳得厉害",
+            "孩子能吃这个药吗\n孩子3个月，体重15公斤，最近一直咳嗽，晚上咳得厉害")
+
+    def test_answers_compared_round_by_round(self):
+        self.assertNotEqual(critical_tokens("头痛怎么办\n没有发烧\n有呕吐"), critical_tokens("头痛怎么办\n有发烧\n没有呕吐"))
+
+    def test_scope_must_match_exactly(self):
+        answers = "想找看糖尿病比较好的医院\n二型糖尿病，预算一万以内"
+        self.cache.set(answers, "stored", scope="去香港哪家医院看病好")
+        self.assertEqual(self.cache.get(answers, scope=" 去香港哪家医院看病好 "), "stored")
+        self.assertIsNone(self.cache.get(answers, scope="去澳门哪家医院看病好"))
+        self.assertIsNone(self.cache.get(answers))
+
+
+class SimilarFinalQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.service = ClarifierService()
+        self.service.semantic_cache = SemanticCache(threshold=THRESHOLD)
+        self.history = [
+            ConversationTurn(1, "understand_intent", "您想了解哪方面？", "想找看糖尿病比较好的医院"),
+            ConversationTurn(2, "gather_context", "您的病情和预算？", "二型糖尿病，预算一万以内"),
+        ]
+        self.service._store_similar_final_query("去香港哪家医院看病好", self.history, "香港的最终问题")
+
+    def test_near_duplicate_answers_hit(self):
+        history = [
+            ConversationTurn(1, "understand_intent", "请问您想了解什么？", "想找看糖尿病比较好的医院。"),
+            ConversationTurn(2, "gather_context", "请问您的情况？", "二型糖尿病,预算一万以内"),
+        ]
+        self.assertEqual(self.service._lookup_similar_final_query("去香港哪家医院看病好", history), "香港的最终问题")
+
+    def test_changed_place_misses(self):
+        # 三行的比较文本中只改一个地名，字符相似度仍远高于阈值
+        lsh = self.service.semantic_cache.lsh
+        self.assertGreaterEqual(lsh.similarity(
+            lsh.signature("去香港哪家医院看病好\n想找看糖尿病比较好的医院\n二型糖尿病，预算一万以内"),
+            lsh.signature("去澳门哪家医院看病好\n想找看糖尿病比较好的医院\n二型糖尿病，预算一万以内")), THRESHOLD)
+        self.assertIsNone(self.service._lookup_similar_final_query("去澳门哪家医院看病好", self.history))
+
+    def test_changed_entity_misses(self):
+        self.service._store_similar_final_query("糖尿病可以吃二甲双胍吗", self.history, "二甲双胍的最终问题")
+        self.assertIsNone(self.service._lookup_similar_final_query("糖尿病可以吃格列美脲吗", self.history))
+
+
+if __name__ == "__main__":
+    unittest.main()
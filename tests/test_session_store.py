@@ -0,0 +1,196 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from admission import UpstreamOverloaded
+from api_service import APIClarifierService
+from session_store import ClarificationSession, ConversationTurn, SessionStore, SQLiteSessionBackend
+
+
+class SQLiteSessionBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "sessions.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def backend(self, **kwargs):
+        backend = SQLiteSessionBackend(self.path, sweep_interval=0, **kwargs)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_round_trip(self):
+        backend = self.backend()
+        session = ClarificationSession("s1", "糖尿病可以吃炸鸡吗")
+        self.assertTrue(backend.put(session))
+        session = backend.get("s1")
+        session.current_round = 1
+        session.conversation_history.append(ConversationTurn(1, "fallback", "您是几型糖尿病？"))
+        self.assertTrue(backend.put(session))
+
+        restored = backend.get("s1")
+        self.assertEqual(restored.to_dict(), session.to_dict())
+        self.assertEqual(restored.version, 2)
+
+    def test_max_entries_enforced_on_put(self):
+        backend = self.backend(max_entries=3)
+        for i in range(5):
+            backend.put(ClarificationSession(f"s{i}", "问题"))
+        self.assertEqual(len(backend), 3)
+        self.assertIsNone(backend.get("s0"))
+        self.assertIsNotNone(backend.get("s4"))
+        self.assertEqual(backend.stats()['evicted'], 2)
+
+    def test_concurrent_writers_do_not_overwrite(self):
+        # 两个工作进程读到同一版本，只有先写回的生效
+        backend = self.backend()
+        backend.put(ClarificationSession("s1", "问题"))
+        first = backend.get("s1")
+        second = self.backend().get("s1")
+
+        first.conversation_history.append(ConversationTurn(1, "fallback", "第一个请求的追问"))
+        second.conversation_history.append(ConversationTurn(1, "fallback", "第二个请求的追问"))
+        self.assertTrue(backend.put(first))
+        self.assertFalse(backend.put(second))
+
+        restored = backend.get("s1")
+        self.assertEqual([turn.question for turn in restored.conversation_history], ["第一个请求的追问"])
+        # 重新读取最新版本后可以写回
+        restored.status = "completed"
+        self.assertTrue(backend.put(restored, ttl=60))
+        self.assertEqual(backend.get("s1").status, "completed")
+
+    def test_put_after_expiry_recreates_row(self):
+        backend = self.backend()
+        backend.put(ClarificationSession("s1", "问题"))
+        session = backend.get("s1")
+        backend.pop("s1")
+        self.assertTrue(backend.put(session))
+        self.assertIsNotNone(backend.get("s1"))
+
+    def test_restart_replaces_session(self):
+        backend = self.backend()
+        backend.put(ClarificationSession("s1", "旧问题"))
+        backend.get("s1")
+        self.assertTrue(backend.put(ClarificationSession("s1", "新问题")))
+        self.assertEqual(backend.get("s1").original_query, "新问题")
+
+    def test_adds_version_column_to_existing_table(self):
+        db = sqlite3.connect(self.path)
+        db.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                   "ttl REAL, updated_at REAL NOT NULL, expires_at REAL NOT NULL)")
+        db.commit()
+        db.close()
+
+        backend = self.backend()
+        backend.put(ClarificationSession("s1", "问题"))
+        session = backend.get("s1")
+        self.assertEqual(session.version, 1)
+        self.assertTrue(backend.put(session))
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_max_entries_enforced_on_put(self):
+        store = SessionStore(max_entries=3, sweep_interval=0)
+        for i in range(5):
+            self.assertTrue(store.put(ClarificationSession(f"s{i}", "问题")))
+        self.assertEqual(len(store), 3)
+        self.assertNotIn("s0", store)
+        self.assertEqual(store.stats()['evicted'], 2)
+
+    def test_get_returns_copy(self):
+        store = SessionStore(sweep_interval=0)
+        store.put(ClarificationSession("s1", "问题"))
+        session = store.get("s1")
+        session.current_round += 1
+        session.conversation_history.append(ConversationTurn(1, "fallback", "追问"))
+        self.assertEqual(store.get("s1").current_round, 0)
+        self.assertEqual(store.get("s1").conversation_history, [])
+
+        # 写回后原对象再修改也不影响已存储的会话
+        self.assertTrue(store.put(session))
+        session.conversation_history[0].user_answer = "回答"
+        self.assertIsNone(store.get("s1").conversation_history[0].user_answer)
+
+    def test_concurrent_writers_do_not_overwrite(self):
+        store = SessionStore(sweep_interval=0)
+        store.put(ClarificationSession("s1", "问题"))
+        first, second = store.get("s1"), store.get("s1")
+        first.conversation_history.append(ConversationTurn(1, "fallback", "第一个请求的追问"))
+        second.conversation_history.append(ConversationTurn(1, "fallback", "第二个请求的追问"))
+        self.assertTrue(store.put(first))
+        self.assertFalse(store.put(second))
+        self.assertEqual([turn.question for turn in store.get("s1").conversation_history], ["第一个请求的追问"])
+
+
+class FailedRoundTest(unittest.TestCase):
+    """一轮处理失败（如上游满载返回 503）时，已存储的会话保持不变，客户端可以原样重试"""
+
+    def setUp(self):
+        self.service = APIClarifierService()
+        self.service.active_sessions = SessionStore(sweep_interval=0)
+
+    def run_round(self, *outcomes):
+        return mock.patch.object(self.service.clarifier, '_run_round', side_effect=list(outcomes))
+
+    def test_failed_rounds_leave_session_unchanged(self):
+        asked = ({'classification': 'VAGUE', 'reason': '缺少信息'}, 'fallback', '您是几型糖尿病？')
+        with self.run_round(asked):
+            self.service.start_clarification("s1", "糖尿病可以吃炸鸡吗")
+        before = self.service.active_sessions.get("s1").to_dict()
+
+        with self.run_round(*[UpstreamOverloaded(1)] * 4):
+            for _ in range(4):
+                with self.assertRaises(UpstreamOverloaded):
+                    self.service.continue_clarification("s1", "二型")
+        self.assertEqual(self.service.active_sessions.get("s1").to_dict(), before)
+
+        with self.run_round(asked):
+            result = self.service.continue_clarification("s1", "二型")
+        self.assertEqual((result['status'], result['round']), ('waiting_answer', 2))
+
+
+
+class _RecordingSQLiteBackend(SQLiteSessionBackend):
+    """记录每次读写所在的线程"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = []
+
+    def get(self, session_id: str):
+        self.threads.append(threading.get_ident())
+        return super().get(session_id)
+
+    def put(self, session: ClarificationSession, ttl: float = None):
+        self.threads.append(threading.get_ident())
+        return super().put(session, ttl)
+
+
+class AsyncSessionAccessTest(unittest.TestCase):
+    def test_sqlite_access_runs_off_event_loop(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        service = APIClarifierService()
+        service.active_sessions = _RecordingSQLiteBackend(os.path.join(tmpdir.name, "sessions.db"),
+                                                          sweep_interval=0)
+        asked = ({'classification': 'VAGUE', 'reason': '缺少信息'}, 'fallback', '您是几型糖尿病？')
+
+        async def main():
+            with mock.patch.object(service.clarifier, '_arun_round', side_effect=[asked, asked]):
+                await service.astart_clarification("s1", "糖尿病可以吃炸鸡吗")
+                result = await service.acontinue_clarification("s1", "二型")
+            return threading.get_ident(), result
+
+        loop_thread, result = asyncio.run(main())
+        self.assertEqual((result['status'], result['round']), ('waiting_answer', 2))
+        self.assertEqual(len(service.active_sessions.threads), 4)
+        self.assertNotIn(loop_thread, service.active_sessions.threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from response_cache import ResponseCache
+from warm_cache import WarmCache, load_queries, write_warm_cache
+
+
+def _key(i: int):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+class WarmCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "warm.bin")
+        self.entries = {_key(i): {'classification': 'VAGUE', 'reason': f'原因 {i}'} for i in range(1000)}
+        write_warm_cache(self.path, self.entries)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup(self):
+        cache = WarmCache(self.path)
+        self.assertEqual(len(cache), 1000)
+        for key, value in self.entries.items():
+            self.assertEqual(cache.get(key), value)
+        self.assertIsNone(cache.get(_key(-1)))
+        cache.close()
+
+    def test_empty_file(self):
+        write_warm_cache(self.path, {})
+        cache = WarmCache(self.path)
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get(_key(1)))
+        cache.close()
+
+    def test_truncated_file_rejected(self):
+        size = os.path.getsize(self.path)
+        for truncated_size in (size - 1, size // 2, 20):
+            with self.subTest(size=truncated_size):
+                with open(self.path, "r+b") as f:
+                    f.truncate(truncated_size)
+                with self.assertRaises(ValueError):
+                    WarmCache(self.path)
+
+    def test_bad_magic_rejected(self):
+        with open(self.path, "r+b") as f:
+            f.write(b"XXXX")
+        with self.assertRaises(ValueError):
+            WarmCache(self.path)
+
+    def test_corrupt_payload_is_a_miss(self):
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f:
+            f.seek(size - 200)
+            f.write(b"\xff" * 100)
+        cache = WarmCache(self.path)
+        results = [cache.get(key) for key in self.entries]
+        self.assertIn(None, results)
+        self.assertEqual(sum(result is not None for result in results), sum(
+            result == self.entries[key] for key, result in zip(self.entries, results)))
+        cache.close()
+
+    def test_response_cache_tier(self):
+        cache = ResponseCache(warm_path=self.path)
+        key = _key(7)
+        self.assertEqual(cache.get(key), self.entries[key])
+        self.assertIsNone(cache.get(_key(-1)))
+        stats = cache.stats()
+        self.assertEqual((stats['warm_hits'], stats['misses'], stats['warm_size']), (1, 1, 1000))
+
+    def test_load_queries(self):
+        log = os.path.join(self.tmpdir.name, "history.jsonl")
+        with open(log, "w", encoding="utf-8") as f:
+            f.write('{"query": "糖尿病可以吃炸鸡吗"}\n')
+            f.write('{"query": " 糖尿病可以吃炸鸡吗 "}\n')
+            f.write('{"kind": "start", "text": "去深圳哪家医院好"}\n')
+            f.write('{"kind": "continue", "text": "二型"}\n')
+            f.write('not json\n')
+            f.write('["list"]\n')
+        self.assertEqual(load_queries([log]), [("糖尿病可以吃炸鸡吗", 2), ("去深圳哪家医院好", 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
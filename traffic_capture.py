@@ -0,0 +1,57 @@
+import json
+import threading
+import time
+from config import Config
+
+
+class TrafficRecorder:
+    """把会话请求（问题、回答、到达时间、耗时）追加写入 JSONL，用于之后回放压测"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def record(self, kind: str, session_id: str, text: str, arrived_at: float, latency: float, result: dict):
+        """记录一次请求；arrived_at 为请求到达的墙钟时间，latency 为处理耗时（秒）"""
+        line = json.dumps({
+            'ts': round(arrived_at, 6),
+            'session_id': session_id,
+            'kind': kind,
+            'text': text,
+            'latency_ms': round(latency * 1000, 3),
+            'status': result.get('status'),
+            'round': result.get('round')
+        }, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def create_recorder():
+    """按配置创建录制器，未开启录制时返回 None"""
+    if not Config.CAPTURE_PATH:
+        return None
+    return TrafficRecorder(Config.CAPTURE_PATH)
+
+
+class CaptureTimer:
+    """记录请求到达时间并在结束时写入录制器"""
+    __slots__ = ("recorder", "kind", "session_id", "text", "arrived_at", "started")
+
+    def __init__(self, recorder: TrafficRecorder, kind: str, session_id: str, text: str):
+        self.recorder = recorder
+        self.kind = kind
+        self.session_id = session_id
+        self.text = text
+        self.arrived_at = time.time()
+        self.started = time.perf_counter()
+
+    def finish(self, result: dict):
+        if self.recorder is not None:
+            self.recorder.record(self.kind, self.session_id, self.text, self.arrived_at,
+                                 time.perf_counter() - self.started, result)
+        return result
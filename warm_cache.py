@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import struct
+import time
+from collections import Counter
+from clarifier_service import ClarifierService
+from config import Config
+from response_cache import get_response_cache, normalize_text
+
+# 文件格式：文件头 | 按键排序的定长索引 | JSON 结果
+# 索引项为 (缓存键的 SHA-256 摘要, 结果偏移, 结果长度)，查找时在映射的内存上二分，不需要加载整个文件
+MAGIC = b"CLWC"
+VERSION = 1
+_HEADER = struct.Struct("<4sHxxI")  # magic, version, 条目数
+_ENTRY = struct.Struct("<32sQI")  # 摘要, 偏移, 长度
+_DIGEST_SIZE = 32
+
+
+class WarmCache:
+    """只读的预计算缓存文件（由本模块的离线任务生成），键与 ResponseCache.make_key 相同
+
+    文件通过 mmap 映射，多个工作进程共享同一份页缓存；未命中时只读取索引中约 log2(条目数) 个键。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"预计算缓存文件 {path} 不完整")
+        magic, version, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} 不是版本 {VERSION} 的预计算缓存文件")
+
+        # 结果按索引顺序写入，最后一项的结尾就是文件应有的长度；被截断的文件拒绝加载
+        index_end = _HEADER.size + count * _ENTRY.size
+        expected = index_end
+        if count and len(self._mmap) >= index_end:
+            _, offset, length = _ENTRY.unpack_from(self._mmap, index_end - _ENTRY.size)
+            expected = offset + length
+        if len(self._mmap) < expected:
+            raise ValueError(f"预计算缓存文件 {path} 不完整：需要 {expected} 字节，实际 {len(self._mmap)} 字节")
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key: str):
+        """按缓存键查找结果，不存在或内容无法解析时返回 None"""
+        digest = bytes.fromhex(key)
+        data = self._mmap
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = _HEADER.size + mid * _ENTRY.size
+            probe = data[position:position + _DIGEST_SIZE]
+            if probe < digest:
+                lo = mid + 1
+            elif probe > digest:
+                hi = mid
+            else:
+                _, offset, length = _ENTRY.unpack_from(data, position)
+                try:
+                    return json.loads(data[offset:offset + length])
+                except ValueError:
+                    # 文件内容损坏时按未命中处理，不让缓存查找变成请求错误
+                    return None
+        return None
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_warm_cache(path: str, entries: dict):
+    """把 {缓存键: 结果} 写成预计算缓存文件；先写临时文件再替换，已映射旧文件的进程不受影响"""
+    items = sorted((bytes.fromhex(key), json.dumps(value, ensure_ascii=False).encode("utf-8"))
+                   for key, value in entries.items())
+    offset = _HEADER.size + len(items) * _ENTRY.size
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(items)))
+        for digest, payload in items:
+            f.write(_ENTRY.pack(digest, offset, len(payload)))
+            offset += len(payload)
+        for _, payload in items:
+            f.write(payload)
+    os.replace(tmp_path, path)
+    return len(items)
+
+
+def load_queries(paths: list):
+    """从历史日志（JSONL）读取首轮问题，按规范化文本去重，返回按出现次数从高到低排序的 [(问题, 次数)]
+
+    每行取 query 字段，或流量录制中 kind 为 start 的 text 字段；无法解析的行跳过。
+    """
+    counts = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                query = record.get('query')
+                if query is None and record.get('kind') == 'start':
+                    query = record.get('text')
+                if isinstance(query, str):
+                    query = normalize_text(query)
+                    if query:
+                        counts[query] += 1
+    return counts.most_common()
+
+
+async def warm_first_rounds(queries: list, concurrency: int):
+    """按服务的首轮路径（当前 ROUND_MODE）处理每个问题，结果写入进程内的响应缓存；返回失败的问题数
+
+    只产生分类和首轮追问的链调用，与线上首轮请求查找的缓存键完全相同。
+    """
+    service = ClarifierService()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(query: str):
+        async with semaphore:
+            try:
+                await service._arun_round(query, [], 1)
+            except Exception as e:
+                print(f"跳过 {query!r}: {e}")
+                return False
+            return True
+
+    results = await asyncio.gather(*(warm(query) for query in queries))
+    return results.count(False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从历史问题日志预计算首轮分类和追问，生成 WARM_CACHE_PATH 使用的缓存文件")
+    parser.add_argument("logs", nargs="+", help="历史日志（JSONL），每行含 query，或流量录制文件")
+    parser.add_argument("--output", required=True, help="输出的预计算缓存文件")
+    parser.add_argument("--limit", type=int, default=0, help="只处理出现次数最多的前 N 个问题（0 表示全部）")
+    parser.add_argument("--concurrency", type=int, default=Config.BATCH_MAX_CONCURRENCY, help="同时处理的问题数")
+    args = parser.parse_args()
+
+    queries = load_queries(args.logs)
+    if args.limit:
+        queries = queries[:args.limit]
+    print(f"去重后 {len(queries)} 个问题")
+
+    # 结果全部留在内存中，最后一次性导出；不读取已有的持久层和预计算文件，保证结果来自当前的提示和模型
+    Config.RESPONSE_CACHE_ENABLED = True
+    Config.RESPONSE_CACHE_MAX_ENTRIES = max(Config.RESPONSE_CACHE_MAX_ENTRIES, 4 * len(queries))
+    Config.RESPONSE_CACHE_TTL = float("inf")
+    Config.RESPONSE_CACHE_SQLITE_PATH = None
+    Config.WARM_CACHE_PATH = None
+
+    started = time.perf_counter()
+    failed = asyncio.run(warm_first_rounds([query for query, _ in queries], args.concurrency))
+    count = write_warm_cache(args.output, get_response_cache().snapshot())
+    print(f"完成 {len(queries) - failed} 个问题（失败 {failed} 个），耗时 {time.perf_counter() - started:.1f}s，"
+          f"写入 {count} 条结果到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()